@@ -0,0 +1,65 @@
+import pyarrow as pa
+
+# Columns with a handful of distinct values per book, stored as Arrow dictionaries while a book is built
+DICTIONARY_COLUMNS = ("segmentPath", "contentType", "chapterPath")
+
+
+class BookColumns:
+    """
+    Columnar builder for the rows of one book.
+    Values are appended to per-column lists that are flushed to Arrow every
+    `chunk_size` rows, with DICTIONARY_COLUMNS dictionary-encoded, so a book is
+    never held as a list of row dicts plus a transposed dict of lists.
+    """
+
+    def __init__(self, features, chunk_size=8192):
+        self.features = features
+        self.chunk_size = chunk_size
+        self._pending = {name: [] for name in features}
+        self._chunks = {name: [] for name in features}
+        self._num_pending = 0
+        self._num_rows = 0
+
+    def __len__(self):
+        return self._num_rows
+
+    def append(self, row):
+        for name, values in self._pending.items():
+            values.append(row[name])
+        self._num_pending += 1
+        self._num_rows += 1
+        if self._num_pending >= self.chunk_size:
+            self._flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def _flush(self):
+        if not self._num_pending:
+            return
+        for name, values in self._pending.items():
+            array = pa.array(values, type=pa.string())
+            if name in DICTIONARY_COLUMNS:
+                array = array.dictionary_encode()
+            self._chunks[name].append(array)
+            values.clear()
+        self._num_pending = 0
+
+    def columns(self):
+        """
+        Return {column name: pa.ChunkedArray} of everything appended so far, ready
+        for `Dataset.from_dict`, which decodes the dictionary columns to the plain
+        string features.
+        """
+        self._flush()
+        return {
+            name: pa.chunked_array(chunks or [pa.array([], type=pa.string())])
+            for name, chunks in self._chunks.items()
+        }
+
+    def rows(self):
+        """Yield the appended rows as dicts, for row-level post-processing."""
+        columns = self.columns()
+        for batch in pa.table(columns).to_batches():
+            yield from batch.to_pylist()
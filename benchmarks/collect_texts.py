@@ -0,0 +1,64 @@
+"""
+Time the text walkers over every node of an export: the explicit-stack
+walk_texts against the original recursive walkers (kept with the tests).
+
+    python -m benchmarks.collect_texts --export raw_data/umbraco-export.v1/umbraco-export.v1.jsonl
+"""
+import argparse
+import time
+from itertools import islice
+
+from extract_natural_language import walk_texts
+from load_textbooks import iter_jsonl
+from tests.test_extract_natural_language import (
+    reference_collect_texts,
+    reference_collect_texts_workbook_commentary,
+)
+
+
+def recursive_generic(node):
+    found = [], []
+    reference_collect_texts(node, *found)
+    return found
+
+
+def recursive_split(node):
+    found = [], [], [], []
+    reference_collect_texts_workbook_commentary(node, *found, False)
+    return found
+
+
+def best_of(walker, nodes, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for node in nodes:
+            walker(node)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export", default="raw_data/umbraco-export.v1/umbraco-export.v1.jsonl")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N export lines")
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    nodes = list(islice(iter_jsonl(args.export), args.limit))
+    print(f"{len(nodes)} export lines")
+    for name, recursive, iterative in [
+        ("generic", recursive_generic, walk_texts),
+        ("workbook/teacher", recursive_split, lambda node: walk_texts(node, True)),
+    ]:
+        recursive_time = best_of(recursive, nodes, args.repeat)
+        iterative_time = best_of(iterative, nodes, args.repeat)
+        print(f"{name:17s} recursive {recursive_time:7.3f}s  walk_texts {iterative_time:7.3f}s  "
+              f"{recursive_time / iterative_time:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Time sentence-mode segment extraction with each installed HTML backend on an
+export, and check that all backends produce the same rows as html.parser.
+
+    python -m benchmarks.html_backends --export raw_data/umbraco-export.v1/umbraco-export.v1.jsonl
+"""
+import argparse
+import time
+from itertools import islice
+
+from html_backends import available_html_backends
+from load_textbooks import extract_segment_rows, init_textbooks_list, iter_jsonl, load_textbooks_meta
+
+
+def run(lines, textbook_paths, backend):
+    start = time.perf_counter()
+    rows = [extract_segment_rows(line, textbook_paths, True, backend) for line in lines]
+    return time.perf_counter() - start, rows
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export", default="raw_data/umbraco-export.v1/umbraco-export.v1.jsonl")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N export lines")
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    textbook_paths = frozenset(init_textbooks_list(load_textbooks_meta(args.export)))
+    lines = list(islice(iter_jsonl(args.export), args.limit))
+    print(f"{len(lines)} export lines, {len(textbook_paths)} textbooks")
+
+    results = {}
+    for backend in ("html.parser",) + tuple(b for b in available_html_backends() if b != "html.parser"):
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, rows = run(lines, textbook_paths, backend)
+            timings.append(elapsed)
+        results[backend] = (min(timings), rows)
+
+    baseline, reference_rows = results["html.parser"]
+    for backend, (elapsed, rows) in results.items():
+        mismatches = sum(
+            row != reference_row
+            for segment_rows, reference_segment_rows in zip(rows, reference_rows)
+            for row, reference_row in zip(segment_rows, reference_segment_rows)
+        ) + sum(len(a) != len(b) for a, b in zip(rows, reference_rows))
+        print(f"{backend:12s} {elapsed:8.2f}s  {baseline / elapsed:5.2f}x  {mismatches} rows differ from html.parser")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+MANIFEST_NAME = "manifest.json"
+FINGERPRINTS_NAME = "export_fingerprints.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_fingerprint(path, previous=None):
+    """
+    Describe an export file by size, mtime and sha256.
+    The hash of `previous` (an earlier fingerprint) is reused when size and
+    mtime are unchanged, so a warm start does not re-read the whole export.
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in fingerprint.items()) and previous.get("sha256"):
+        fingerprint["sha256"] = previous["sha256"]
+    else:
+        fingerprint["sha256"] = file_sha256(path)
+    return fingerprint
+
+
+def read_manifest(cache_dir):
+    """Return the cache manifest stored in `cache_dir`, or None if there is none."""
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable cache manifest {manifest_path}: {e}")
+        return None
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """
+    Write `data` as JSON to a uniquely named temp file next to `path` and move it
+    into place, so concurrent writers (e.g. worker processes) never share a temp file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_manifest(cache_dir, manifest):
+    """Atomically write the cache manifest to `cache_dir`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    write_json_atomic(os.path.join(cache_dir, MANIFEST_NAME), manifest, ensure_ascii=False, indent=2)
+
+
+def variant_key(export_sha256, options, loader_version):
+    """Content address of one cache variant: the export, the loader options and the loader code version."""
+    payload = json.dumps(
+        {"export": export_sha256, "options": options, "loader_version": loader_version},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def cached_export_fingerprint(cache_dir, path):
+    """
+    `export_fingerprint` of `path`, reusing and updating the fingerprints kept in
+    `cache_dir`, so the export is only re-hashed when its size or mtime changes.
+    """
+    fingerprints_path = os.path.join(cache_dir, FINGERPRINTS_NAME)
+    fingerprints = {}
+    if os.path.isfile(fingerprints_path):
+        try:
+            with open(fingerprints_path, "r", encoding="utf-8") as f:
+                fingerprints = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            fingerprints = {}
+    abs_path = os.path.abspath(path)
+    fingerprint = export_fingerprint(path, fingerprints.get(abs_path))
+    if fingerprints.get(abs_path) != fingerprint:
+        fingerprints[abs_path] = fingerprint
+        os.makedirs(cache_dir, exist_ok=True)
+        write_json_atomic(fingerprints_path, fingerprints, indent=2)
+    return fingerprint
+
+
+def touch_manifest(variant_dir, manifest):
+    """Mark a cache variant as used now, for LRU eviction."""
+    manifest["last_used"] = time.time()
+    write_manifest(variant_dir, manifest)
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict_lru(cache_dir, max_bytes, keep=None):
+    """
+    Delete the least recently used cache variants (subfolders of `cache_dir`
+    with a manifest) until their total size is at most `max_bytes`.
+    The variant named `keep` is never evicted. Returns the evicted names.
+    """
+    variants = []
+    for name in os.listdir(cache_dir):
+        variant_dir = os.path.join(cache_dir, name)
+        if not os.path.isdir(variant_dir):
+            continue
+        manifest = read_manifest(variant_dir)
+        if manifest is None:
+            continue
+        variants.append((manifest.get("last_used", 0), name, dir_size(variant_dir)))
+
+    total = sum(size for _, _, size in variants)
+    evicted = []
+    for _, name, size in sorted(variants):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name))
+        total -= size
+        evicted.append(name)
+        print(f"Evicted cache variant {name} ({size / 1e6:.1f} MB)")
+    return evicted
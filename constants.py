@@ -3,6 +3,8 @@ API_KEY = "<YOUR_API_KEY>"
 BASE_URL = "<BASE_URL>"
 PAGE_SIZE = 1000
 MAX_DEPTH = 2
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 10
 IDIOMS_MAPPING = {
     "Sutsilvan": "rm-sutsilv",
     "Sursilvan": "rm-sursilv",
@@ -40,4 +42,8 @@ CONTENT_TYPES_INCLUDED = [
     "textimage",
     "topicsPage",
 ]
-CACHE_DIR = "hf_cache"
\ No newline at end of file
+CACHE_DIR = "hf_cache"
+CACHE_MAX_BYTES = 10 * 1024**3  # LRU cap on all cached dataset variants
+# BeautifulSoup parser of the sentence-level HTML mapping; "lxml" (not in requirements.txt) is faster,
+# but builds different trees from malformed markup, so it is opt-in and part of the cache variant
+HTML_BACKEND = "html.parser"
@@ -0,0 +1,103 @@
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+
+from batching import approx_token_count, embed_api_batches, embed_in_batches
+
+
+@dataclass(frozen=True)
+class ModelCapabilities:
+    """
+    What the embedding code needs to know about a model. For API models
+    `max_batch_size` and `max_tokens` are the limits of one request, and
+    `concurrency` and `rate` (requests per second) are the defaults of the
+    concurrent scheduler. For local models `max_tokens` is the padding budget
+    of one forward pass.
+    """
+
+    provider: str
+    model_id: str
+    dimension: int
+    max_batch_size: int | None
+    max_tokens: int
+    local: bool = False
+    concurrency: int | None = None
+    rate: float | None = None
+
+
+# One entry per model name of embed_overlaps.MODELS, plus the fake model
+MODEL_CAPABILITIES = {
+    "qwen3-Embedding-0.6B": ModelCapabilities(
+        "transformers", "Qwen/Qwen3-Embedding-0.6B", 1024, None, 16384, local=True),
+    "sentence-swissbert": ModelCapabilities(
+        "transformers", "jgrosjean-mathesis/sentence-swissbert", 768, None, 16384, local=True),
+    "openai-v3": ModelCapabilities(
+        "openai", "text-embedding-3-large", 3072, 2048, 300_000, concurrency=8, rate=20),
+    "gemini-embedding": ModelCapabilities(
+        "gemini", "gemini-embedding-exp-03-07", 3072, 100, 20_000, concurrency=2, rate=10 / 60),
+    "voyage-v3": ModelCapabilities(
+        "voyage", "voyage-3-large", 1024, 128, 120_000, concurrency=4, rate=10),
+    "cohere-v4": ModelCapabilities(
+        "cohere", "embed-v4.0", 1536, 96, 128_000, concurrency=8, rate=20),
+    "fake": ModelCapabilities(
+        "fake", "fake", 16, 32, 10_000, concurrency=4, rate=1000),
+}
+
+
+class EmbeddingBackend:
+    """
+    A model that embeds a list of texts. Subclasses implement `embed_batch`
+    for one request or forward pass; `embed` splits any number of texts into
+    batches within the model's capabilities and returns a float32 array of
+    shape (len(texts), dimension) in the order of the texts.
+    """
+
+    def __init__(self, name, capabilities=None):
+        self.name = name
+        self.capabilities = capabilities or MODEL_CAPABILITIES[name]
+
+    def embed_batch(self, texts):
+        raise NotImplementedError
+
+    def token_lengths(self, texts):
+        return [approx_token_count(text) for text in texts]
+
+    def embed(self, texts, progress=None):
+        capabilities = self.capabilities
+        if capabilities.local:
+            # local models pad a batch to its longest text, so similar lengths are batched together
+            return embed_in_batches(texts, self.embed_batch, self.token_lengths(texts), capabilities.max_tokens,
+                                    capabilities.max_batch_size, progress)
+        return embed_api_batches(texts, self.embed_batch, capabilities.max_batch_size, capabilities.max_tokens,
+                                 lengths=self.token_lengths(texts), progress=progress)
+
+
+class FunctionBackend(EmbeddingBackend):
+    """Backend around a function `embed_batch(texts) -> list of vectors or array`."""
+
+    def __init__(self, name, embed_batch, capabilities=None):
+        super().__init__(name, capabilities)
+        self._embed_batch = embed_batch
+
+    def embed_batch(self, texts):
+        return np.asarray(self._embed_batch(texts), dtype=np.float32)
+
+
+class FakeBackend(EmbeddingBackend):
+    """
+    Deterministic local stand-in for an embedding model: every text gets a unit
+    vector seeded by the hash of the text, so identical texts always get the same
+    vector. Needs no model download or API key, for dry runs and tests.
+    """
+
+    def __init__(self, name="fake", capabilities=None):
+        super().__init__(name, capabilities or MODEL_CAPABILITIES["fake"])
+
+    def embed_batch(self, texts):
+        embeddings = np.empty((len(texts), self.capabilities.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.capabilities.dimension)
+            embeddings[row] = vector / np.linalg.norm(vector)
+        return embeddings
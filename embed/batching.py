@@ -0,0 +1,169 @@
+import random
+import time
+
+import numpy as np
+
+
+def token_budget_batches(lengths, max_tokens, max_batch_size=None):
+    """
+    Group item indices into batches of similar length. Items are sorted by
+    length, longest first, and a batch is closed when its padded size (longest
+    item x batch size) would exceed `max_tokens`. An item longer than the
+    budget gets a batch of its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches, batch, longest = [], [], 0
+    for i in order:
+        new_longest = max(longest, lengths[i])
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (full or new_longest * (len(batch) + 1) > max_tokens):
+            batches.append(batch)
+            batch, new_longest = [], lengths[i]
+        batch.append(i)
+        longest = new_longest
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def embed_in_batches(texts, embed_batch, lengths, max_tokens, max_batch_size=None, progress=None):
+    """
+    Embed `texts` with `embed_batch(list[str]) -> array of shape (n, dim)` in
+    length-sorted batches under a token budget, and return a float32 array
+    whose rows are in the original order of `texts`.
+    """
+    embeddings = None
+    for batch in token_budget_batches(lengths, max_tokens, max_batch_size):
+        batch_embeddings = np.asarray(embed_batch([texts[i] for i in batch]), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+        embeddings[batch] = batch_embeddings
+        if progress is not None:
+            progress.update(len(batch))
+    if embeddings is None:
+        return np.empty((0, 0), dtype=np.float32)
+    return embeddings
+
+
+def approx_token_count(text):
+    """Upper estimate of the token count of `text` without a provider tokenizer (~3 characters per token)."""
+    return len(text) // 3 + 1
+
+
+def pack_batches(lengths, max_batch_size, max_tokens):
+    """
+    Split item indices into consecutive batches of at most `max_batch_size`
+    items and `max_tokens` summed length. An item longer than the budget gets
+    a batch of its own; the provider truncates or rejects it.
+    """
+    batches, batch, tokens = [], [], 0
+    for i, length in enumerate(lengths):
+        if batch and (len(batch) >= max_batch_size or tokens + length > max_tokens):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(i)
+        tokens += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# attempts per request for transient errors and the base of their backoff (s), shared by the
+# serial path and the scheduler; the waits add up to about a minute, the window of per-minute rate limits
+MAX_RETRIES = 5
+BACKOFF_BASE = 4.0
+
+# HTTP statuses of a request the provider rejects for its content (bad or too large input)
+CONTENT_ERROR_STATUSES = {400, 413, 422}
+# timeouts, rate limits and server errors; other statuses (e.g. an invalid API key) are permanent
+TRANSIENT_ERROR_STATUSES = {408, 429}
+
+
+class EmbeddingCountError(ValueError):
+    """A request returned a different number of vectors than texts."""
+
+
+def error_status(error):
+    """HTTP status of an error raised by a provider SDK (or urllib/requests), or None if it has none."""
+    for attr in ("status_code", "http_status", "code", "status"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_content_error(error):
+    """Whether a request failed because of the texts in it, so that smaller requests may succeed."""
+    return isinstance(error, EmbeddingCountError) or error_status(error) in CONTENT_ERROR_STATUSES
+
+
+def is_transient_error(error):
+    """Whether the same request may succeed later: rate limits, server errors and errors without HTTP status (network)."""
+    status = error_status(error)
+    if status is None:
+        return not isinstance(error, EmbeddingCountError)
+    return status in TRANSIENT_ERROR_STATUSES or status >= 500
+
+
+def check_count(embeddings, texts):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) != len(texts):
+        raise EmbeddingCountError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+    return embeddings
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter: a random delay in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def embed_bisecting(texts, embed_batch, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE):
+    """
+    Embed `texts` with `embed_batch`, which makes one attempt per call.
+    Transient errors (rate limits, server and network errors) are retried up to
+    `max_retries` times with jittered exponential backoff. If the provider
+    rejects the request for its content (see is_content_error), both halves
+    are embedded separately, recursively, so one bad text only costs the
+    requests on its path. A single text that is still rejected raises its
+    error, and any other error (e.g. an invalid key) is raised right away.
+    """
+    for attempt in range(max_retries):
+        try:
+            return check_count(embed_batch(texts), texts)
+        except Exception as e:
+            if is_content_error(e) and len(texts) > 1:
+                error = e
+                break
+            if not is_transient_error(e) or attempt + 1 == max_retries:
+                raise
+            delay = backoff_delay(attempt, backoff_base)
+            print(f"[Attempt {attempt + 1}/{max_retries}] Error: {e}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+    middle = len(texts) // 2
+    print(f"Batch of {len(texts)} texts failed ({error}), splitting it in two")
+    return np.concatenate([
+        embed_bisecting(texts[:middle], embed_batch, max_retries, backoff_base),
+        embed_bisecting(texts[middle:], embed_batch, max_retries, backoff_base),
+    ])
+
+
+def embed_api_batches(texts, embed_batch, max_batch_size, max_tokens, count_tokens=approx_token_count,
+                      progress=None, lengths=None, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE):
+    """
+    Embed `texts` with an API `embed_batch(list[str]) -> array of shape (n, dim)`,
+    packing consecutive texts into requests under the provider's limits.
+    Transient failures are retried with backoff and requests rejected for their
+    content by bisection (see embed_bisecting). Returns a float32 array in the
+    order of `texts`. `lengths` (token counts of the texts) defaults to `count_tokens` of each text.
+    """
+    if lengths is None:
+        lengths = [count_tokens(text) for text in texts]
+    chunks = []
+    for batch in pack_batches(lengths, max_batch_size, max_tokens):
+        chunks.append(embed_bisecting([texts[i] for i in batch], embed_batch, max_retries, backoff_base))
+        if progress is not None:
+            progress.update(len(batch))
+    if not chunks:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(chunks)
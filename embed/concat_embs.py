@@ -7,6 +7,8 @@ import os
 
 import numpy as np
 
+from emb_store import open_emb, write_emb
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -60,20 +62,21 @@ def get_sent2line(in_path, idiom, chapter, input):
     return sent2line
 
 
-def get_emb(in_path, idiom, chapter, sent2line, input):
-    line_embeddings = np.fromfile(
-        f"{in_path}/{chapter}/rm-{idiom}_{input}_overlaps.emb",
-        dtype=np.float32,
-        count=-1,
+def get_emb(in_path, idiom, chapter, sent2line, input, overlap_path=None):
+    """
+    Memory-map the overlap embeddings as a [len(overlaps), d] array. With `overlap_path`
+    the vectors are checked against the overlap file they were embedded from; a count
+    or dimension mismatch raises instead of being reshaped.
+    """
+    if overlap_path is not None:
+        return open_emb(
+            f"{in_path}/{chapter}/rm-{idiom}_{input}_overlaps.emb",
+            overlaps_path=f"{overlap_path}/{chapter}/rm-{idiom}_{input}_overlaps.txt",
+        )
+    return open_emb(
+        f"{in_path}/{chapter}/rm-{idiom}_{input}_overlaps.emb", count=len(sent2line)
     )
 
-    embedding_size = line_embeddings.size // len(sent2line)
-
-    line_embeddings.resize(line_embeddings.shape[0] // embedding_size, embedding_size)
-
-    # return [len(overlaps),d] array
-    return line_embeddings
-
 
 def reorder_emb(text_path, emb, idiom, chapter, sent2line, input, num_overlaps):
     """Yield the embeddings in the same order for both the HTML and plain text so we can concatenate them. Mostly based on the make_doc_embedding function at https://github.com/thompsonb/vecalign/blob/master/dp_utils.py"""
@@ -157,6 +160,7 @@ def main(args):
             chap,
             text_sent2line,
             "text",
+            args.overlap_path,
         )
         html_emb = get_emb(
             args.embedding_path,
@@ -164,6 +168,7 @@ def main(args):
             chap,
             html_sent2line,
             "html",
+            args.overlap_path,
         )
         # # reorder the arrays so that they correspond to the original doc order.
         text_emb, overlap_text = reorder_emb(
@@ -197,12 +202,12 @@ def main(args):
             for line in overlap_text:
                 f.write(line + "\n")
 
-        # Save concatenated embeddings;
-        with open(
+        # Save concatenated embeddings with their header
+        write_emb(
             f"{args.embedding_path}/{chap}/rm-{args.idiom}_embconcat_overlaps.emb",
-            "wb",
-        ) as wb:
-            emb_concat.astype(np.float32).tofile(wb)
+            emb_concat,
+            overlaps_path=f"{args.overlap_path}/{chap}/rm-{args.idiom}_embconcat_overlaps.txt",
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+"""
+Self-describing .emb files.
+
+The .emb file itself stays a headerless dump of float32 vectors, since vecalign
+reads it with np.fromfile. Its description lives in a JSON header next to it,
+`<file>.emb.meta.json`: dimension, dtype, number of vectors, model and the hash
+of the overlap file the vectors belong to. Readers memory-map the vectors and
+check them against the header and the overlap file instead of guessing the
+dimension from the file size.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+HEADER_SUFFIX = ".meta.json"
+FORMAT_VERSION = 1
+
+
+class EmbeddingFormatError(ValueError):
+    """An .emb file does not match its header or its overlap file."""
+
+
+def header_path(emb_path):
+    return f"{emb_path}{HEADER_SUFFIX}"
+
+
+def overlaps_hash(overlaps_path):
+    digest = hashlib.sha256()
+    with open(overlaps_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_lines(overlaps_path):
+    with open(overlaps_path, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def read_emb_header(emb_path):
+    """Return the header of `emb_path`, or None for files written without one."""
+    try:
+        with open(header_path(emb_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_emb_header(emb_path, dim, count, model=None, overlaps_path=None, dtype="float32"):
+    header = {
+        "format": FORMAT_VERSION,
+        "dim": int(dim),
+        "dtype": dtype,
+        "count": int(count),
+        "model": model,
+        "overlaps_sha256": overlaps_hash(overlaps_path) if overlaps_path else None,
+    }
+    tmp_path = f"{header_path(emb_path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(header, f)
+    os.replace(tmp_path, header_path(emb_path))
+    return header
+
+
+def write_emb(emb_path, embeddings, model=None, overlaps_path=None):
+    """Write an (n, dim) array as float32 vectors plus their header, each through a temp file."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    tmp_path = f"{emb_path}.tmp"
+    embeddings.tofile(tmp_path)
+    os.replace(tmp_path, emb_path)
+    dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+    return write_emb_header(emb_path, dim, len(embeddings), model, overlaps_path)
+
+
+def open_emb(emb_path, overlaps_path=None, count=None, model=None):
+    """
+    Memory-map the vectors of `emb_path` as a read-only (count, dim) array.
+    The header (if any) must match the file size, `model`, and the overlap file
+    (same hash and line count); without a header, `count` or the overlap file's
+    line count must divide the file into whole vectors. Raises EmbeddingFormatError otherwise.
+    """
+    header = read_emb_header(emb_path)
+    size = os.path.getsize(emb_path)
+    if count is None and overlaps_path is not None:
+        count = count_lines(overlaps_path)
+
+    if header is None:
+        if not count:
+            raise EmbeddingFormatError(f"{emb_path} has no header and no line count to infer its dimension from")
+        itemsize = np.dtype(np.float32).itemsize
+        if not size or size % (count * itemsize):
+            raise EmbeddingFormatError(f"{emb_path}: {size} bytes are not {count} whole float32 vectors")
+        dtype, dim = np.dtype(np.float32), size // (count * itemsize)
+    else:
+        dtype, dim = np.dtype(header["dtype"]), header["dim"]
+        if size != header["count"] * dim * dtype.itemsize:
+            raise EmbeddingFormatError(
+                f"{emb_path}: {size} bytes, but the header describes {header['count']} x {dim} {dtype} vectors"
+            )
+        if count is not None and count != header["count"]:
+            raise EmbeddingFormatError(f"{emb_path} holds {header['count']} vectors, expected {count}")
+        if model is not None and header["model"] is not None and model != header["model"]:
+            raise EmbeddingFormatError(f"{emb_path} was embedded with {header['model']}, expected {model}")
+        if overlaps_path is not None and header["overlaps_sha256"] not in (None, overlaps_hash(overlaps_path)):
+            raise EmbeddingFormatError(f"{overlaps_path} changed since {emb_path} was embedded")
+        count = header["count"]
+
+    if not count or not dim:
+        return np.empty((count or 0, dim), dtype=dtype)
+    return np.memmap(emb_path, dtype=dtype, mode="r", shape=(count, dim))
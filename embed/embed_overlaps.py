@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import json
 import os
 import time
@@ -6,26 +7,17 @@ import random
 import re
 import requests
 import socket
+from dataclasses import replace
+from functools import lru_cache, partial
 
-import cohere
-from cohere.core.api_error import ApiError
-from google import genai
-import numpy as np
-from openai import OpenAI
-from ratelimit import limits, sleep_and_retry
 from tqdm import tqdm
-import torch
-import torch.nn.functional as F
-from transformers import AutoTokenizer, AutoModel
-import voyageai
-
-from embed_api_keys import (
-    COHERE_API_KEY,
-    OPENAI_API_KEY,
-    VOYAGE_API_KEY,
-    GOOGLE_API_KEY,
-)
-from load_textbooks import load_textbooks
+
+from backends import MODEL_CAPABILITIES, EmbeddingBackend, FakeBackend, FunctionBackend
+from embedding_cache import EMB_CACHE_PATH, EmbeddingCache, embed_with_cache
+from emb_store import write_emb
+from resumable_emb import ResumableEmbWriter, emb_file_complete
+from scheduler import EmbeddingScheduler, find_pending_jobs
+from onnx_backend import ONNX_DIR, OnnxEmbedder, onnx_path
 
 MODELS = {
     "qwen3-Embedding-0.6B": "Qwen/Qwen3-Embedding-0.6B",
@@ -34,12 +26,53 @@ MODELS = {
     "gemini-embedding": "gemini-embedding-exp-03-07",
     "voyage-v3": "voyage-3-large",
     "cohere-v4": "embed-v4.0",
+    # deterministic stand-in without model or API key, for dry runs
+    "fake": "fake",
 }
 
-client_cohere = cohere.ClientV2(api_key=COHERE_API_KEY)
-client_openai = OpenAI(api_key=OPENAI_API_KEY)
-client_gemini = genai.Client(api_key=GOOGLE_API_KEY)
-client_voyage = voyageai.Client(api_key=VOYAGE_API_KEY)
+# padding budget (longest line x batch size) of one forward pass of a local model
+DEFAULT_MAX_TOKENS = 16384
+FULL_EMB_DIR = "/projects/text/romansh/textbooks/final/embeddings"
+# lines embedded between two progress records of a full dataset .emb file
+EMB_WRITE_CHUNK = 512
+
+# Providers (see MODEL_CAPABILITIES) are imported and their clients built on first use,
+# so embedding with one model only needs that provider's dependencies and API key.
+@lru_cache(maxsize=None)
+def get_client(provider):
+    """Import the SDK of an API provider and build its client, once per run."""
+    if provider == "cohere":
+        import cohere
+        from embed_api_keys import COHERE_API_KEY
+
+        return cohere.ClientV2(api_key=COHERE_API_KEY)
+    elif provider == "openai":
+        from openai import OpenAI
+        from embed_api_keys import OPENAI_API_KEY
+
+        # one attempt per request, see API_BATCH_EMBEDDERS
+        return OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    elif provider == "gemini":
+        from google import genai
+        from embed_api_keys import GOOGLE_API_KEY
+
+        return genai.Client(api_key=GOOGLE_API_KEY)
+    elif provider == "voyage":
+        import voyageai
+        from embed_api_keys import VOYAGE_API_KEY
+
+        return voyageai.Client(api_key=VOYAGE_API_KEY)
+    raise ValueError(f"{provider} is not an API provider")
+
+
+def list_models():
+    print(f"{'model':<22} {'provider':<14} {'dim':>5} {'batch':>6} {'tokens':>7}  model id")
+    for model_name, model_id in MODELS.items():
+        capabilities = MODEL_CAPABILITIES[model_name]
+        print(
+            f"{model_name:<22} {capabilities.provider:<14} {capabilities.dimension:>5} "
+            f"{capabilities.max_batch_size or '-':>6} {capabilities.max_tokens:>7}  {model_id}"
+        )
 
 
 def get_args():
@@ -48,17 +81,16 @@ def get_args():
     parser.add_argument(
         "--model_name",
         type=str,
-        choices=[
-            "qwen3-Embedding-0.6B",
-            "sentence-swissbert",
-            "openai-v3",
-            "gemini-embedding",
-            "voyage-v3",
-            "cohere-v4",
-        ],
+        choices=list(MODELS),
         help="Model name for embeddings",
     )
 
+    parser.add_argument(
+        "--list_models",
+        action="store_true",
+        help="List the models with their provider and exit",
+    )
+
     parser.add_argument(
         "--in_path",
         type=str,
@@ -86,10 +118,65 @@ def get_args():
 
     parser.add_argument("--out_dir", type=str, help="Directory for output embeddings")
 
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=DEFAULT_MAX_TOKENS,
+        help="Token budget of one batch for the local models (qwen3, swissbert)",
+    )
+
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="Number of CPU threads for torch (default: torch's own choice)",
+    )
+
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="torch",
+        choices=["torch", "onnx"],
+        help="Run the local models with torch or as int8 ONNX models exported by onnx_backend.py",
+    )
+
+    parser.add_argument(
+        "--onnx_dir", type=str, default=ONNX_DIR, help="Directory of the exported ONNX models"
+    )
+
+    parser.add_argument(
+        "--emb_cache",
+        type=str,
+        default=EMB_CACHE_PATH,
+        help="SQLite file of embeddings shared across chapters and runs",
+    )
+
+    parser.add_argument(
+        "--no_emb_cache",
+        action="store_true",
+        help="Embed every line without looking it up in or adding it to the embedding cache",
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=0,
+        help="Embed the chapters of the full dataset with this many concurrent API requests (0: one request at a time)",
+    )
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="API requests per second shared by all concurrent requests (default: the model's capabilities in backends.py)",
+    )
+
     return parser.parse_args()
 
 
 def get_hf_model(model_name):
+    from transformers import AutoTokenizer, AutoModel
+
     if model_name == "sentence-swissbert":
         model = AutoModel.from_pretrained(MODELS[model_name])
         # romansh adapter
@@ -105,19 +192,33 @@ def get_hf_model(model_name):
         return model, tokenizer
 
 
+def get_onnx_model(model_name, onnx_dir=ONNX_DIR, num_threads=None):
+    # exported (and int8-quantized) by onnx_backend.py
+    if not os.path.isfile(onnx_path(model_name, onnx_dir)):
+        raise FileNotFoundError(
+            f"No ONNX model for {model_name} in {onnx_dir}, export it with onnx_backend.py first"
+        )
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(MODELS[model_name])
+    return OnnxEmbedder(model_name, tokenizer, onnx_dir, num_threads=num_threads), tokenizer
+
+
 def get_hf_chapter(parsed_line, tb):
     chapter_name = parsed_line[tb.idiom]
     if chapter_name:
-        return tb.hf_dataset.filter(lambda row: chapter_name in row["chapterPath"])
+        return tb.select_chapter(chapter_name)
     # in case this chapter doesn't exist for an idiom
     else:
         return None
 
 
-def embed_qwen(text, model, tokenizer):
+def embed_qwen_batch(texts, model, tokenizer):
+    import torch
+
     # from QWEN3 Documentation: https://huggingface.co/Qwen/Qwen3-Embedding-0.6B
     inputs = tokenizer(
-        text, padding=True, truncation=True, return_tensors="pt", max_length=512
+        texts, padding=True, truncation=True, return_tensors="pt", max_length=512
     )
     with torch.no_grad():
         outputs = model(**inputs)
@@ -135,13 +236,19 @@ def embed_qwen(text, model, tokenizer):
             torch.arange(batch_size, device=last_hidden_states.device), sequence_lengths
         ]
 
-    return embedding.squeeze().tolist()
+    return embedding.float().cpu().numpy()
 
 
-def embed_swissbert(text, model, tokenizer):
+def embed_qwen(text, model, tokenizer):
+    return embed_qwen_batch([text], model, tokenizer)[0].tolist()
+
+
+def embed_swissbert_batch(texts, model, tokenizer):
+    import torch
+
     # From sentence-SwissBERT documentation: https://huggingface.co/jgrosjean-mathesis/sentence-swissbert
     inputs = tokenizer(
-        text, padding=True, truncation=True, return_tensors="pt", max_length=512
+        texts, padding=True, truncation=True, return_tensors="pt", max_length=512
     )
     with torch.no_grad():
         outputs = model(**inputs)
@@ -155,44 +262,109 @@ def embed_swissbert(text, model, tokenizer):
     sum_mask = torch.clamp(attention_mask.sum(1), min=1e-9)
     embedding = sum_embeddings / sum_mask
 
-    return embedding.squeeze().tolist()
+    return embedding.float().cpu().numpy()
 
 
-def embed_openai(text, model_name):
+def embed_swissbert(text, model, tokenizer):
+    return embed_swissbert_batch([text], model, tokenizer)[0].tolist()
+
+
+LOCAL_BATCH_EMBEDDERS = {
+    "qwen3-Embedding-0.6B": embed_qwen_batch,
+    "sentence-swissbert": embed_swissbert_batch,
+}
+
+
+def token_lengths(texts, tokenizer):
+    """Number of tokens of each text, as truncated for the model."""
+    return [len(ids) for ids in tokenizer(texts, truncation=True, max_length=512)["input_ids"]]
+
+
+class LocalModelBackend(EmbeddingBackend):
+    """
+    sentence-SwissBERT or Qwen3-Embedding, run with torch or as an ONNX export (see onnx_backend.py).
+    An ONNX backend is named after its variant (e.g. qwen3-Embedding-0.6B-onnx-int8), so its
+    vectors are cached and written apart from the torch model's.
+    """
+
+    def __init__(self, model_name, model, tokenizer, max_tokens=DEFAULT_MAX_TOKENS):
+        name = model.name if isinstance(model, OnnxEmbedder) else model_name
+        super().__init__(name, replace(MODEL_CAPABILITIES[model_name], max_tokens=max_tokens))
+        self.model_name = model_name
+        self.model = model
+        self.tokenizer = tokenizer
+
+    def token_lengths(self, texts):
+        return token_lengths(texts, self.tokenizer)
+
+    def embed_batch(self, texts):
+        if isinstance(self.model, OnnxEmbedder):
+            return self.model.embed_batch(texts)
+        return LOCAL_BATCH_EMBEDDERS[self.model_name](texts, self.model, self.tokenizer)
+
+
+def embed_openai_batch(texts, model_name):
     # OpenAI API call for text embedding
-    response_text = client_openai.embeddings.create(
-        input=text, model=MODELS[model_name]
+    response_text = get_client("openai").embeddings.create(
+        input=texts, model=MODELS[model_name]
     )
-    return response_text.data[0].embedding
+    return [item.embedding for item in sorted(response_text.data, key=lambda item: item.index)]
+
+
+def embed_openai(text, model_name):
+    return embed_openai_batch([text], model_name)[0]
+
+
+@lru_cache(maxsize=None)
+def gemini_embed_content():
+    from ratelimit import limits, sleep_and_retry
+
+    client_gemini = get_client("gemini")
+
+    # sleep wrapper for low RPM
+    @sleep_and_retry
+    @limits(calls=10, period=60)
+    def embed_content(texts, model):
+        return client_gemini.models.embed_content(contents=texts, model=model)
+
+    return embed_content
+
+
+def embed_gemini_batch(texts, model_name):
+    # Gemini embedding API call
+    response = gemini_embed_content()(texts, MODELS[model_name])
+    return [embedding.values for embedding in response.embeddings]
 
 
-@sleep_and_retry
-@limits(calls=10, period=60)
 def embed_gemini(text, model_name):
-    # Gemini embedding API call, with sleep wrapper for low RPM
-    response = client_gemini.models.embed_content(
-        contents=text, model=MODELS[model_name]
-    )
-    return response.embeddings[0].values
+    return embed_gemini_batch([text], model_name)[0]
 
 
-def embed_voyage(text, model_name):
+def embed_voyage_batch(texts, model_name):
     # Voyage AI embedding API call
-    response = client_voyage.embed(text, model=MODELS[model_name])
-    return response.embeddings[0]
+    response = get_client("voyage").embed(texts, model=MODELS[model_name])
+    return response.embeddings
 
 
-def embed_cohere(text, model_name, max_retries=5):
-    # Cohere embedding API call, with exception handling to continue after timeouts and API errors
+def embed_voyage(text, model_name):
+    return embed_voyage_batch([text], model_name)[0]
+
+
+def embed_cohere_batch(texts, model_name, max_retries=5):
+    # Cohere embedding API call, with exception handling to continue after timeouts and API errors.
+    # The error of the last attempt is raised, so with max_retries=1 it fails fast.
+    client_cohere = get_client("cohere")
+    from cohere.core.api_error import ApiError
+
     for attempt in range(max_retries):
         try:
             response = client_cohere.embed(
-                texts=[text],
+                texts=texts,
                 model=MODELS[model_name],
                 embedding_types=["float"],
                 input_type="clustering",
             )
-            return response.embeddings.float[0]
+            return response.embeddings.float
         except (
             ApiError,
             json.decoder.JSONDecodeError,
@@ -201,6 +373,8 @@ def embed_cohere(text, model_name, max_retries=5):
             TimeoutError,
             ConnectionError,
         ) as e:
+            if attempt + 1 == max_retries:
+                raise
 
             wait_time = 30 + random.uniform(0, 5) * (attempt + 1)
             print(f"[Attempt {attempt+1}/{max_retries}] Error: {e}")
@@ -208,65 +382,91 @@ def embed_cohere(text, model_name, max_retries=5):
             print(f"Waiting {wait_time:.1f}s before retrying...")
             time.sleep(wait_time)
 
-    raise RuntimeError(f"Failed to embed text after {max_retries} retries")
+
+def embed_cohere(text, model_name, max_retries=5):
+    return embed_cohere_batch([text], model_name, max_retries)[0]
 
 
-def embed_overlap(
-    text_type, in_path, out_path, idiom, model_name=None, model=None, tokenizer=None
+# One attempt per request: the batching layer (and the scheduler) retries transient errors with
+# backoff and bisects requests rejected for their content, instead of stacking provider retries on every step.
+API_BATCH_EMBEDDERS = {
+    "openai-v3": embed_openai_batch,
+    "gemini-embedding": embed_gemini_batch,
+    "voyage-v3": embed_voyage_batch,
+    "cohere-v4": partial(embed_cohere_batch, max_retries=1),
+}
+
+
+def get_backend(
+    model_name, max_tokens=DEFAULT_MAX_TOKENS, backend="torch", onnx_dir=ONNX_DIR, num_threads=None
 ):
-    """Write .emb files with the binary embeddings of the text in the overlap files."""
-
-    with (
-        open(
-            f"{in_path}/rm-{idiom}_{text_type}_overlaps.txt", "r", encoding="utf-8"
-        ) as f,
-        open(f"{out_path}/rm-{idiom}_{text_type}_overlaps.emb", "wb") as wb,
-    ):
-        # loop through each segment in the book
-        for line in tqdm(f, desc=f"Embedding with {model_name}"):
-            if model_name == "qwen3-Embedding-0.6B":
-                # Write text embedding
-                emb = np.array(embed_qwen(line, model, tokenizer), dtype=np.float32)
-                emb.tofile(wb)
-            elif model_name == "sentence-swissbert":
-                emb = np.array(
-                    embed_swissbert(line, model, tokenizer), dtype=np.float32
-                )
-                emb.tofile(wb)
-            elif model_name == "openai-v3":
-                emb = np.array(embed_openai(line, model_name), dtype=np.float32)
-                emb.tofile(wb)
-            elif model_name == "gemini-embedding":
-                emb = np.array(embed_gemini(line, model_name), dtype=np.float32)
-                emb.tofile(wb)
-            elif model_name == "voyage-v3":
-                emb = np.array(embed_voyage(line, model_name), dtype=np.float32)
-                emb.tofile(wb)
-            elif model_name == "cohere-v4":
-                emb = np.array(embed_cohere(line, model_name), dtype=np.float32)
-                emb.tofile(wb)
-            else:
-                raise ValueError(
-                    f"Model {model_name} is not supported. Choose from {list(MODELS.keys())}."
-                )
+    """Build the EmbeddingBackend of a model in MODELS, loading a local model with torch or ONNX Runtime."""
+    if model_name == "fake":
+        return FakeBackend()
+    elif model_name in LOCAL_BATCH_EMBEDDERS:
+        if backend == "onnx":
+            model, tokenizer = get_onnx_model(model_name, onnx_dir, num_threads)
+        else:
+            model, tokenizer = get_hf_model(model_name)
+        return LocalModelBackend(model_name, model, tokenizer, max_tokens)
+    elif model_name in API_BATCH_EMBEDDERS:
+        embed_batch = API_BATCH_EMBEDDERS[model_name]
+        return FunctionBackend(model_name, lambda texts: embed_batch(texts, model_name))
+    raise ValueError(
+        f"Model {model_name} is not supported. Choose from {list(MODELS.keys())}."
+    )
+
+
+def embed_lines(backend, lines):
+    with tqdm(total=len(lines), desc=f"Embedding with {backend.name}") as progress:
+        return backend.embed(lines, progress)
 
 
-def embed_overlaps_full(in_path, book, chapter, idiom):
-    with (
-        open(
-            f"{in_path}/{book}/{chapter}/rm-{idiom}_text_overlaps.txt",
-            "r",
-            encoding="utf-8",
-        ) as f,
-        open(
-            f"/projects/text/romansh/textbooks/final/embeddings/{book}/{chapter}/rm-{idiom}_text_overlaps.emb",
-            "wb",
-        ) as wb,
-    ):
-        # loop through each segment in the book
-        for line in tqdm(f, desc=f"Embedding with Cohere-v4"):
-            emb = np.array(embed_cohere(line, "cohere-v4"), dtype=np.float32)
-            emb.tofile(wb)
+def embed_overlap(text_type, in_path, out_path, idiom, backend, cache=None):
+    """
+    Write .emb files with the binary embeddings of the text in the overlap files.
+    With an `EmbeddingCache`, only lines that are not cached yet are embedded.
+    """
+    overlaps_path = f"{in_path}/rm-{idiom}_{text_type}_overlaps.txt"
+    with open(overlaps_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    embeddings = embed_with_cache(
+        lines, lambda texts: embed_lines(backend, texts), cache, backend.name, text_type
+    )
+    write_emb(
+        f"{out_path}/rm-{idiom}_{text_type}_overlaps.emb", embeddings, backend.name, overlaps_path
+    )
+
+
+def embed_overlaps_full(
+    in_path, book, chapter, idiom, backend, cache=None, out=FULL_EMB_DIR, text_type="text"
+):
+    """
+    Embed one overlap file of the full dataset, writing the vectors in chunks of
+    EMB_WRITE_CHUNK lines through a `ResumableEmbWriter`, so an interrupted run
+    resumes after the last complete vector.
+    """
+    overlaps_path = f"{in_path}/{book}/{chapter}/rm-{idiom}_{text_type}_overlaps.txt"
+    with open(overlaps_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    writer = ResumableEmbWriter(
+        f"{out}/{book}/{chapter}/rm-{idiom}_{text_type}_overlaps.emb",
+        backend.name,
+        len(lines),
+        overlaps_path,
+    )
+    for start in range(writer.lines_done, len(lines), EMB_WRITE_CHUNK):
+        writer.write(
+            embed_with_cache(
+                lines[start : start + EMB_WRITE_CHUNK],
+                lambda texts: embed_lines(backend, texts),
+                cache,
+                backend.name,
+                text_type,
+            )
+        )
 
 
 def get_grade_number(name):
@@ -274,18 +474,27 @@ def get_grade_number(name):
     return int(match.group(1)) if match else None
 
 
-def main(model_name, in_path, text_type, val_set_only, grade, out):
+def main(
+    model_name,
+    in_path,
+    text_type,
+    val_set_only,
+    grade,
+    out,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    cache=None,
+    concurrency=0,
+    rate=None,
+    backend="torch",
+    onnx_dir=ONNX_DIR,
+    num_threads=None,
+):
+    embedding_backend = get_backend(model_name, max_tokens, backend, onnx_dir, num_threads)
     if val_set_only:
-
-        if model_name in ["qwen3-Embedding-0.6B", "sentence-swissbert"]:
-            model, tokenizer = get_hf_model(model_name)
-        else:
-            model, tokenizer = None, None
-
         for chap in os.listdir(in_path):
             print(f"Now embedding {chap}")
             extended_in = os.path.join(in_path, chap)
-            out_dir = f"{out}/{model_name}"
+            out_dir = f"{out}/{embedding_backend.name}"
             out_path = os.path.join(out_dir, chap)
 
             os.makedirs(out_dir, exist_ok=True)
@@ -297,13 +506,30 @@ def main(model_name, in_path, text_type, val_set_only, grade, out):
                     extended_in,
                     out_path,
                     idiom,
-                    model_name,
-                    model,
-                    tokenizer,
+                    embedding_backend,
+                    cache,
                 )
     else:
-        assert model_name == "cohere-v4"
-        assert text_type == "text"
+        if concurrency:
+            assert not embedding_backend.capabilities.local, "--concurrency is for API models"
+            books = [book for book in os.listdir(in_path) if get_grade_number(book) == grade]
+            jobs = find_pending_jobs(
+                in_path,
+                out,
+                embedding_backend.name,
+                books,
+                text_type,
+                embedding_backend.capabilities.dimension,
+            )
+            scheduler = EmbeddingScheduler(
+                embedding_backend,
+                cache,
+                text_type,
+                concurrency=concurrency,
+                rate=rate,
+            )
+            asyncio.run(scheduler.run(jobs))
+            return
 
         for book in os.listdir(in_path):
             book_grade = get_grade_number(book)
@@ -322,18 +548,37 @@ def main(model_name, in_path, text_type, val_set_only, grade, out):
                 os.makedirs(emb_chap_path, exist_ok=True)
 
                 for idiom in ["puter", "sursilv", "sutsilv", "surmiran", "vallader"]:
-                    text_path = f"{chapter_path}/rm-{idiom}_text_overlaps.txt"
-                    emb_path = f"{emb_chap_path}/rm-{idiom}_text_overlaps.emb"
+                    text_path = f"{chapter_path}/rm-{idiom}_{text_type}_overlaps.txt"
+                    emb_path = f"{emb_chap_path}/rm-{idiom}_{text_type}_overlaps.emb"
 
                     if os.path.isfile(text_path):
-                        if not os.path.isfile(emb_path):
-                            embed_overlaps_full(in_path, book, chapter, idiom)
+                        with open(text_path, "r", encoding="utf-8") as f:
+                            num_lines = sum(1 for _ in f)
+                        # partial, truncated or dimension-mismatched files are resumed or rewritten
+                        if not emb_file_complete(
+                            emb_path,
+                            embedding_backend.name,
+                            num_lines,
+                            embedding_backend.capabilities.dimension,
+                            text_path,
+                        ):
+                            embed_overlaps_full(
+                                in_path, book, chapter, idiom, embedding_backend, cache, out, text_type
+                            )
                         else:
                             print(f"Already embedded {idiom} {chapter} in {book}")
 
 
 if __name__ == "__main__":
     args = get_args()
+    if args.list_models:
+        list_models()
+        raise SystemExit
+    if args.num_threads and args.backend == "torch":
+        import torch
+
+        torch.set_num_threads(args.num_threads)
+    cache = None if args.no_emb_cache else EmbeddingCache(args.emb_cache)
     main(
         args.model_name,
         args.in_path,
@@ -341,4 +586,14 @@ if __name__ == "__main__":
         args.val_set_only,
         args.grade,
         args.out_dir,
+        args.max_tokens,
+        cache,
+        args.concurrency,
+        args.rate,
+        args.backend,
+        args.onnx_dir,
+        args.num_threads,
     )
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
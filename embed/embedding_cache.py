@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+EMB_CACHE_PATH = "emb_cache/embeddings.sqlite"
+# SQLite caps the number of parameters of one statement
+LOOKUP_CHUNK = 500
+
+
+def text_key(text):
+    """
+    Hash of the exact text sent to the model. Texts are not normalized: "foo\n" and
+    "foo" tokenize differently, so they must not share a vector.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed store of float32 embeddings in one SQLite file,
+    keyed by (model, text_type, hash of the text), shared by all chapters,
+    books and runs.
+    """
+
+    def __init__(self, path=EMB_CACHE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS text_embeddings ("
+            "model TEXT, text_type TEXT, key BLOB, dim INTEGER, vector BLOB, "
+            "PRIMARY KEY (model, text_type, key))"
+        )
+        self._conn.commit()
+        # per line of the embedded files; `embedded` counts the distinct texts sent to the model
+        self.hits = 0
+        self.misses = 0
+        self.embedded = 0
+
+    def get_many(self, model, text_type, keys):
+        """Return {key: vector} for the keys that are cached."""
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            rows = self._conn.execute(
+                "SELECT key, vector FROM text_embeddings WHERE model = ? AND text_type = ? "
+                f"AND key IN ({','.join('?' * len(chunk))})",
+                [model, text_type, *chunk],
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model, text_type, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO text_embeddings VALUES (?, ?, ?, ?, ?)",
+            [(model, text_type, key, len(vector), vector.tobytes()) for key, vector in zip(keys, vectors)],
+        )
+        self._conn.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return (
+            f"Embedding cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate), "
+            f"{self.embedded} distinct texts embedded"
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+def lookup_cached(texts, cache, model, text_type):
+    """
+    Bulk-look up `texts` in `cache`. Returns the keys of the texts, the {key: vector}
+    hits, and {key: text} for the first text of every distinct key that missed.
+    """
+    keys = [text_key(text) for text in texts]
+    vectors = cache.get_many(model, text_type, set(keys))
+    num_hits = sum(key in vectors for key in keys)
+    cache.hits += num_hits
+    cache.misses += len(keys) - num_hits
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors and key not in missing:
+            missing[key] = text
+    return keys, vectors, missing
+
+
+def store_embedded(cache, model, text_type, vectors, missing_keys, embedded):
+    """Add the vectors embedded for `missing_keys` to the cache and to `vectors`."""
+    embedded = np.asarray(embedded, dtype=np.float32)
+    cache.put_many(model, text_type, missing_keys, embedded)
+    cache.embedded += len(missing_keys)
+    vectors.update(zip(missing_keys, embedded))
+
+
+def stack_vectors(keys, vectors):
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([vectors[key] for key in keys])
+
+
+def embed_with_cache(texts, embed_texts, cache, model, text_type):
+    """
+    Embed `texts` with `embed_texts(list[str]) -> array of shape (n, dim)`, looking
+    all of them up in `cache` in bulk first. Only distinct texts that miss are
+    embedded (and then stored). Returns a float32 array in the order of `texts`.
+    Without a cache, all texts are embedded.
+    """
+    if cache is None:
+        return np.asarray(embed_texts(texts), dtype=np.float32)
+    keys, vectors, missing = lookup_cached(texts, cache, model, text_type)
+    if missing:
+        store_embedded(cache, model, text_type, vectors, list(missing), embed_texts(list(missing.values())))
+    return stack_vectors(keys, vectors)
@@ -1,10 +1,10 @@
 import argparse
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-from load_textbooks import load_textbooks
-
-textbooks = load_textbooks()
+from load_textbooks import load_textbook_catalog
+from models.textbook_catalog import TextbookCatalog
 
 IDIOMS = {
     "rm-surmiran": "surmiran",
@@ -23,6 +23,110 @@ VAL_CHAP = [
     "8-scriver-ei-buc-adina-sempel",
 ]
 
+MAPPINGS_DIR = "./chapter_mappings/final_jsonl"
+TEXT_COLUMNS = {"text": "sentenceExtractedText", "html": "sentenceHTML"}
+
+# catalog of the worker processes, see _init_worker
+_textbooks = None
+
+
+def load_catalog():
+    # lazy: a book's dataset is only loaded from the cache when it is looked up
+    return load_textbook_catalog(split_segments_into_sentences=True)
+
+
+def write_lines_atomic(path, lines):
+    """Write one line per item to a temp file and move it into place, so `path` is never half-written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f_out:
+        for line in lines:
+            f_out.write(f"{line}\n")
+    os.replace(tmp_path, path)
+
+
+def export_chapter(tb, chapter_name, out_dir, idiom, text_types):
+    """Select a chapter once and write `<idiom>_<text_type>.txt` for every requested text type."""
+    chapter = tb.select_chapter(chapter_name)
+    os.makedirs(out_dir, exist_ok=True)
+    for text_type in text_types:
+        write_lines_atomic(f"{out_dir}/{idiom}_{text_type}.txt", chapter[TEXT_COLUMNS[text_type]])
+
+
+def export_val_set(textbooks, out_dir, text_types, mappings_dir=MAPPINGS_DIR):
+    # Get for workbook 4.1
+    klasse = 4
+    book_num = 1
+    with open(f"{mappings_dir}/4.1_wb.jsonl", "r") as f:
+        # loop through chapters until one of the val_chap is found
+        for chap in f:
+            chapter_map = json.loads(chap)
+            name = chapter_map["rm-sursilv"]
+            if name not in VAL_CHAP:
+                continue
+            print(f"---{name}---")
+            for idiom in list(chapter_map.keys()):
+                if chapter_map.get(idiom, None):
+                    tb = textbooks[f"/{IDIOMS[idiom]}/klasse-{klasse}/arbeitsbuch-{book_num}/workbook"]
+                    export_chapter(tb, chapter_map[idiom], f"{out_dir}/{name}", idiom, text_types)
+
+
+def export_book(textbooks, book, out_dir, text_types, mappings_dir=MAPPINGS_DIR):
+    """Write the chapter files of one chapter mapping file (one book). Returns the number of chapters."""
+    print(f"---{book}---")
+    book_name = os.path.splitext(book)[0]
+    klasse, book_num = book.split("_")[0].split(".")
+    book_type = "workbook" if "wb" in book else "teachers_commentary"
+    num_chapters = 0
+    with open(f"{mappings_dir}/{book}", "r") as f:
+        for chap in f:
+            chapter_map = json.loads(chap)
+            name = chapter_map["rm-sursilv"]
+            for idiom in list(chapter_map.keys()):
+                if chapter_map.get(idiom, None):
+                    tb = textbooks[f"/{IDIOMS[idiom]}/klasse-{klasse}/arbeitsbuch-{book_num}/{book_type}"]
+                    export_chapter(tb, chapter_map[idiom], f"{out_dir}/{book_name}/{name}", idiom, text_types)
+            num_chapters += 1
+    return num_chapters
+
+
+def worker_catalog_args(textbooks):
+    """
+    (manifest entries, variant dir) from which a worker rebuilds `textbooks` without
+    touching the cache manifest, or None if the books are not all cached on disk.
+    """
+    if not isinstance(textbooks, TextbookCatalog):
+        return None
+    entries = [textbooks.metadata(path) for path in textbooks]
+    if any(entry["cache_folder"] is None for entry in entries):
+        return None
+    return entries, textbooks.variant_dir
+
+
+def _init_worker(entries, variant_dir):
+    global _textbooks
+    _textbooks = TextbookCatalog(entries, variant_dir)
+
+
+def _export_book_worker(book, out_dir, text_types, mappings_dir):
+    return export_book(_textbooks, book, out_dir, text_types, mappings_dir)
+
+
+def export_full(textbooks, out_dir, text_types, num_proc=None, mappings_dir=MAPPINGS_DIR):
+    """
+    Export every book listed in `mappings_dir`. With `num_proc` > 1 the books are
+    fanned out over a process pool; each worker opens the books of the (already
+    built) catalog `textbooks` from its cache folders.
+    """
+    books = sorted(os.listdir(mappings_dir))
+    catalog_args = worker_catalog_args(textbooks) if num_proc and num_proc > 1 else None
+    if catalog_args is None:
+        if num_proc and num_proc > 1:
+            print("The textbooks are not all cached on disk, exporting in one process")
+        return sum(export_book(textbooks, book, out_dir, text_types, mappings_dir) for book in books)
+    with ProcessPoolExecutor(max_workers=num_proc, initializer=_init_worker, initargs=catalog_args) as executor:
+        futures = [executor.submit(_export_book_worker, book, out_dir, text_types, mappings_dir) for book in books]
+        return sum(future.result() for future in futures)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -35,82 +139,23 @@ if __name__ == "__main__":
     parser.add_argument(
         "--text_type",
         type=str,
-        choices=["text", "html"],
+        choices=["text", "html", "both"],
         default="text",
-        help="Determines whether the plain text or the HTML for each segment is written to the output",
+        help="Determines whether the plain text or the HTML for each segment is written to the output ('both' writes both in one pass)",
+    )
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=1,
+        help="Number of processes to export books in parallel (full dataset only)",
     )
     args = parser.parse_args()
+    text_types = ["text", "html"] if args.text_type == "both" else [args.text_type]
 
+    # builds the cache on first use, before any worker opens it
+    textbooks = load_catalog()
     if args.val_set_only:
-        # Get for workbook 4.1
-        klasse = 4
-        book_num = 1
-        with open(f"./chapter_mappings/final_jsonl/4.1_wb.jsonl", "r") as f:
-            # loop through chapters until one of the val_chap is found
-            for chap in f:
-                chapter_map = json.loads(chap)
-                name = chapter_map["rm-sursilv"]
-                if name in VAL_CHAP:
-                    print(f"---{name}---")
-                    for idiom in list(chapter_map.keys()):
-                        if chapter_map.get(idiom, None):
-                            data = textbooks[
-                                f"/{IDIOMS[idiom]}/klasse-{klasse}/arbeitsbuch-{book_num}/workbook"
-                            ]
-                            filtered = data.hf_dataset.filter(
-                                lambda row: chapter_map[idiom] in row["chapterPath"]
-                            )
-
-                            os.makedirs(f"{args.out_dir}/{name}", exist_ok=True)
-                            with open(
-                                f"{args.out_dir}/{name}/{idiom}_{args.text_type}.txt",
-                                "w",
-                                encoding="utf-8",
-                            ) as f_out:
-                                for segment in filtered:
-                                    if args.text_type == "text":
-                                        f_out.write(
-                                            f"{segment['sentenceExtractedText']}\n"
-                                        )
-                                    else:
-                                        f_out.write(f"{segment['sentenceHTML']}\n")
-                else:
-                    continue
+        export_val_set(textbooks, args.out_dir, text_types)
     else:
-        for book in os.listdir("./chapter_mappings/final_jsonl"):
-            print(f"---{book}---")
-            klasse = book.split("_")[0].split(".")[0]
-            book_num = book.split("_")[0].split(".")[1]
-            with open(f"./chapter_mappings/final_jsonl/{book}", "r") as f:
-                for chap in f:
-                    chapter_map = json.loads(chap)
-                    name = chapter_map["rm-sursilv"]
-                    print(f"---{name}---")
-                    for idiom in list(chapter_map.keys()):
-                        if chapter_map.get(idiom, None):
-                            data = textbooks[
-                                f"/{IDIOMS[idiom]}/klasse-{klasse}/arbeitsbuch-{book_num}/{'workbook' if 'wb' in book else 'teachers_commentary'}"
-                            ]
-                            filtered = data.hf_dataset.filter(
-                                lambda row: chapter_map[idiom] in row["chapterPath"]
-                            )
-
-                            os.makedirs(
-                                f"{args.out_dir}/{book.strip('.jsonl')}/", exist_ok=True
-                            )
-                            os.makedirs(
-                                f"{args.out_dir}/{book.strip('.jsonl')}/{name}",
-                                exist_ok=True,
-                            )
-                            with open(
-                                f"{args.out_dir}/{book.strip('.jsonl')}/{name}/{idiom}_{args.text_type}.txt",
-                                "w",
-                                encoding="utf-8",
-                            ) as f_out:
-                                for segment in filtered:
-                                    if args.text_type == "text":
-                                        f_out.write(
-                                            f"{segment['sentenceExtractedText']}\n"
-                                        )
-                                    else:
-                                        f_out.write(f"{segment['sentenceHTML']}\n")
+        num_chapters = export_full(textbooks, args.out_dir, text_types, args.num_proc)
+        print(f"Exported {num_chapters} chapters")
@@ -0,0 +1,215 @@
+"""CPU backend for the local embedding models on ONNX Runtime, with optional dynamic int8 quantization.
+
+torch is only needed to export a model; embedding with an exported model needs onnxruntime and the tokenizer.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+ONNX_DIR = "onnx_models"
+# pooling of the last hidden state, as in the torch embedding functions of embed_overlaps.py
+POOLING = {
+    "sentence-swissbert": "mean",
+    "qwen3-Embedding-0.6B": "last_token",
+}
+MAX_LENGTH = 512
+
+
+def mean_pool(hidden, attention_mask):
+    """Mean of the token vectors of each sequence, ignoring padding (sentence-SwissBERT)."""
+    mask = attention_mask[..., None].astype(np.float32)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def last_token_pool(hidden, attention_mask):
+    """Vector of the last non-padding token of each sequence (Qwen3-Embedding)."""
+    if attention_mask[:, -1].sum() == attention_mask.shape[0]:
+        # left padding: the last position is always a real token
+        return hidden[:, -1]
+    sequence_lengths = attention_mask.sum(axis=1) - 1
+    return hidden[np.arange(hidden.shape[0]), sequence_lengths]
+
+
+POOLING_FUNCTIONS = {"mean": mean_pool, "last_token": last_token_pool}
+
+
+def cosine_similarities(reference, candidate):
+    """Row-wise cosine similarity of two (n, dim) arrays."""
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return (reference * candidate).sum(axis=1) / np.clip(norms, 1e-12, None)
+
+
+def cosine_drift(reference, candidate):
+    """Summary of how far `candidate` embeddings drift from `reference` ones (1 - cosine similarity)."""
+    drift = 1 - cosine_similarities(reference, candidate)
+    return {
+        "mean": float(drift.mean()),
+        "p99": float(np.quantile(drift, 0.99)),
+        "max": float(drift.max()),
+    }
+
+
+def onnx_path(model_name, onnx_dir=ONNX_DIR, int8=True):
+    return os.path.join(onnx_dir, model_name, "model.int8.onnx" if int8 else "model.onnx")
+
+
+def onnx_model_name(model_name, int8=True):
+    """
+    Name of the ONNX variant of a model, used in place of the torch model's name
+    for the embedding cache, .emb headers and output directories: its vectors drift
+    from the torch ones, so the two must never be mixed.
+    """
+    return f"{model_name}-onnx-{'int8' if int8 else 'fp32'}"
+
+
+def export_onnx(model_name, model, tokenizer, onnx_dir=ONNX_DIR, quantize=True):
+    """
+    Export a loaded torch model (see get_hf_model) to ONNX with dynamic batch and
+    sequence axes, and with `quantize` also write a dynamically int8-quantized copy.
+    The graph outputs the last hidden state; pooling is applied at embedding time.
+    For sentence-SwissBERT the default language set on the model (the rm_CH
+    adapter) is traced into the graph.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            kwargs = {"use_cache": False} if POOLING[model_name] == "last_token" else {}
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, **kwargs).last_hidden_state
+
+    os.makedirs(os.path.dirname(onnx_path(model_name, onnx_dir)), exist_ok=True)
+    fp32_path = onnx_path(model_name, onnx_dir, int8=False)
+    inputs = tokenizer(["Bun di!", "Co vai?"], padding=True, return_tensors="pt")
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(model),
+            (inputs["input_ids"], inputs["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=17,
+        )
+    if quantize:
+        # Qwen3-Embedding-0.6B is larger than the 2GB protobuf limit, so weights are stored externally
+        quantize_dynamic(fp32_path, onnx_path(model_name, onnx_dir), weight_type=QuantType.QInt8,
+                         use_external_data_format=True)
+    return fp32_path
+
+
+class OnnxEmbedder:
+    """Embed texts with an exported model on ONNX Runtime's CPU provider and the model's pooling."""
+
+    def __init__(self, model_name, tokenizer, onnx_dir=ONNX_DIR, int8=True, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model_name = model_name
+        self.name = onnx_model_name(model_name, int8)
+        self.tokenizer = tokenizer
+        self.pool = POOLING_FUNCTIONS[POOLING[model_name]]
+        self.session = ort.InferenceSession(
+            onnx_path(model_name, onnx_dir, int8), options, providers=["CPUExecutionProvider"]
+        )
+
+    def embed_batch(self, texts):
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np", max_length=MAX_LENGTH)
+        feed = {name: inputs[name].astype(np.int64) for name in ("input_ids", "attention_mask")}
+        (hidden,) = self.session.run(["last_hidden_state"], feed)
+        return self.pool(hidden, feed["attention_mask"]).astype(np.float32)
+
+
+def timed(embed):
+    start = time.perf_counter()
+    embeddings = embed()
+    return embeddings, time.perf_counter() - start
+
+
+def compare_backends(lines, embed_torch, embed_onnx):
+    """
+    Embed `lines` with both backends (callables taking the list of lines) and
+    report the throughput of each and the cosine drift of ONNX from torch.
+    """
+    torch_embeddings, torch_seconds = timed(lambda: embed_torch(lines))
+    onnx_embeddings, onnx_seconds = timed(lambda: embed_onnx(lines))
+    return {
+        "lines": len(lines),
+        "torch_lines_per_s": len(lines) / torch_seconds,
+        "onnx_lines_per_s": len(lines) / onnx_seconds,
+        "speedup": torch_seconds / onnx_seconds,
+        "cosine_drift": cosine_drift(torch_embeddings, onnx_embeddings),
+    }
+
+
+def read_val_lines(in_path, text_type="text", idioms=("puter", "sursilv", "sutsilv", "surmiran", "vallader")):
+    """All overlap lines of the validation chapters in `in_path`."""
+    lines = []
+    for chap in sorted(os.listdir(in_path)):
+        for idiom in idioms:
+            path = f"{in_path}/{chap}/rm-{idiom}_{text_type}_overlaps.txt"
+            if os.path.isfile(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    lines.extend(f.readlines())
+    return lines
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Export a local embedding model to ONNX (int8) and compare it with the torch model on the validation chapters"
+    )
+    parser.add_argument("--model_name", choices=list(POOLING), required=True)
+    parser.add_argument("--in_path", type=str, default="/projects/text/romansh/textbooks/val_overlaps",
+                        help="Path to the chapter-wise overlap files of the validation set")
+    parser.add_argument("--text_type", type=str, default="text", choices=["text", "html"])
+    parser.add_argument("--onnx_dir", type=str, default=ONNX_DIR)
+    parser.add_argument("--no_int8", action="store_true", help="Compare the float32 ONNX model instead")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--max_tokens", type=int, default=16384, help="Token budget of one batch")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N overlap lines")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import torch
+
+    from embed_overlaps import LocalModelBackend, get_hf_model
+
+    args = get_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    model, tokenizer = get_hf_model(args.model_name)
+    int8 = not args.no_int8
+    if not os.path.isfile(onnx_path(args.model_name, args.onnx_dir, int8)):
+        print(f"Exporting {args.model_name} to {args.onnx_dir}")
+        export_onnx(args.model_name, model, tokenizer, args.onnx_dir, quantize=int8)
+    onnx_model = OnnxEmbedder(args.model_name, tokenizer, args.onnx_dir, int8, args.num_threads)
+
+    lines = read_val_lines(args.in_path, args.text_type)[: args.limit]
+    report = compare_backends(
+        lines,
+        LocalModelBackend(args.model_name, model, tokenizer, args.max_tokens).embed,
+        LocalModelBackend(args.model_name, onnx_model, tokenizer, args.max_tokens).embed,
+    )
+    drift = report["cosine_drift"]
+    print(f"{args.model_name} ({'int8' if int8 else 'fp32'} ONNX vs torch) on {report['lines']} lines")
+    print(f"torch: {report['torch_lines_per_s']:.1f} lines/s, ONNX: {report['onnx_lines_per_s']:.1f} lines/s "
+          f"({report['speedup']:.2f}x)")
+    print(f"cosine drift: mean {drift['mean']:.2e}, p99 {drift['p99']:.2e}, max {drift['max']:.2e}")
@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+
+from emb_store import EmbeddingFormatError, header_path, open_emb, read_emb_header, write_emb_header
+
+PROGRESS_SUFFIX = ".progress.json"
+# bytes of one float32 value
+VALUE_BYTES = np.dtype(np.float32).itemsize
+
+
+def progress_path(emb_path):
+    return f"{emb_path}{PROGRESS_SUFFIX}"
+
+
+def read_progress(emb_path):
+    """Return the sidecar progress record of `emb_path`, or None if there is none (or it is unreadable)."""
+    try:
+        with open(progress_path(emb_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_progress(emb_path, progress):
+    tmp_path = f"{progress_path(emb_path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path(emb_path))
+
+
+def emb_file_complete(emb_path, model, total_lines, expected_dim=None, overlaps_path=None):
+    """
+    Whether `emb_path` holds all `total_lines` vectors of `model`. A finished file
+    has a header (see emb_store) that must match, including the hash of `overlaps_path`
+    if given. Files written before progress records existed have no sidecar; they
+    count as complete if their size is a whole number of vectors per line (of
+    `expected_dim`, if given). Pass the model's dimension as `expected_dim`: without
+    it, a truncated legacy file whose size happens to divide by the line count looks complete.
+    """
+    if not os.path.isfile(emb_path):
+        return False
+    header = read_emb_header(emb_path)
+    if header is not None:
+        if expected_dim is not None and header["dim"] != expected_dim:
+            return False
+        try:
+            open_emb(emb_path, overlaps_path, total_lines, model)
+        except EmbeddingFormatError:
+            return False
+        return True
+    size = os.path.getsize(emb_path)
+    progress = read_progress(emb_path)
+    if progress is None:
+        if not total_lines or size % (total_lines * VALUE_BYTES):
+            return total_lines == 0 and size == 0
+        dim = size // (total_lines * VALUE_BYTES)
+        return dim > 0 and (expected_dim is None or dim == expected_dim)
+    return (
+        progress["model"] == model
+        and progress["total_lines"] == total_lines
+        and progress["lines_done"] == total_lines
+        and size == total_lines * (progress["dim"] or 0) * VALUE_BYTES
+    )
+
+
+class ResumableEmbWriter:
+    """
+    Append float32 vectors to an .emb file, recording after every write how many
+    lines are done, the dimension and the model in a sidecar progress file.
+    Opening a file that has a progress record for the same model and line count
+    resumes after the last complete vector (a partially written vector is cut
+    off); any other existing file is truncated and written from the start.
+    Once all lines are written, the progress record is replaced by the file's
+    header (see emb_store).
+    """
+
+    def __init__(self, emb_path, model, total_lines, overlaps_path=None):
+        self.emb_path = emb_path
+        self.model = model
+        self.total_lines = total_lines
+        self.overlaps_path = overlaps_path
+        self.lines_done = 0
+        self.dim = None
+        self._recover()
+
+    def _recover(self):
+        header = read_emb_header(self.emb_path)
+        if header is not None and emb_file_complete(
+                self.emb_path, self.model, self.total_lines, overlaps_path=self.overlaps_path):
+            self.dim = header["dim"]
+            self.lines_done = self.total_lines
+            return
+        progress = read_progress(self.emb_path)
+        resumable = (
+            progress is not None
+            and progress["model"] == self.model
+            and progress["total_lines"] == self.total_lines
+            and os.path.isfile(self.emb_path)
+        )
+        if resumable and progress["dim"]:
+            self.dim = progress["dim"]
+            # vectors are appended in order, so every whole vector on disk is valid,
+            # even those written after the last progress record
+            whole_vectors = os.path.getsize(self.emb_path) // (self.dim * VALUE_BYTES)
+            self.lines_done = min(whole_vectors, self.total_lines)
+            if whole_vectors != progress["lines_done"] or os.path.getsize(self.emb_path) % (self.dim * VALUE_BYTES):
+                print(f"Repairing {self.emb_path}: resuming after {self.lines_done}/{self.total_lines} lines")
+        elif os.path.isfile(self.emb_path) and os.path.getsize(self.emb_path):
+            print(f"Discarding {self.emb_path}: no matching progress record")
+        with open(self.emb_path, "ab") as f:
+            f.truncate(self.lines_done * (self.dim or 0) * VALUE_BYTES)
+        if os.path.exists(header_path(self.emb_path)):
+            os.remove(header_path(self.emb_path))
+        self._write_progress()
+
+    def _write_progress(self):
+        if self.done:
+            # the header describes the finished file
+            write_emb_header(self.emb_path, self.dim or 0, self.total_lines, self.model, self.overlaps_path)
+            if os.path.exists(progress_path(self.emb_path)):
+                os.remove(progress_path(self.emb_path))
+            return
+        write_progress(self.emb_path, {
+            "model": self.model,
+            "dim": self.dim,
+            "lines_done": self.lines_done,
+            "total_lines": self.total_lines,
+        })
+
+    @property
+    def done(self):
+        return self.lines_done >= self.total_lines
+
+    def write(self, embeddings):
+        """Append the vectors of the next lines (an array of shape (n, dim))."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(embeddings):
+            return
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"{self.emb_path}: got vectors of dimension {embeddings.shape[1]}, expected {self.dim}")
+        if self.lines_done + len(embeddings) > self.total_lines:
+            raise ValueError(f"{self.emb_path}: more vectors than the {self.total_lines} lines")
+        with open(self.emb_path, "ab") as f:
+            embeddings.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.lines_done += len(embeddings)
+        self._write_progress()
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from tqdm import tqdm
+
+from batching import (
+    BACKOFF_BASE,
+    MAX_RETRIES,
+    backoff_delay,
+    check_count,
+    is_content_error,
+    is_transient_error,
+    pack_batches,
+)
+from embedding_cache import store_embedded, text_key
+from rate_limit import TokenBucket
+from resumable_emb import ResumableEmbWriter, emb_file_complete
+
+IDIOMS = ["puter", "sursilv", "sutsilv", "surmiran", "vallader"]
+
+
+@dataclass
+class EmbeddingJob:
+    book: str
+    chapter: str
+    idiom: str
+    text_path: str
+    emb_path: str
+
+
+def find_pending_jobs(in_path, out, model_name, books=None, text_type="text", expected_dim=None):
+    """
+    List an EmbeddingJob for every overlap file of `books` (default: all books in
+    `in_path`) whose .emb file under `out` is missing, partial, from another model
+    or (with `expected_dim`, the model's dimension) of another dimension.
+    """
+    jobs = []
+    for book in sorted(os.listdir(in_path) if books is None else books):
+        book_path = os.path.join(in_path, book)
+        for chapter in sorted(os.listdir(book_path)):
+            for idiom in IDIOMS:
+                text_path = f"{book_path}/{chapter}/rm-{idiom}_{text_type}_overlaps.txt"
+                if not os.path.isfile(text_path):
+                    continue
+                emb_path = f"{out}/{book}/{chapter}/rm-{idiom}_{text_type}_overlaps.emb"
+                with open(text_path, "r", encoding="utf-8") as f:
+                    num_lines = sum(1 for _ in f)
+                if emb_file_complete(emb_path, model_name, num_lines, expected_dim, text_path):
+                    print(f"Already embedded {idiom} {chapter} in {book}")
+                    continue
+                jobs.append(EmbeddingJob(book, chapter, idiom, text_path, emb_path))
+    return jobs
+
+
+class EmbeddingScheduler:
+    """
+    Embed many overlap files with one API `EmbeddingBackend` concurrently.
+    Requests of all files share at most `concurrency` calls in flight and a
+    token bucket of `rate` calls per second (defaults: the backend's
+    capabilities). This is the only retry policy: the backend makes one attempt
+    per request, transient failures are retried with jittered exponential
+    backoff, and requests rejected for their content are split in halves;
+    the texts are never reordered.
+    At most `max_files` files (default: twice the concurrency) are open at a
+    time. A text missing from the cache is embedded once per run, even if
+    several open files contain it, and each .emb file is written, with its
+    progress record, as soon as a prefix of its lines is embedded.
+    """
+
+    def __init__(self, backend, cache=None, text_type="text", concurrency=None, rate=None,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, max_files=None):
+        capabilities = backend.capabilities
+        self.backend = backend
+        self.model_name = backend.name
+        self.cache = cache
+        self.text_type = text_type
+        self.concurrency = concurrency or capabilities.concurrency or 4
+        self.rate = rate or capabilities.rate or 10
+        self.max_files = max_files or 2 * self.concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.in_flight = 0
+        self.failed_requests = 0
+
+    async def _request(self, texts):
+        """
+        Embed `texts` in one request, retrying transient errors (rate limits,
+        server and network errors) with jittered backoff. A request rejected for
+        its content is split in halves; any other error is raised at once.
+        """
+        for attempt in range(self.max_retries):
+            await self.bucket.acquire()
+            async with self.semaphore:
+                self.in_flight += 1
+                try:
+                    return check_count(await asyncio.to_thread(self.backend.embed_batch, texts), texts)
+                except Exception as e:
+                    self.failed_requests += 1
+                    if is_content_error(e) and len(texts) > 1:
+                        break
+                    if not is_transient_error(e) or attempt + 1 == self.max_retries:
+                        raise
+                finally:
+                    self.in_flight -= 1
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_base))
+        middle = len(texts) // 2
+        halves = await asyncio.gather(self._request(texts[:middle]), self._request(texts[middle:]))
+        return np.concatenate(halves)
+
+    async def _embed_missing(self, missing):
+        """
+        Embed the texts of `missing` ({key: text}) in request-sized batches and
+        resolve the pending future of each key (adding the vectors to the cache).
+        """
+        keys, texts = list(missing), list(missing.values())
+
+        async def embed_batch(batch):
+            batch_keys = [keys[i] for i in batch]
+            try:
+                embeddings = await self._request([texts[i] for i in batch])
+            except Exception as e:
+                for key in batch_keys:
+                    future = self._pending.pop(key)
+                    future.set_exception(e)
+                    # raised below; files that stopped before awaiting the future must not log it again
+                    future.exception()
+                raise
+            if self.cache is not None:
+                store_embedded(self.cache, self.model_name, self.text_type, {}, batch_keys, embeddings)
+            for key, vector in zip(batch_keys, embeddings):
+                self._pending.pop(key).set_result(vector)
+
+        capabilities = self.backend.capabilities
+        batches = pack_batches(self.backend.token_lengths(texts), capabilities.max_batch_size, capabilities.max_tokens)
+        await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+    async def _write_in_order(self, writer, keys, vectors, futures):
+        """Append the vectors of `keys` to `writer` whenever the next lines in file order are available."""
+        chunk = []
+        for i, key in enumerate(keys):
+            chunk.append(vectors[key] if key in vectors else await futures[key])
+            last = i + 1 == len(keys)
+            if last or (keys[i + 1] not in vectors and not futures[keys[i + 1]].done()):
+                writer.write(np.stack(chunk))
+                self.progress.update(len(chunk))
+                chunk = []
+
+    async def _run_job(self, job):
+        with open(job.text_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        os.makedirs(os.path.dirname(job.emb_path), exist_ok=True)
+        writer = ResumableEmbWriter(job.emb_path, self.model_name, len(lines), job.text_path)
+        self.progress.update(writer.lines_done)
+        lines = lines[writer.lines_done:]
+        keys = [text_key(line) for line in lines]
+        vectors = {} if self.cache is None else self.cache.get_many(self.model_name, self.text_type, set(keys))
+        # a text another open file is already embedding is awaited, not sent again
+        futures, missing = {}, {}
+        for key, line in zip(keys, lines):
+            if key in vectors or key in futures:
+                continue
+            if key not in self._pending:
+                self._pending[key] = asyncio.get_running_loop().create_future()
+                missing[key] = line
+            futures[key] = self._pending[key]
+        if self.cache is not None:
+            num_misses = sum(key in missing for key in keys)
+            self.cache.hits += len(keys) - num_misses
+            self.cache.misses += num_misses
+        await asyncio.gather(self._embed_missing(missing), self._write_in_order(writer, keys, vectors, futures))
+        self.files_done += 1
+
+    async def _run_job_in_slot(self, job):
+        async with self.file_slots:
+            await self._run_job(job)
+
+    async def _report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self._set_postfix()
+
+    def _set_postfix(self):
+        self.progress.set_postfix(
+            files=f"{self.files_done}/{self.num_files}",
+            in_flight=self.in_flight,
+            headroom=f"{self.bucket.headroom()}/{self.bucket.capacity}",
+            failed=self.failed_requests,
+        )
+
+    async def run(self, jobs, report_interval=1.0):
+        """Embed all `jobs`; the progress bar shows lines per second and the rate-limit headroom."""
+        self.bucket = TokenBucket(self.rate, capacity=max(1, int(self.rate)))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.file_slots = asyncio.Semaphore(self.max_files)
+        # key -> future of the vector of a text being embedded, shared by all open files
+        self._pending = {}
+        self.files_done, self.num_files = 0, len(jobs)
+        total_lines = 0
+        for job in jobs:
+            with open(job.text_path, "r", encoding="utf-8") as f:
+                total_lines += sum(1 for _ in f)
+        start = time.monotonic()
+        with tqdm(total=total_lines, unit="line", desc=f"Embedding with {self.model_name}") as self.progress:
+            reporter = asyncio.ensure_future(self._report(report_interval))
+            try:
+                await asyncio.gather(*(self._run_job_in_slot(job) for job in jobs))
+            finally:
+                reporter.cancel()
+                self._set_postfix()
+        elapsed = time.monotonic() - start
+        print(f"Embedded {self.num_files} files in {elapsed:.1f}s ({self.progress.n / max(elapsed, 1e-9):.1f} lines/s)")
@@ -1,177 +1,187 @@
 import re
+from functools import lru_cache
 from html import unescape
 
-def strip_html_tags(text):
-    """Remove HTML tags, unescape HTML entities, and convert <b> to <strong>."""
+_B_OPEN_TAG = re.compile(r'<b\b[^>]*>', re.IGNORECASE)
+_B_CLOSE_TAG = re.compile(r'</b\s*>', re.IGNORECASE)
+# all tags except <strong> and </strong>
+_OTHER_TAG = re.compile(r'<(?!\/?strong\b)[^>]+>')
+
+
+# Only short strings (titles, memo titles, small markup) repeat often enough to be worth
+# memoizing; caching long markup would keep whole segments alive in every extraction worker
+MEMO_MAX_LENGTH = 256
+
+
+def _strip_html_tags(text):
     text = unescape(text)
+    if '<' not in text:
+        # no tags to convert or remove (titles, memo titles, plain markup)
+        return text.strip()
     # Convert <b> and </b> to <strong> and </strong>
-    text = re.sub(r'<b\b[^>]*>', '<strong>', text, flags=re.IGNORECASE)
-    text = re.sub(r'</b\s*>', '</strong>', text, flags=re.IGNORECASE)
+    text = _B_CLOSE_TAG.sub('</strong>', _B_OPEN_TAG.sub('<strong>', text))
     # Remove all other HTML tags, except for <strong> and </strong>
-    text = re.sub(r'<(?!\/?strong\b)[^>]+>', '', text)
-    return text.strip()
+    return _OTHER_TAG.sub('', text).strip()
+
+
+_strip_short_html_tags = lru_cache(maxsize=4096)(_strip_html_tags)
+
+
+def strip_html_tags(text):
+    """Remove HTML tags, unescape HTML entities, and convert <b> to <strong>."""
+    if len(text) <= MEMO_MAX_LENGTH:
+        return _strip_short_html_tags(text)
+    return _strip_html_tags(text)
+
+_DONE = object()
+
+
+def walk_texts(obj, split_main_content=False, in_main_content=False):
+    """
+    Collect the text pieces of an Umbraco node in one depth-first pass over an
+    explicit stack (no recursion, so deep nodes cannot hit the recursion limit).
+    `url` fields and Image dicts are skipped without descending into them.
+
+    Returns (texts, htmls), or with `split_main_content`
+    (workbook_texts, teacher_texts, workbook_htmls, teacher_htmls):
+    mainContent.markup goes to the teacher's commentary, everything else to the workbook.
+    `in_main_content` is the context of `obj` itself (see collect_texts_workbook_commentary).
+    """
+    texts, htmls = [], []
+    teacher_texts, teacher_htmls = [], []
+    # frames of (holder dict or None for a list, iterator over its items, main content context);
+    # a frame's loop breaks out to descend into a child and resumes from its iterator afterwards
+    stack = [(None, iter((obj,)), in_main_content)]
+    while stack:
+        holder, items, context = stack[-1]
+        for item in items:
+            if holder is None:
+                # list items keep the context of their list
+                val, child_context = item, context
+            else:
+                key, val = item
+                if key == 'url':
+                    continue
+                child_context = False
+
+                if not split_main_content:
+                    if key == 'memoTitle':
+                        if isinstance(val, str):
+                            texts.append(val)
+                            htmls.append(val)
+                    elif key == 'properties':
+                        if isinstance(val, dict):
+                            title = val.get('title')
+                            if title and holder.get("contentType") != "chapter":
+                                texts.append(title)
+                                htmls.append(title)
+                    elif key == 'markup':
+                        if isinstance(val, str):
+                            stripped = strip_html_tags(val)
+                            if stripped:
+                                texts.append(stripped)
+                                htmls.append(val)
+
+                elif key == 'mainContent' or key == 'mainContent2':
+                    if not isinstance(val, dict):
+                        continue
+                    markup = val.get('markup')
+                    if markup and isinstance(markup, str):
+                        stripped = strip_html_tags(markup)
+                        if stripped:
+                            if key == 'mainContent':
+                                teacher_texts.append(stripped)
+                                teacher_htmls.append(markup)
+                            else:
+                                texts.append(stripped) # mainContent2.markup to workbook
+                                htmls.append(markup)
+                    # the mainContent markup was handled here, not again inside it
+                    child_context = key == 'mainContent'
+                elif key == 'memoTitle':
+                    if isinstance(val, str):
+                        texts.append(val)
+                        htmls.append(val)
+                elif key == 'properties':
+                    if not isinstance(val, dict):
+                        continue
+                    # 'title' within 'properties' depends on the contentType of the holder of 'properties'
+                    title = val.get('title')
+                    if title and isinstance(title, str) and holder.get("contentType") != "chapter":
+                        texts.append(strip_html_tags(title))
+                        htmls.append(title)
+                elif key == 'markup':
+                    if isinstance(val, str) and not context: # we want to collect all non-mainContent markup into the workbook
+                        stripped = strip_html_tags(val)
+                        if stripped:
+                            texts.append(stripped)
+                            htmls.append(val)
+
+            # parsed JSON only holds plain dicts and lists, so exact type checks suffice
+            val_type = type(val)
+            if val_type is dict:
+                if val.get('mediaType') != 'Image':
+                    stack.append((val, iter(val.items()), child_context))
+                    break
+            elif val_type is list:
+                stack.append((None, iter(val), child_context))
+                break
+        else:
+            stack.pop()
+
+    if split_main_content:
+        return texts, teacher_texts, htmls, teacher_htmls
+    return texts, htmls
 
 def collect_texts(obj, texts, html_pieces):
     """
     Walk through dicts/lists and append any
     matching text pieces into `texts` list.
     """
-    if isinstance(obj, dict):
-        # skip pure image entries
-        if obj.get('mediaType') == 'Image':
-            return
-
-        for key, val in obj.items():
-            if key == 'url':
-                continue
-
-            if key in ('memoTitle') and isinstance(val, str):
-                texts.append(val)
-                html_pieces.append(val)
-
-            if key == 'properties' and isinstance(val, dict):
-                title = val.get('title')
-                if title and obj["contentType"] != "chapter":
-                    texts.append(title)
-                    html_pieces.append(title)
-
-            if key == 'markup' and isinstance(val, str):
-                stripped = strip_html_tags(val)
-                if stripped:
-                    texts.append(stripped)
-                    html_pieces.append(val)
-
-            # recurse
-            collect_texts(val, texts, html_pieces)
-
-    elif isinstance(obj, list):
-        for item in obj:
-            collect_texts(item, texts, html_pieces)
+    found_texts, found_htmls = walk_texts(obj)
+    texts.extend(found_texts)
+    html_pieces.extend(found_htmls)
 
 def collect_texts_workbook_commentary(obj, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, current_obj_is_main_content_context, parent_content_type=None):
     """
-    Recursive helper to collect texts into workbook and teacher lists.
+    Collect texts into workbook and teacher lists.
     - current_obj_is_main_content_context: True if 'obj' is the content of a 'mainContent' field.
       This helps decide where generic 'markup' fields go.
-    - parent_content_type: The 'contentType' of the object that contained the current 'obj'
-      if 'obj' is, for example, a 'properties' dictionary.
+    - parent_content_type: kept for compatibility; the split does not depend on it.
     """
-    if isinstance(obj, dict):
-        if obj.get('mediaType') == 'Image':
-            return
-
-        for key, val in obj.items():
-            if key == 'url':
-                continue
-
-            if key == 'mainContent' and isinstance(val, dict):
-                markup = val.get('markup')
-                if markup and isinstance(markup, str):
-                    stripped = strip_html_tags(markup)
-                    if stripped:
-                        teacher_texts.append(stripped)
-                        teacher_htmls.append(markup)
-                collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, True, obj.get("contentType"))
-            
-            elif key == 'mainContent2' and isinstance(val, dict):
-                markup = val.get('markup')
-                if markup and isinstance(markup, str):
-                    stripped = strip_html_tags(markup)
-                    if stripped:
-                        workbook_texts.append(stripped) # mainContent2.markup to workbook
-                        workbook_htmls.append(markup)
-                collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
-
-            elif key == 'memoTitle' and isinstance(val, str):
-                workbook_texts.append(val)
-                workbook_htmls.append(val)
-            
-            elif key == 'properties' and isinstance(val, dict):
-                # 'title' within 'properties' depends on the contentType of 'obj' (the holder of 'properties')
-                title = val.get('title')
-                if title and isinstance(title,str) and obj.get("contentType") != "chapter":
-                    workbook_texts.append(strip_html_tags(title))
-                    workbook_htmls.append(title)
-                collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
-            
-            elif key == 'markup' and isinstance(val, str):
-                if not current_obj_is_main_content_context: # we want to collect all non-mainContent markup into workbook_texts
-                    stripped = strip_html_tags(val)
-                    if stripped:
-                        workbook_texts.append(stripped)
-                        workbook_htmls.append(val)
-            
-            elif isinstance(val, (dict, list)) and key not in ('mainContent', 'mainContent2', 'properties'):
-                 collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
-
-    elif isinstance(obj, list):
-        for item in obj:
-            # Propagate context and parent_content_type. parent_content_type might be less relevant for list items directly.
-            collect_texts_workbook_commentary(item, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, current_obj_is_main_content_context, parent_content_type)
+    wb, tc, wb_htmls, tc_htmls = walk_texts(obj, True, current_obj_is_main_content_context)
+    workbook_texts.extend(wb)
+    teacher_texts.extend(tc)
+    workbook_htmls.extend(wb_htmls)
+    teacher_htmls.extend(tc_htmls)
+
+def first_html_by_text(texts, htmls):
+    """Map each distinct text to the HTML it was first collected with, in first-seen order."""
+    first_html = {}
+    for text, html in zip(texts, htmls):
+        if text not in first_html:
+            first_html[text] = html
+    return first_html
 
 def extract_text(obj):
     """
-    Return all text from the dict.
+    Return all text from the dict, plus the deduplicated texts and their HTML.
     """
-    bits = []
-    html_bits = []
-    collect_texts(obj, bits, html_bits)
-
-    unique_texts_intermediate = []
-    corresponding_htmls_intermediate = []
-    seen_texts = set()
-
-    for i, text_item in enumerate(bits):
-        # Deduplicate based on the stripped text_item
-        if text_item not in seen_texts:
-            unique_texts_intermediate.append(text_item)
-            if i < len(html_bits): # Ensure index is valid for HTML list
-                corresponding_htmls_intermediate.append(html_bits[i])
-            else:
-                # This case should ideally not be reached if collect_texts is correct
-                corresponding_htmls_intermediate.append("") # Fallback
-            seen_texts.add(text_item)
-    return "\n".join(bits), unique_texts_intermediate, corresponding_htmls_intermediate # Return both
+    bits, html_bits = walk_texts(obj)
+    unique = first_html_by_text(bits, html_bits)
+    return "\n".join(bits), list(unique), list(unique.values())
 
 def extract_text_workbook_teacher(obj):
     """
     Extracts texts into workbook and teacher commentary.
     Workbook: general texts + mainContent2.markup
     Teacher Commentary: mainContent.markup
+    Both are deduplicated while preserving order, each text keeping the HTML it was first seen with.
     """
-    workbook_bits = []
-    teacher_bits = []
-    workbook_htmls = []
-    teacher_htmls = []
-
-    collect_texts_workbook_commentary(obj, workbook_bits, teacher_bits, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
-    
-    # Remove duplicates while preserving order (Python 3.7+)
-    # This is a safeguard; ideally, the logic prevents duplicate additions of the same text item.
-    unique_workbook_bits = list(dict.fromkeys(workbook_bits))
-    unique_teacher_bits = list(dict.fromkeys(teacher_bits))
-
-    workbook_string = "\n".join(unique_workbook_bits)
-    teacher_commentary_string = "\n".join(unique_teacher_bits)
-
-    unique_workbook_texts_intermediate = []
-    corresponding_workbook_htmls = []
-    seen_wb_texts = set()
-    for i, text in enumerate(workbook_bits):
-        if text not in seen_wb_texts:
-            unique_workbook_texts_intermediate.append(text)
-            if i < len(workbook_htmls): # Ensure index is valid for HTML list
-                corresponding_workbook_htmls.append(workbook_htmls[i])
-            seen_wb_texts.add(text)
-    
-    unique_teacher_texts_intermediate = []
-    corresponding_teacher_htmls = []
-    seen_tc_texts = set()
-    for i, text in enumerate(teacher_bits):
-        if text not in seen_tc_texts:
-            unique_teacher_texts_intermediate.append(text)
-            if i < len(teacher_htmls): # Ensure index is valid for HTML list
-                corresponding_teacher_htmls.append(teacher_htmls[i])
-            seen_tc_texts.add(text)
-    
-    return workbook_string, teacher_commentary_string, unique_workbook_texts_intermediate, unique_teacher_texts_intermediate, corresponding_workbook_htmls, corresponding_teacher_htmls
+    workbook_bits, teacher_bits, workbook_htmls, teacher_htmls = walk_texts(obj, True)
+    workbook = first_html_by_text(workbook_bits, workbook_htmls)
+    teacher = first_html_by_text(teacher_bits, teacher_htmls)
+    return (
+        "\n".join(workbook), "\n".join(teacher),
+        list(workbook), list(teacher),
+        list(workbook.values()), list(teacher.values()),
+    )
@@ -1,124 +1,448 @@
+import argparse
+import asyncio
 import requests
 import time
+import hashlib
 import json
 import os
-from constants import API_KEY, ROOT_ID, BASE_URL, PAGE_SIZE, MAX_DEPTH
+from collections import deque
+from requests.adapters import HTTPAdapter
+from constants import API_KEY, ROOT_ID, BASE_URL, PAGE_SIZE, MAX_DEPTH, CONCURRENCY, REQUESTS_PER_SECOND
+from rate_limit import TokenBucket
 
 headers = {
     "Api-Key":    API_KEY,
     "Start-Item": ROOT_ID
 }
+EXPAND_ALL = "properties[$all]"
 
 
-def fetch_node(node_id):
+def make_session(pool_size=CONCURRENCY):
+    """Return a requests session whose connection pool can serve `pool_size` concurrent requests."""
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_node(node_id, session=requests, expand=EXPAND_ALL):
     url    = f"{BASE_URL}/item/{node_id}"
-    params = {"expand": "properties[$all]"}
-    r = requests.get(url, headers=headers, params=params)
+    params = {"expand": expand}
+    r = session.get(url, headers=headers, params=params)
     r.raise_for_status()
     return r.json()
 
 
-def fetch_children(parent_id, skip=0, take=PAGE_SIZE):
+def fetch_children(parent_id, skip=0, take=PAGE_SIZE, session=requests, delay=0.5, expand=EXPAND_ALL):
     print(f"⮕ paging children of {parent_id} @ skip={skip}")
     params = {
-        "expand":    "properties[$all]",
+        "expand":    expand,
         "fetch":     f"children:{parent_id}",
         "skip":      skip,
         "take":      take
     }
-    r = requests.get(BASE_URL, headers=headers, params=params)
-    time.sleep(0.5)
+    r = session.get(BASE_URL, headers=headers, params=params)
+    if delay:
+        time.sleep(delay)
     r.raise_for_status()
     return r.json().get("items", [])
 
 
-def fetch_flat_descendants(parent_id, skip=0, take=PAGE_SIZE):
+def fetch_flat_descendants(parent_id, skip=0, take=PAGE_SIZE, session=requests, delay=0.5, expand=EXPAND_ALL):
     print(f"⮕ flat descendants of {parent_id} @ skip={skip}")
     params = {
-        "expand":    "properties[$all]",
+        "expand":    expand,
         "fetch":     f"descendants:{parent_id}",
         "skip":      skip,
         "take":      take
     }
-    r = requests.get(BASE_URL, headers=headers, params=params)
-    time.sleep(0.5)
+    r = session.get(BASE_URL, headers=headers, params=params)
+    if delay:
+        time.sleep(delay)
     r.raise_for_status()
     return r.json().get("items", [])
 
 
-def fetch_all_descendants(root_id):
-    all_items = []
-    # queue holds (node_id, depth)
-    queue = [(root_id, 0)]
+def iter_unique(items, seen_ids):
+    """Yield items whose id is set and not yet in `seen_ids`, updating `seen_ids` in place."""
+    for item in items:
+        item_id = item.get("id")
+        if item_id is not None and item_id not in seen_ids:
+            seen_ids.add(item_id)
+            yield item
 
-    while queue:
-        current, depth = queue.pop(0)
-        # 1) fetch the node itself
-        node = fetch_node(current)
-        all_items.append(node)
 
-        if depth < MAX_DEPTH:
-            # 2) page through its immediate children, enqueue for next level
-            skip = 0
-            while True:
-                children = fetch_children(current, skip=skip)
-                if not children:
-                    break
-                all_items.extend(children)
-                queue.extend((c["id"], depth+1) for c in children)
-                skip += len(children)
-                if len(children) < PAGE_SIZE:
-                    break
+def read_export_ids(export_file):
+    """Return the set of item ids already written to a JSONL export."""
+    seen_ids = set()
+    with open(export_file, "r", encoding="utf-8") as f:
+        for line in f:
+            item_id = json.loads(line).get("id")
+            if item_id is not None:
+                seen_ids.add(item_id)
+    return seen_ids
+
+
+class CheckpointedExport:
+    """
+    JSONL export that is written while crawling.
+    Items are appended as they arrive to `<output_file>.partial` and deduplicated
+    against the ids already on disk. After every page the crawl frontier, a list
+    of [node_id, depth, skip] entries, is saved to a checkpoint file together
+    with the partial file's byte size, so a rerun truncates any half-written tail
+    and resumes from the frontier. Once the crawl completes the partial file
+    replaces `output_file` and the checkpoint is removed; until then a previous
+    export at `output_file` is left untouched.
+    """
+
+    def __init__(self, output_file, root_id, checkpoint_file=None):
+        self.output_file = output_file
+        self.partial_file = f"{output_file}.partial"
+        self.root_id = root_id
+        self.checkpoint_file = checkpoint_file or f"{os.path.splitext(output_file)[0]}.checkpoint.json"
+        self.fetched = 0
+        self.written = 0
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        checkpoint = self._load_checkpoint(root_id)
+        if checkpoint is None:
+            self.frontier = [[root_id, 0, 0]]
+            self.seen_ids = set()
+            self.file = open(self.partial_file, "wb")
         else:
-            # 3) at max depth: fetch ALL descendants flat (<=10k)
-            skip = 0
+            self.frontier = checkpoint["frontier"]
+            self.fetched = checkpoint["fetched"]
+            with open(self.partial_file, "r+b") as f:
+                f.truncate(checkpoint["offset"])
+            self.seen_ids = read_export_ids(self.partial_file)
+            self.written = len(self.seen_ids)
+            self.file = open(self.partial_file, "ab")
+            print(f"⮕ resuming from checkpoint: {self.written} items on disk, {len(self.frontier)} nodes in frontier")
+
+    def _load_checkpoint(self, root_id):
+        if not (os.path.isfile(self.checkpoint_file) and os.path.isfile(self.partial_file)):
+            return None
+        with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("root_id") != root_id:
+            print(f"Ignoring checkpoint '{self.checkpoint_file}' for a different root")
+            return None
+        return checkpoint
+
+    def write(self, items):
+        self.fetched += len(items)
+        for item in iter_unique(items, self.seen_ids):
+            self.file.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.written += 1
+
+    def save(self, frontier):
+        self.frontier = [list(entry) for entry in frontier]
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        checkpoint = {
+            "root_id": self.root_id,
+            "frontier": self.frontier,
+            "offset": self.file.tell(),
+            "fetched": self.fetched,
+        }
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.partial_file, self.output_file)
+            if os.path.isfile(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+        return False
+
+
+def fetch_all_descendants(root_id, output_file="raw_data/umbraco-export.v1.jsonl", checkpoint_file=None,
+                          expand=EXPAND_ALL):
+    """
+    Breadth-first crawl of the tree below `root_id`, streaming unique items to
+    `output_file`. An interrupted crawl resumes from its checkpoint. Returns the
+    number of items written. With `expand=None` only the unexpanded listing of
+    the tree is fetched.
+    """
+    with CheckpointedExport(output_file, root_id, checkpoint_file) as export:
+        # frontier holds [node_id, depth, skip]; skip > 0 means the node and its
+        # first `skip` children/descendants are already on disk
+        frontier = deque(export.frontier)
+
+        while frontier:
+            current, depth, skip = frontier[0]
+            # 1) fetch the node itself
+            if skip == 0:
+                export.write([fetch_node(current, expand=expand)])
+
+            if depth < MAX_DEPTH:
+                # 2) page through its immediate children, enqueue for next level
+                fetch_page = fetch_children
+            else:
+                # 3) at max depth: fetch ALL descendants flat (<=10k)
+                fetch_page = fetch_flat_descendants
             while True:
-                desc = fetch_flat_descendants(current, skip=skip)
-                if not desc:
+                page = fetch_page(current, skip=skip, take=PAGE_SIZE, expand=expand)
+                if not page:
                     break
-                all_items.extend(desc)
-                skip += len(desc)
-                if len(desc) < PAGE_SIZE:
+                export.write(page)
+                if depth < MAX_DEPTH:
+                    frontier.extend([c["id"], depth+1, 0] for c in page)
+                skip += len(page)
+                frontier[0] = [current, depth, skip]
+                export.save(frontier)
+                if len(page) < PAGE_SIZE:
                     break
 
-        print(f"Fetched total so far: {len(all_items)}")
-    return all_items
+            frontier.popleft()
+            export.save(frontier)
+            print(f"Fetched total so far: {export.fetched}")
+    return export.written
 
 
-def remove_duplicates(list_of_items):
-    print(f"Removing duplicates from {len(list_of_items)} items...")
-    unique_items = []
-    seen_ids = set()
+async def _fetch_subtree_async(node_id, depth, skip, request, expand=EXPAND_ALL):
+    """
+    Fetch one frontier entry: the node itself (unless `skip` shows it is already
+    on disk) plus all pages of its children, or of its flat descendants at
+    MAX_DEPTH. Returns the items in the order the serial crawler writes them,
+    and the [node_id, depth, skip] entries to enqueue.
+    """
+    page_fn = fetch_children if depth < MAX_DEPTH else fetch_flat_descendants
+    node_task = asyncio.ensure_future(request(fetch_node, node_id, expand=expand)) if skip == 0 else None
+    pages = []
+    while True:
+        page = await request(page_fn, node_id, skip=skip, take=PAGE_SIZE, delay=0, expand=expand)
+        if not page:
+            break
+        pages.extend(page)
+        skip += len(page)
+        if len(page) < PAGE_SIZE:
+            break
+    items = [await node_task] + pages if node_task is not None else pages
+    children = [[item["id"], depth+1, 0] for item in pages] if depth < MAX_DEPTH else []
+    return items, children
 
-    for item in list_of_items:
-        item_id = item.get("id")
-        if item_id is not None and item_id not in seen_ids:
-            unique_items.append(item)
-            seen_ids.add(item_id)
-    print(f"Count after removing duplicates: {len(unique_items)}")
-    return unique_items
 
+def make_async_request(session, concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND):
+    """
+    Return a coroutine function `request(fn, *args, **kwargs)` that runs one of the
+    blocking fetch functions on `session` in a worker thread, with at most
+    `concurrency` calls in flight and at most `rate` calls started per second.
+    """
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
 
-def save_to_file(data, output_file="raw_data/umbraco-export.v1.jsonl"):
-    print(f"Saving {len(data)} items to '{output_file}'...")
-    total_items_written = 0
+    async def request(fn, *args, **kwargs):
+        await bucket.acquire()
+        async with semaphore:
+            return await asyncio.to_thread(fn, *args, session=session, **kwargs)
+
+    return request
+
+
+async def fetch_all_descendants_async(root_id, output_file="raw_data/umbraco-export.v1.jsonl", checkpoint_file=None,
+                                      concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND, expand=EXPAND_ALL):
+    """
+    Concurrent version of `fetch_all_descendants`.
+    Frontier entries are fetched ahead of time in a sliding window of tasks over
+    one pooled session, while results are written strictly in frontier order, so
+    the export is identical to the serial crawl. At most `concurrency` requests
+    are in flight and their rate is capped by a token bucket instead of fixed sleeps.
+    The checkpoint is saved after each completed node.
+    """
+    session = make_session(concurrency)
+    request = make_async_request(session, concurrency, rate)
+    pending = deque()  # (entry, task) for the head of the frontier, in order
+    window = 2 * concurrency
     try:
-        output_dir = os.path.dirname(output_file)
-        if output_dir: # Check if output_dir is not empty (i.e., not just a filename)
-            os.makedirs(output_dir, exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for item in data:
-                json_string = json.dumps(item, ensure_ascii=False)
-                f.write(json_string + '\n')
-                total_items_written += 1
-        print(f"✅ Successfully saved {total_items_written} items to '{output_file}'")
-    except Exception as e:
-        print(f"❌ Error writing to file: {e}")
+        with CheckpointedExport(output_file, root_id, checkpoint_file) as export:
+            queue = deque(export.frontier)
+            while queue or pending:
+                while queue and len(pending) < window:
+                    entry = queue.popleft()
+                    pending.append((entry, asyncio.ensure_future(_fetch_subtree_async(*entry, request, expand))))
+                items, children = await pending[0][1]
+                pending.popleft()
+                export.write(items)
+                queue.extend(children)
+                export.save([entry for entry, _ in pending] + list(queue))
+                print(f"Fetched total so far: {export.fetched}")
+    finally:
+        for _, task in pending:
+            task.cancel()
+        session.close()
+    return export.written
+
+
+def content_hash(item):
+    """Stable hash of an item's content, used when the API gives no update timestamp."""
+    return hashlib.sha256(json.dumps(item, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def index_export(export_file):
+    """
+    Map each item id of a JSONL export to (byte offset, updateDate, route path),
+    so unchanged items can later be copied over without keeping them in memory.
+    """
+    index = {}
+    with open(export_file, "rb") as f:
+        offset = 0
+        for line in f:
+            item = json.loads(line)
+            if item.get("id") is not None and item["id"] not in index:
+                index[item["id"]] = (offset, item.get("updateDate"), (item.get("route") or {}).get("path"))
+            offset += len(line)
+    return index
+
+
+def read_export_line(f, offset):
+    f.seek(offset)
+    return f.readline()
+
+
+def write_item(f, item):
+    f.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+async def _fetch_nodes_to_file_async(node_ids, f, concurrency, rate):
+    """
+    Fetch `node_ids` concurrently and write them to `f` in order, one window of
+    4 x `concurrency` nodes at a time, so only that window is held in memory.
+    """
+    session = make_session(concurrency)
+    request = make_async_request(session, concurrency, rate)
+    window = 4 * concurrency
+    try:
+        for start in range(0, len(node_ids), window):
+            batch = node_ids[start:start + window]
+            for item in await asyncio.gather(*(request(fetch_node, node_id) for node_id in batch)):
+                write_item(f, item)
+    finally:
+        session.close()
+
+
+def sync_export(root_id, previous_file, output_file="raw_data/umbraco-export.v1.jsonl", changelog_file=None,
+                async_crawl=False, concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND):
+    """
+    Delta sync against an existing export.
+    1) crawl the tree without expanding properties to list every current item,
+    2) fully fetch only items that are new or whose updateDate differs from
+       `previous_file` (items without an updateDate are fetched and compared by
+       content hash),
+    3) write the new export in crawl order, copying unchanged lines verbatim
+       and merging in the fetched items, which are streamed to a temp JSONL,
+    4) write a changelog of added/modified/removed ids and the route paths they
+       touch, so downstream caches can rebuild only the affected books.
+    Returns the changelog dict.
+    """
+    changelog_file = changelog_file or f"{os.path.splitext(output_file)[0]}.changelog.json"
+    listing_file = f"{os.path.splitext(output_file)[0]}.listing.jsonl"
+
+    print(f"Indexing previous export '{previous_file}' …")
+    previous = index_export(previous_file)
+
+    if async_crawl:
+        asyncio.run(fetch_all_descendants_async(root_id, listing_file, concurrency=concurrency, rate=rate, expand=None))
+    else:
+        fetch_all_descendants(root_id, listing_file, expand=None)
+
+    # ids whose full content must be downloaded, in crawl order
+    to_fetch = []
+    with open(listing_file, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            prev = previous.get(item["id"])
+            if prev is None or item.get("updateDate") is None or item.get("updateDate") != prev[1]:
+                to_fetch.append(item["id"])
+    print(f"⮕ {len(to_fetch)} new or changed nodes to fetch")
+
+    # fetched items are streamed to disk in the order of `to_fetch`, i.e. listing order
+    fetched_file = f"{os.path.splitext(output_file)[0]}.fetched.jsonl"
+    with open(fetched_file, "wb") as fetched_out:
+        if async_crawl:
+            asyncio.run(_fetch_nodes_to_file_async(to_fetch, fetched_out, concurrency, rate))
+        else:
+            for node_id in to_fetch:
+                write_item(fetched_out, fetch_node(node_id))
+
+    changelog = {"since": previous_file, "added": [], "modified": [], "removed": [], "paths": set()}
+    current_ids = set()
+    next_fetched = 0
+    tmp_file = f"{output_file}.tmp"
+    with open(listing_file, "r", encoding="utf-8") as listing, open(previous_file, "rb") as prev_f, \
+            open(fetched_file, "rb") as fetched, open(tmp_file, "wb") as out:
+        for line in listing:
+            node_id = json.loads(line)["id"]
+            current_ids.add(node_id)
+            prev = previous.get(node_id)
+            if next_fetched == len(to_fetch) or to_fetch[next_fetched] != node_id:
+                out.write(read_export_line(prev_f, prev[0]))
+                continue
+            next_fetched += 1
+            new_line = fetched.readline()
+            item = json.loads(new_line)
+            if prev is None:
+                changelog["added"].append(node_id)
+            else:
+                old_line = read_export_line(prev_f, prev[0])
+                if content_hash(json.loads(old_line)) == content_hash(item):
+                    out.write(old_line)
+                    continue
+                changelog["modified"].append(node_id)
+                changelog["paths"].add(prev[2])
+            changelog["paths"].add((item.get("route") or {}).get("path"))
+            out.write(new_line)
+    os.replace(tmp_file, output_file)
+    os.remove(listing_file)
+    os.remove(fetched_file)
+
+    for node_id, (_, _, path) in previous.items():
+        if node_id not in current_ids:
+            changelog["removed"].append(node_id)
+            changelog["paths"].add(path)
+    changelog["paths"] = sorted(p for p in changelog["paths"] if p)
+    with open(changelog_file, "w", encoding="utf-8") as f:
+        json.dump(changelog, f, ensure_ascii=False, indent=2)
+    print(f"✅ Delta sync: {len(changelog['added'])} added, {len(changelog['modified'])} modified, "
+          f"{len(changelog['removed'])} removed; changelog written to '{changelog_file}'")
+    return changelog
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Fetch the Umbraco export")
+    parser.add_argument("--async_crawl", action="store_true", help="Fetch nodes and pages concurrently")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Max concurrent requests in async mode")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Max requests per second in async mode")
+    parser.add_argument("--output_file", type=str, default="raw_data/umbraco-export.v1.jsonl")
+    parser.add_argument("--checkpoint_file", type=str, default=None,
+                        help="Crawl checkpoint used to resume an interrupted run (default: next to the output file)")
+    parser.add_argument("--since", type=str, default=None,
+                        help="Existing export to sync against; only new or changed nodes are downloaded")
+    parser.add_argument("--changelog_file", type=str, default=None,
+                        help="Where --since writes the added/modified/removed ids (default: next to the output file)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    descendants = fetch_all_descendants(ROOT_ID)
-    print(f"✅ Total nodes fetched: {len(descendants)}")
-    descendants_no_duplicates = remove_duplicates(descendants)
-    save_to_file(descendants_no_duplicates)
+    args = get_args()
+    if args.since:
+        sync_export(ROOT_ID, args.since, args.output_file, args.changelog_file,
+                    args.async_crawl, args.concurrency, args.rate)
+    else:
+        if args.async_crawl:
+            written = asyncio.run(fetch_all_descendants_async(ROOT_ID, args.output_file, args.checkpoint_file,
+                                                              args.concurrency, args.rate))
+        else:
+            written = fetch_all_descendants(ROOT_ID, args.output_file, args.checkpoint_file)
+        print(f"✅ Successfully saved {written} unique items to '{args.output_file}'")
     print("✅ Finished processing all nodes.")
\ No newline at end of file
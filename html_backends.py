@@ -0,0 +1,65 @@
+from functools import lru_cache
+
+from bs4 import BeautifulSoup
+
+from constants import HTML_BACKEND
+from extract_natural_language import strip_html_tags
+
+# Consider only block-level tags (far fewer than “all”)
+BLOCK_TAGS = ['p', 'div', 'li', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'caption', 'dt', 'dd']
+
+
+@lru_cache(maxsize=None)
+def available_html_backends():
+    """
+    BeautifulSoup tree builders usable here, fastest first.
+    lxml is only used through BeautifulSoup, so elements are serialized by bs4
+    exactly as with html.parser.
+    """
+    backends = []
+    try:
+        import lxml  # noqa: F401
+        backends.append("lxml")
+    except ImportError:
+        pass
+    backends.append("html.parser")
+    return tuple(backends)
+
+
+def resolve_html_backend(name=None):
+    """
+    Return `name`, or HTML_BACKEND from constants.py (html.parser by default).
+    An installed lxml is never picked on its own: it maps malformed markup
+    differently, so the datasets would depend on the installed packages.
+    """
+    name = name or HTML_BACKEND or "html.parser"
+    available = available_html_backends()
+    if name not in available:
+        raise ValueError(f"HTML backend {name!r} is not available, choose one of {available}")
+    return name
+
+
+def build_stripped_to_html_map(soup):
+    """
+    Returns a dict mapping stripped_text -> best-matching element HTML.
+    Chooses <p> first, then other block tags, then shortest match.
+    """
+    stripped_map = {}
+    for el in soup.find_all(BLOCK_TAGS):
+        html = str(el)
+        text = strip_html_tags(html).strip()
+        if not text:
+            continue
+        # if not seen yet, or this html is a tighter match, record it
+        prev = stripped_map.get(text)
+        if prev is None or len(html) < len(prev):
+            stripped_map[text] = html
+    return stripped_map
+
+
+def stripped_to_html_map(html, backend="html.parser"):
+    """`build_stripped_to_html_map` of an HTML string, parsed with the given backend."""
+    if "<" not in html:
+        # no tags, so no block elements: skip the parse (titles, memo titles, plain markup)
+        return {}
+    return build_stripped_to_html_map(BeautifulSoup(html, backend))
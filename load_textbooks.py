@@ -1,21 +1,32 @@
 from pathlib import Path
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 
 from models.textbook import Textbook
+from models.textbook_catalog import TextbookCatalog
 from datasets import Dataset, Features, Value, load_from_disk
 import json
 # from textbooks.constants import CONTENT_TYPES_INCLUDED, IDIOMS_MAPPING, CACHE_DIR
-from constants import CONTENT_TYPES_INCLUDED, IDIOMS_MAPPING, CACHE_DIR
+from constants import CONTENT_TYPES_INCLUDED, IDIOMS_MAPPING, CACHE_DIR, CACHE_MAX_BYTES
 import re
-from extract_natural_language import extract_text, extract_text_workbook_teacher, strip_html_tags
+from extract_natural_language import extract_text, extract_text_workbook_teacher
 from sorting_utils import sort_teacher_commentary_segments, sort_workbook_segments
 from sentence_utils import postprocess_merge_sentences
-from collections import defaultdict
+from html_backends import resolve_html_backend, stripped_to_html_map
+from arrow_utils import BookColumns
+from parquet_corpus import CORPUS_FILE, CorpusParquetWriter, read_corpus_parquet
+from cache_utils import cached_export_fingerprint, evict_lru, read_manifest, touch_manifest, variant_key, write_manifest
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import os
+import shutil
+import time
 import zipfile
 import string
 
+# Bump whenever a change to the extraction changes the datasets, so old cache variants are not reused
+# 2: walk_texts matches memoTitle exactly and takes the title of properties holders without a contentType
+LOADER_VERSION = "2"
 
 def load_and_filter_jsonl(filepath):
     data = []
@@ -29,6 +40,29 @@ def load_and_filter_jsonl(filepath):
     return data, textbooks
 
 
+def iter_jsonl(filepath, parse=True):
+    """Yield the parsed lines of a JSONL file one at a time (the raw strings if not `parse`)."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line) if parse else line
+
+
+def load_textbooks_meta(filepath):
+    """
+    First pass over the export: return only the `book` items.
+    Lines that cannot contain a book are skipped without being parsed.
+    """
+    textbooks = []
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            if '"book"' not in line:
+                continue
+            parsed_line = json.loads(line)
+            if parsed_line["contentType"] == "book":
+                textbooks.append(parsed_line)
+    return textbooks
+
+
 def init_textbooks_list(textbooks):
     textbooks_dict = {}
     for txtbook in textbooks:
@@ -57,130 +91,57 @@ def define_textbook_type(content_type, path):
     return 'workbook'
 
 
-def build_stripped_to_html_map(soup):
+def extract_segment_rows(json_line, textbooks_dict, split_segments_into_sentences=False, html_backend=None):
     """
-    Returns a dict mapping stripped_text -> best-matching element HTML.
-    Chooses <p> first, then other block tags, then shortest match.
+    Extract the dataset rows of one export line.
+    Returns a list of (textbook_path, row) pairs; only paths in `textbooks_dict` are kept.
+    Lines given as raw JSON strings are parsed first, so worker processes can do the parsing.
+    `html_backend` is the BeautifulSoup builder used in sentence mode (see html_backends.py).
     """
-    stripped_map = {}
-    # Consider only block-level tags (far fewer than “all”)
-    block_tags = ['p','div','li','td','th','h1','h2','h3','h4','h5','h6','caption','dt','dd']
-    for el in soup.find_all(block_tags):
-        html = str(el)
-        text = strip_html_tags(html).strip()
-        if not text:
-            continue
-        # if not seen yet, or this html is a tighter match, record it
-        prev = stripped_map.get(text)
-        if prev is None or len(html) < len(prev):
-            stripped_map[text] = html
-    return stripped_map
-
+    html_backend = resolve_html_backend(html_backend)
+    if isinstance(json_line, str):
+        json_line = json.loads(json_line)
+    segment_rows = []
+    content_type = json_line.get("contentType")
+    if content_type in CONTENT_TYPES_INCLUDED:
+        segment_path = json_line["route"]["path"]
+        match_base = re.match(r"^(/[^/]+/[^/]+/[^/]+)", segment_path)
+        path_base = match_base.group(1) if match_base else None
 
+        if content_type == "topicsPage": # special case  
+            if path_base:
+                parts = path_base.split('/')
+                # parts will be ['', 'idiom', 'klasse-X', 'vorwort-Y']
+                if len(parts) == 4 and 'vorwort' in parts[3]:
+                    # Extract the number from 'vorwort-Y'
+                    num_match = re.search(r'-(\d+)$', parts[3])
+                    if num_match:
+                        number = num_match.group(1)
+                        parts[3] = f'arbeitsbuch-{number}'
+                        path_base = '/'.join(parts)
 
-def save_segments_to_textbooks(json_list, textbooks_dict, split_segments_into_sentences=False):
-    if split_segments_into_sentences:
-        dataset_features = Features({
-            "segmentId": Value("string"),
-            "sentenceId": Value("string"),
-            "sentenceExtractedText": Value("string"),
-            "sentenceHTML": Value("string"),
-            "segmentPath": Value("string"),
-            "contentType": Value("string"),
-            "chapterPath": Value("string")
-        })
-    else:
-        dataset_features = Features({
-            "segmentId": Value("string"), 
-            "segmentPath": Value("string"),
-            "segmentExtractedText": Value("string"),
-            "contentType": Value("string"),
-            "chapterPath": Value("string")
-        })
-    rows_per_book = defaultdict(list)
-
-    total_segments = len(json_list)
-    for idx, json_line in tqdm(enumerate(json_list), total=total_segments, desc="Processing segments"):
-        content_type = json_line.get("contentType")
-        if content_type in CONTENT_TYPES_INCLUDED:
-            segment_path = json_line["route"]["path"]
-            match_base = re.match(r"^(/[^/]+/[^/]+/[^/]+)", segment_path)
-            path_base = match_base.group(1) if match_base else None
-
-            if content_type == "topicsPage": # special case  
-                if path_base:
-                    parts = path_base.split('/')
-                    # parts will be ['', 'idiom', 'klasse-X', 'vorwort-Y']
-                    if len(parts) == 4 and 'vorwort' in parts[3]:
-                        # Extract the number from 'vorwort-Y'
-                        num_match = re.search(r'-(\d+)$', parts[3])
-                        if num_match:
-                            number = num_match.group(1)
-                            parts[3] = f'arbeitsbuch-{number}'
-                            path_base = '/'.join(parts)
-
-                extracted_text_workbook, extracted_text_teacher, wb, tc, wb_htmls, tc_htmls = extract_text_workbook_teacher(json_line)
-                if extracted_text_workbook != "" and extracted_text_teacher != "":
-                    for role, extracted in [('workbook', extracted_text_workbook), ('teachers_commentary', extracted_text_teacher)]:
-                        full_path = f"{path_base}/{role}"
-                        #teacher_path = f"{path_base}/teachers_commentary"
-                        if full_path in textbooks_dict:
-                            if split_segments_into_sentences:
-                                text_chunks_for_role = wb if role == 'workbook' else tc
-                                html_chunks_for_role = wb_htmls if role == 'workbook' else tc_htmls
-                                for text_chunk_idx, text_chunk_content in enumerate(text_chunks_for_role):
-                                    html_chunk_content = html_chunks_for_role[text_chunk_idx] if text_chunk_idx < len(html_chunks_for_role) else ""
-                                    if not text_chunk_content.strip(): # Skip if the text chunk itself is empty
-                                        continue
-                                    soup_for_chunk = BeautifulSoup(html_chunk_content, 'html.parser')
-                                    mapping = build_stripped_to_html_map(soup_for_chunk)
-                                    count = 0
-                                    for line in text_chunk_content.splitlines():
-                                        text = line.strip()
-                                        inner = re.sub(r'<[^>]+>', '', text)
-                                        if not inner.strip() or all(ch in string.punctuation or ch.isspace() for ch in inner): # skip empty or punctuation-only lines
-                                            continue
-                                        specific_sentence_html = mapping.get(text, html_chunk_content)
-                                        rows_per_book[full_path].append({
-                                            "segmentId": str(json_line["id"]),
-                                            "sentenceId": f"{json_line['id']}.{count}",
-                                            "sentenceExtractedText": text,
-                                            "sentenceHTML": specific_sentence_html,
-                                            "segmentPath": full_path,
-                                            "contentType": content_type,
-                                            "chapterPath": segment_path if segment_path else "",
-                                        })
-                                        count += 1
-                            else:
-                                rows_per_book[full_path].append({
-                                    "segmentId": str(json_line["id"]),
-                                    "segmentPath": full_path,
-                                    "segmentExtractedText": extracted,
-                                    "contentType": content_type,
-                                    "chapterPath": segment_path if segment_path else ""
-                                })
-            else:
-                target_booktype = define_textbook_type(content_type, segment_path)
-                full_path = f"{path_base}/{target_booktype}"
-                if full_path in textbooks_dict:
-                    extracted_primary_string, unique_text_chunks, html_for_unique_chunks = extract_text(json_line)
-                    extracted = extracted_primary_string or ""
-                    if extracted:
+            extracted_text_workbook, extracted_text_teacher, wb, tc, wb_htmls, tc_htmls = extract_text_workbook_teacher(json_line)
+            if extracted_text_workbook != "" and extracted_text_teacher != "":
+                for role, extracted in [('workbook', extracted_text_workbook), ('teachers_commentary', extracted_text_teacher)]:
+                    full_path = f"{path_base}/{role}"
+                    #teacher_path = f"{path_base}/teachers_commentary"
+                    if full_path in textbooks_dict:
                         if split_segments_into_sentences:
-                            count = 0
-                            for chunk_idx, chunk_content in enumerate(unique_text_chunks):
-                                html_for_this_chunk = html_for_unique_chunks[chunk_idx] if chunk_idx < len(html_for_unique_chunks) else ""
-                                if not chunk_content.strip():
+                            text_chunks_for_role = wb if role == 'workbook' else tc
+                            html_chunks_for_role = wb_htmls if role == 'workbook' else tc_htmls
+                            for text_chunk_idx, text_chunk_content in enumerate(text_chunks_for_role):
+                                html_chunk_content = html_chunks_for_role[text_chunk_idx] if text_chunk_idx < len(html_chunks_for_role) else ""
+                                if not text_chunk_content.strip(): # Skip if the text chunk itself is empty
                                     continue
-                                soup_for_chunk = BeautifulSoup(html_for_this_chunk, 'html.parser')
-                                mapping = build_stripped_to_html_map(soup_for_chunk)
-                                for line in chunk_content.splitlines():
+                                mapping = stripped_to_html_map(html_chunk_content, html_backend)
+                                count = 0
+                                for line in text_chunk_content.splitlines():
                                     text = line.strip()
                                     inner = re.sub(r'<[^>]+>', '', text)
-                                    if not inner.strip() or all(ch in string.punctuation or ch.isspace() for ch in inner):
+                                    if not inner.strip() or all(ch in string.punctuation or ch.isspace() for ch in inner): # skip empty or punctuation-only lines
                                         continue
-                                    specific_sentence_html = mapping.get(text, html_for_this_chunk)
-                                    rows_per_book[full_path].append({
+                                    specific_sentence_html = mapping.get(text, html_chunk_content)
+                                    segment_rows.append((full_path, {
                                         "segmentId": str(json_line["id"]),
                                         "sentenceId": f"{json_line['id']}.{count}",
                                         "sentenceExtractedText": text,
@@ -188,20 +149,217 @@ def save_segments_to_textbooks(json_list, textbooks_dict, split_segments_into_se
                                         "segmentPath": full_path,
                                         "contentType": content_type,
                                         "chapterPath": segment_path if segment_path else "",
-                                    })
+                                    }))
                                     count += 1
                         else:
-                            rows_per_book[full_path].append({
+                            segment_rows.append((full_path, {
                                 "segmentId": str(json_line["id"]),
-                                "segmentPath": segment_path,
+                                "segmentPath": full_path,
                                 "segmentExtractedText": extracted,
                                 "contentType": content_type,
                                 "chapterPath": segment_path if segment_path else ""
-                            })       
-    return rows_per_book, dataset_features
+                            }))
+        else:
+            target_booktype = define_textbook_type(content_type, segment_path)
+            full_path = f"{path_base}/{target_booktype}"
+            if full_path in textbooks_dict:
+                extracted_primary_string, unique_text_chunks, html_for_unique_chunks = extract_text(json_line)
+                extracted = extracted_primary_string or ""
+                if extracted:
+                    if split_segments_into_sentences:
+                        count = 0
+                        for chunk_idx, chunk_content in enumerate(unique_text_chunks):
+                            html_for_this_chunk = html_for_unique_chunks[chunk_idx] if chunk_idx < len(html_for_unique_chunks) else ""
+                            if not chunk_content.strip():
+                                continue
+                            mapping = stripped_to_html_map(html_for_this_chunk, html_backend)
+                            for line in chunk_content.splitlines():
+                                text = line.strip()
+                                inner = re.sub(r'<[^>]+>', '', text)
+                                if not inner.strip() or all(ch in string.punctuation or ch.isspace() for ch in inner):
+                                    continue
+                                specific_sentence_html = mapping.get(text, html_for_this_chunk)
+                                segment_rows.append((full_path, {
+                                    "segmentId": str(json_line["id"]),
+                                    "sentenceId": f"{json_line['id']}.{count}",
+                                    "sentenceExtractedText": text,
+                                    "sentenceHTML": specific_sentence_html,
+                                    "segmentPath": full_path,
+                                    "contentType": content_type,
+                                    "chapterPath": segment_path if segment_path else "",
+                                }))
+                                count += 1
+                    else:
+                        segment_rows.append((full_path, {
+                            "segmentId": str(json_line["id"]),
+                            "segmentPath": segment_path,
+                            "segmentExtractedText": extracted,
+                            "contentType": content_type,
+                            "chapterPath": segment_path if segment_path else ""
+                        }))
+    return segment_rows
+
+
+def _extract_segment_rows_batch(json_lines, textbook_paths, split_segments_into_sentences, html_backend):
+    return [extract_segment_rows(json_line, textbook_paths, split_segments_into_sentences, html_backend)
+            for json_line in json_lines]
+
+
+def extract_segment_rows_parallel(json_list, textbooks_dict, split_segments_into_sentences, num_proc,
+                                  total_segments=None, batch_size=256, html_backend=None):
+    """
+    Shard the export lines across `num_proc` worker processes in batches and
+    yield each line's rows in input order, so the result is identical to the
+    serial path. Only a bounded window of batches is in flight at a time.
+    """
+    textbook_paths = frozenset(textbooks_dict)
+    # resolved here so every worker uses the same backend
+    html_backend = resolve_html_backend(html_backend)
+    max_in_flight = 4 * num_proc
+    progress = tqdm(total=total_segments, desc=f"Processing segments ({num_proc} processes)")
+    with ProcessPoolExecutor(max_workers=num_proc) as executor:
+        in_flight = deque()
+        lines = iter(json_list)
+        batches = iter(lambda: list(islice(lines, batch_size)), [])
+        for batch in batches:
+            in_flight.append(executor.submit(_extract_segment_rows_batch, batch, textbook_paths,
+                                             split_segments_into_sentences, html_backend))
+            if len(in_flight) >= max_in_flight:
+                yield from _consume_batch(in_flight.popleft(), progress)
+        while in_flight:
+            yield from _consume_batch(in_flight.popleft(), progress)
+    progress.close()
+
+
+def _consume_batch(future, progress):
+    rows_per_segment = future.result()
+    progress.update(len(rows_per_segment))
+    return rows_per_segment
+
+
+def segment_features(split_segments_into_sentences=False):
+    if split_segments_into_sentences:
+        return Features({
+            "segmentId": Value("string"),
+            "sentenceId": Value("string"),
+            "sentenceExtractedText": Value("string"),
+            "sentenceHTML": Value("string"),
+            "segmentPath": Value("string"),
+            "contentType": Value("string"),
+            "chapterPath": Value("string")
+        })
+    return Features({
+        "segmentId": Value("string"), 
+        "segmentPath": Value("string"),
+        "segmentExtractedText": Value("string"),
+        "contentType": Value("string"),
+        "chapterPath": Value("string")
+    })
 
 
-def load_textbooks(sort_like_sample_textbooks=False, data_path=None, split_segments_into_sentences=False):
+def iter_segment_rows(json_list, textbooks_dict, split_segments_into_sentences=False, num_proc=None, html_backend=None):
+    """
+    Yield the (textbook_path, row) pairs of every included segment, in export order.
+    With `num_proc` > 1 the lines are sharded across a process pool; the rows and
+    their order are the same as in the serial path.
+    """
+    total_segments = len(json_list) if hasattr(json_list, "__len__") else None
+    if num_proc and num_proc > 1:
+        rows_per_segment = extract_segment_rows_parallel(json_list, textbooks_dict, split_segments_into_sentences,
+                                                         num_proc, total_segments, html_backend=html_backend)
+    else:
+        html_backend = resolve_html_backend(html_backend)
+        rows_per_segment = (
+            extract_segment_rows(json_line, textbooks_dict, split_segments_into_sentences, html_backend)
+            for json_line in tqdm(json_list, total=total_segments, desc="Processing segments")
+        )
+    for segment_rows in rows_per_segment:
+        yield from segment_rows
+
+
+def save_segments_to_textbooks(json_list, textbooks_dict, split_segments_into_sentences=False, num_proc=None,
+                               html_backend=None):
+    """
+    Extract the rows of every included segment, grouped by textbook path.
+    `json_list` may be a list or any iterable of parsed export lines (or raw JSON
+    strings), e.g. `iter_jsonl`. With `num_proc` > 1 the lines are sharded across
+    a process pool; the rows and their order are the same as in the serial path.
+    """
+    rows_per_book = defaultdict(list)
+    for full_path, row in iter_segment_rows(json_list, textbooks_dict, split_segments_into_sentences, num_proc,
+                                            html_backend):
+        rows_per_book[full_path].append(row)
+    return rows_per_book, segment_features(split_segments_into_sentences)
+
+
+def save_segments_to_columns(json_list, textbooks_dict, split_segments_into_sentences=False, num_proc=None,
+                             html_backend=None):
+    """
+    Like `save_segments_to_textbooks`, but each book's rows go straight into a
+    columnar `BookColumns` builder instead of a list of row dicts.
+    """
+    features = segment_features(split_segments_into_sentences)
+    columns_per_book = {}
+    for full_path, row in iter_segment_rows(json_list, textbooks_dict, split_segments_into_sentences, num_proc,
+                                            html_backend):
+        columns = columns_per_book.get(full_path)
+        if columns is None:
+            columns = columns_per_book[full_path] = BookColumns(features)
+        columns.append(row)
+    return columns_per_book, features
+
+
+def textbook_cache_entry(tb, cache_folder):
+    """Manifest entry holding everything needed to restore `tb` from its cache folder."""
+    return {
+        "textbook_path": tb.textbook_path,
+        "idiom": tb.idiom,
+        "subject": tb.subject,
+        "grade_volume": tb.grade_volume,
+        "book_type": tb.book_type,
+        "ISBN": tb.ISBN,
+        "cache_folder": cache_folder,
+    }
+
+
+def load_textbooks_from_manifest(manifest, variant_dir):
+    """
+    Restore all textbooks listed in a cache manifest straight from disk,
+    without opening the export. Returns None if any cached dataset fails to load.
+    """
+    if manifest.get("corpus"):
+        corpus_path = os.path.join(variant_dir, manifest["corpus"])
+        try:
+            return read_corpus_parquet(corpus_path)
+        except Exception as e:
+            print(f"Failed to load cached corpus {corpus_path}: {e}")
+            return None
+    textbooks = {}
+    for entry in manifest["books"]:
+        cache_folder = os.path.join(variant_dir, entry["cache_folder"])
+        try:
+            ds = load_from_disk(cache_folder)
+        except Exception as e:
+            print(f"Failed to load cache for {entry['idiom']} at {cache_folder}: {e}")
+            return None
+        textbooks[entry["textbook_path"]] = Textbook(
+            idiom=entry["idiom"],
+            subject=entry["subject"],
+            grade_volume=entry["grade_volume"],
+            book_type=entry["book_type"],
+            ISBN=entry["ISBN"],
+            hf_dataset=ds,
+            textbook_path=entry["textbook_path"],
+        )
+    return textbooks
+
+
+def resolve_cache_variant(data_path, sort_like_sample_textbooks, split_segments_into_sentences, cache_format="datasets"):
+    """
+    Locate the export (extracting the zip on first use) and the cache variant
+    matching it and the loader options. Returns (jsonl_path, export fingerprint,
+    options, variant key, variant dir).
+    """
     if data_path is None:
         data_path = Path(__file__).parent / 'raw_data'
     zip_path     = data_path / 'umbraco-export.v1.zip'
@@ -214,69 +372,179 @@ def load_textbooks(sort_like_sample_textbooks=False, data_path=None, split_segme
         with zipfile.ZipFile(zip_path, 'r') as zf:
             zf.extractall(extract_dir)
 
+    # Each combination of export, loader options and loader version gets its own cache variant
+    options = {
+        "split_segments_into_sentences": split_segments_into_sentences,
+        "sort_like_sample_textbooks": sort_like_sample_textbooks,
+    }
+    if split_segments_into_sentences:
+        # backends can disagree on malformed markup, so their sentenceHTML is cached separately
+        options["html_backend"] = resolve_html_backend()
+    if cache_format != "datasets":
+        options["cache_format"] = cache_format
+    export = cached_export_fingerprint(CACHE_DIR, jsonl_path)
+    key = variant_key(export["sha256"], options, LOADER_VERSION)
+    return jsonl_path, export, options, key, os.path.join(CACHE_DIR, key)
+
+
+def load_textbook_catalog(sort_like_sample_textbooks=False, data_path=None, split_segments_into_sentences=False, num_proc=None):
+    """
+    Like `load_textbooks`, but returns a lazy `TextbookCatalog`: on a warm cache
+    no dataset is opened until its book is accessed. On a cold cache all books
+    are built first.
+    """
+    _, _, _, _, variant_dir = resolve_cache_variant(data_path, sort_like_sample_textbooks, split_segments_into_sentences)
+    manifest = read_manifest(variant_dir)
+    loaded = None
+    if manifest is None:
+        loaded = load_textbooks(sort_like_sample_textbooks, data_path, split_segments_into_sentences, num_proc)
+        manifest = read_manifest(variant_dir)
+        if manifest is None:
+            # the cache could not be written; serve the books built in memory
+            return TextbookCatalog([textbook_cache_entry(tb, None) for tb in loaded.values()], variant_dir, loaded)
+    touch_manifest(variant_dir, manifest)
+    return TextbookCatalog(manifest["books"], variant_dir, loaded)
+
+
+def load_corpus(idiom=None, grade=None, book_type=None, filters=None, sort_like_sample_textbooks=False,
+                data_path=None, split_segments_into_sentences=False, num_proc=None):
+    """
+    Load textbooks from the single-Parquet cache variant, building it on first use.
+    Only the books matching idiom/grade/book_type are read, and `filters` (a pyarrow
+    expression such as pc.field("chapterPath") == path) is pushed down to the reader.
+    """
+    _, _, _, _, variant_dir = resolve_cache_variant(data_path, sort_like_sample_textbooks,
+                                                    split_segments_into_sentences, "parquet")
+    manifest = read_manifest(variant_dir)
+    if manifest is None:
+        load_textbooks(sort_like_sample_textbooks, data_path, split_segments_into_sentences, num_proc, "parquet")
+        manifest = read_manifest(variant_dir)
+        if manifest is None:
+            raise RuntimeError(f"Could not build the corpus cache in {variant_dir}")
+    touch_manifest(variant_dir, manifest)
+    return read_corpus_parquet(os.path.join(variant_dir, manifest["corpus"]), idiom, grade, book_type, filters)
+
+
+def load_textbooks(sort_like_sample_textbooks=False, data_path=None, split_segments_into_sentences=False, num_proc=None,
+                   cache_format="datasets"):
+    """
+    Build (or load from hf_cache) one Dataset per textbook, keyed by textbook_path.
+    With cache_format="parquet" the cache variant is a single Parquet file with one
+    row group per book (see parquet_corpus.py) instead of one save_to_disk folder per book.
+    """
+    jsonl_path, export, options, key, variant_dir = resolve_cache_variant(
+        data_path, sort_like_sample_textbooks, split_segments_into_sentences, cache_format
+    )
+    manifest = read_manifest(variant_dir)
+    if manifest is not None:
+        textbooks = load_textbooks_from_manifest(manifest, variant_dir)
+        if textbooks is not None:
+            touch_manifest(variant_dir, manifest)
+            print(f"Finished. Loaded {len(textbooks)}, Built 0, Total textbooks: {len(textbooks)} (cache variant {key}).")
+            return textbooks
+
     print(f"Loading metadata from {jsonl_path} …")
-    json_list, textbooks_meta = load_and_filter_jsonl(jsonl_path)
+    textbooks_meta = load_textbooks_meta(jsonl_path)
     textbooks_dict = init_textbooks_list(textbooks_meta)
 
-    # Prepare segment data
-    rows_per_book, features = save_segments_to_textbooks(json_list, textbooks_dict, split_segments_into_sentences)
+    # Prepare segment data, streaming the export a second time
+    # (worker processes parse the raw lines themselves when extracting in parallel)
+    parallel = bool(num_proc and num_proc > 1)
+    columns_per_book, features = save_segments_to_columns(
+        iter_jsonl(jsonl_path, parse=not parallel), textbooks_dict, split_segments_into_sentences, num_proc,
+        options.get("html_backend"),
+    )
     if split_segments_into_sentences:
-        print("Post-processing sentences for merging...")
-        rows_per_book = postprocess_merge_sentences(rows_per_book)
-        print("Sentence merging complete.")
-    os.makedirs(CACHE_DIR, exist_ok=True)
+        print("Post-processing sentences for merging, book by book...")
+    os.makedirs(variant_dir, exist_ok=True)
 
-    loaded, built = 0, 0
+    built, failed = 0, 0
+    cache_entries = []
+    corpus_writer = CorpusParquetWriter(os.path.join(variant_dir, CORPUS_FILE)) if cache_format == "parquet" else None
     for _, tb in enumerate(textbooks_dict.values()):
         # Determine safe cache folder name
         mapped_idiom = IDIOMS_MAPPING.get(tb.idiom, tb.idiom)
         safe_name = f"{mapped_idiom.lower()}_{tb.grade_volume.replace('.', '_')}_{tb.book_type.replace(' ', '_')}"
-        cache_folder = os.path.join(CACHE_DIR, safe_name)
+        cache_folder = os.path.join(variant_dir, safe_name)
+        # release each book's columns as soon as it is handled
+        columns = columns_per_book.pop(tb.textbook_path, None) or BookColumns(features)
 
-        if os.path.isdir(cache_folder):
-            # Load existing dataset
-            try:
-                tb.hf_dataset = load_from_disk(cache_folder)
-                tb.idiom = mapped_idiom
-                print(f"Loaded from cache: {mapped_idiom} {tb.grade_volume} {tb.book_type}")
-                loaded += 1
-                continue
-            except Exception as e:
-                print(f"Failed to load cache for {mapped_idiom} at {cache_folder}: {e}")
-                # fall through to rebuild
+        if split_segments_into_sentences or sort_like_sample_textbooks:
+            # merging and sorting work on row dicts, materialized for this one book only
+            rows = list(columns.rows())
+            if split_segments_into_sentences:
+                rows = postprocess_merge_sentences({tb.textbook_path: rows})[tb.textbook_path]
+            if sort_like_sample_textbooks:
+                # Sort segments for teacher's commentary
+                if tb.book_type == "teacher's commentary":
+                    rows = sort_teacher_commentary_segments(rows, tb.textbook_path)
+                elif tb.book_type == "workbook":
+                    rows = sort_workbook_segments(rows, tb.textbook_path)
+            columns = BookColumns(features)
+            columns.extend(rows)
+            del rows
 
         tb.idiom = mapped_idiom
-        # Build dataset if no cache or load failed
-        rows = rows_per_book.get(tb.textbook_path, [])
-        if not rows:
+        if not len(columns):
             print(f"No segments for {mapped_idiom} {tb.grade_volume} {tb.book_type}, skipping.")
             continue
 
-        if sort_like_sample_textbooks:
-            # Sort segments for teacher's commentary
-            if tb.book_type == "teacher's commentary":
-                rows = sort_teacher_commentary_segments(rows, tb.textbook_path)
-            elif tb.book_type == "workbook":
-                rows = sort_workbook_segments(rows, tb.textbook_path)
-
-        data = { key: [r[key] for r in rows] for key in rows[0].keys() }
-        ds = Dataset.from_dict(data, features=features)
+        ds = Dataset.from_dict(columns.columns(), features=features)
         tb.hf_dataset = ds
 
-        # Save to cache
+        if corpus_writer is not None:
+            try:
+                corpus_writer.write_book(tb)
+                print(f"Built: {mapped_idiom} {tb.grade_volume} {tb.book_type}")
+                built += 1
+                cache_entries.append(textbook_cache_entry(tb, None))
+            except Exception as e:
+                print(f"Failed to write {mapped_idiom} to the corpus cache: {e}")
+                failed += 1
+            continue
+
+        # Save to cache, replacing whatever a stale build left behind
+        if os.path.isdir(cache_folder):
+            shutil.rmtree(cache_folder)
         os.makedirs(cache_folder, exist_ok=True)
         try:
             ds.save_to_disk(cache_folder)
             print(f"Built and cached: {mapped_idiom} {tb.grade_volume} {tb.book_type}")
             built += 1
+            cache_entries.append(textbook_cache_entry(tb, safe_name))
         except Exception as e:
             print(f"Failed to save cache for {mapped_idiom}: {e}")
+            failed += 1
+
+    if corpus_writer is not None and failed:
+        corpus_writer.abort()
+    elif corpus_writer is not None:
+        try:
+            corpus_writer.close()
+            print(f"Cached {built} textbooks in {corpus_writer.path}")
+        except Exception as e:
+            print(f"Failed to write the corpus cache {corpus_writer.path}: {e}")
+            failed += 1
+
+    if not failed:
+        manifest = {
+            "key": key,
+            "loader_version": LOADER_VERSION,
+            "export": export,
+            "options": options,
+            "books": cache_entries,
+            "last_used": time.time(),
+        }
+        if corpus_writer is not None:
+            manifest["corpus"] = CORPUS_FILE
+        write_manifest(variant_dir, manifest)
+        evict_lru(CACHE_DIR, CACHE_MAX_BYTES, keep=key)
 
     ret_txtbook_dict = {
         path: tb
         for path, tb in textbooks_dict.items()
         if hasattr(tb, 'hf_dataset') and len(tb.hf_dataset) > 0
     }
-    print(f"Finished. Loaded {loaded}, Built {built}, Total textbooks: {len(ret_txtbook_dict.values())}.")
+    print(f"Finished. Loaded 0, Built {built}, Total textbooks: {len(ret_txtbook_dict.values())}.")
     # Return only textbooks with datasets
     return ret_txtbook_dict
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from itertools import chain
 from datasets import Dataset
 
 
@@ -11,4 +12,47 @@ class Textbook():
   book_type: str
   ISBN: str | None = None
   hf_dataset: Dataset = Dataset.from_dict({})
-  textbook_path: str = ""
\ No newline at end of file
+  textbook_path: str = ""
+  # (dataset, index) of the last chapter index built, rebuilt when hf_dataset is replaced
+  _chapter_index: tuple | None = field(default=None, init=False, repr=False, compare=False)
+
+  def chapter_index(self):
+    """
+    Map each distinct chapterPath of the dataset to its rows, as a list of
+    contiguous [start, stop) ranges. Built in one pass over the column and
+    kept until hf_dataset changes.
+    """
+    if self._chapter_index is None or self._chapter_index[0] is not self.hf_dataset:
+      index = {}
+      paths = self.hf_dataset.with_format("arrow")["chapterPath"].to_pylist() if len(self.hf_dataset) else []
+      for row, path in enumerate(paths):
+        ranges = index.setdefault(path, [])
+        if ranges and ranges[-1][1] == row:
+          ranges[-1][1] = row + 1
+        else:
+          ranges.append([row, row + 1])
+      self._chapter_index = (self.hf_dataset, index)
+    return self._chapter_index[1]
+
+  def chapter_ranges(self, chapter_name):
+    """
+    Sorted, merged row ranges whose chapterPath contains `chapter_name`, i.e. the
+    rows of `hf_dataset.filter(lambda row: chapter_name in row["chapterPath"])`.
+    Only the distinct paths are scanned, not the rows.
+    """
+    ranges = sorted(r for path, path_ranges in self.chapter_index().items() if chapter_name in path for r in path_ranges)
+    merged = []
+    for start, stop in ranges:
+      if merged and merged[-1][1] == start:
+        merged[-1] = (merged[-1][0], stop)
+      else:
+        merged.append((start, stop))
+    return merged
+
+  def select_chapter(self, chapter_name):
+    """The rows of a chapter, selected by index instead of filtering every row."""
+    ranges = self.chapter_ranges(chapter_name)
+    if len(ranges) == 1:
+      # a contiguous selection needs no indices mapping
+      return self.hf_dataset.select(range(*ranges[0]))
+    return self.hf_dataset.select(list(chain.from_iterable(range(start, stop) for start, stop in ranges)))
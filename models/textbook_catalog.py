@@ -0,0 +1,77 @@
+import os
+from collections.abc import Mapping
+
+from datasets import load_from_disk
+
+from models.textbook import Textbook
+
+
+class TextbookCatalog(Mapping):
+    """
+    Dict-like view of cached textbooks, keyed by textbook_path.
+    Only the manifest metadata is held up front; a book's Arrow dataset is
+    loaded from its cache folder the first time the book is accessed.
+    """
+
+    def __init__(self, entries, variant_dir, loaded=None):
+        self._entries = {entry["textbook_path"]: entry for entry in entries}
+        self._variant_dir = variant_dir
+        # shared between a catalog and the catalogs filtered from it
+        self._loaded = loaded if loaded is not None else {}
+
+    def __getitem__(self, textbook_path):
+        if textbook_path not in self._loaded:
+            entry = self._entries[textbook_path]
+            self._loaded[textbook_path] = Textbook(
+                idiom=entry["idiom"],
+                subject=entry["subject"],
+                grade_volume=entry["grade_volume"],
+                book_type=entry["book_type"],
+                ISBN=entry["ISBN"],
+                hf_dataset=load_from_disk(os.path.join(self._variant_dir, entry["cache_folder"])),
+                textbook_path=textbook_path,
+            )
+        return self._loaded[textbook_path]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"TextbookCatalog({len(self)} textbooks, {len(self.loaded_paths())} loaded)"
+
+    @property
+    def variant_dir(self):
+        """Cache variant folder the books are loaded from."""
+        return self._variant_dir
+
+    def metadata(self, textbook_path):
+        """Manifest entry of a book, without loading its dataset."""
+        return self._entries[textbook_path]
+
+    def loaded_paths(self):
+        return [path for path in self._entries if path in self._loaded]
+
+    def filter(self, idiom=None, grade=None, book_type=None):
+        """
+        Sub-catalog of the books matching all given criteria, selected from
+        metadata only. `grade` is either a class (4) or a grade_volume ("4.1").
+        """
+        def matches(entry):
+            if idiom is not None and entry["idiom"] != idiom:
+                return False
+            if book_type is not None and entry["book_type"] != book_type:
+                return False
+            if grade is not None:
+                grade_volume = entry["grade_volume"]
+                if str(grade) != grade_volume and str(grade) != grade_volume.split(".")[0]:
+                    return False
+            return True
+
+        return TextbookCatalog(
+            [entry for entry in self._entries.values() if matches(entry)],
+            self._variant_dir,
+            self._loaded,
+        )
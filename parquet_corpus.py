@@ -0,0 +1,142 @@
+import argparse
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from datasets import Dataset
+
+from models.textbook import Textbook
+
+CORPUS_FILE = "corpus.parquet"
+# Book metadata stored as columns next to the segment columns; constant within a row group
+BOOK_COLUMNS = ("textbook_path", "idiom", "subject", "grade_volume", "book_type", "ISBN")
+
+
+class CorpusParquetWriter:
+    """
+    Write textbooks into a single Parquet file, one zstd-compressed row group
+    per book with column statistics, so readers can skip whole books by
+    idiom/grade/book_type and prune on segment columns such as chapterPath.
+    The file is written under a temporary name and moved into place on close.
+    """
+
+    def __init__(self, path, compression="zstd"):
+        self.path = path
+        self.compression = compression
+        self._tmp_path = f"{path}.tmp"
+        self._writer = None
+        self.num_books = 0
+
+    def write_book(self, tb):
+        table = tb.hf_dataset.with_format("arrow")[:]
+        table = table.replace_schema_metadata(None)
+        for name in BOOK_COLUMNS:
+            table = table.append_column(name, pa.repeat(pa.scalar(getattr(tb, name), pa.string()), len(table)))
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._tmp_path, table.schema, compression=self.compression,
+                                            write_statistics=True)
+        self._writer.write_table(table, row_group_size=max(len(table), 1))
+        self.num_books += 1
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Drop a partially written file."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_corpus_parquet(textbooks, path):
+    """Write a {textbook_path: Textbook} dict as returned by `load_textbooks` to one Parquet file."""
+    with CorpusParquetWriter(path) as writer:
+        for tb in textbooks.values():
+            writer.write_book(tb)
+    return writer.num_books
+
+
+def corpus_filter(idiom=None, grade=None, book_type=None, filters=None):
+    """
+    Combine the book selection and extra `filters` into one pyarrow expression.
+    `grade` is either a class (4) or a grade_volume ("4.1"); `filters` is a
+    pyarrow expression on the segment columns, e.g. pc.field("chapterPath") == path.
+    """
+    expressions = [] if filters is None else [filters]
+    if idiom is not None:
+        expressions.append(pc.field("idiom") == idiom)
+    if book_type is not None:
+        expressions.append(pc.field("book_type") == book_type)
+    if grade is not None:
+        if "." in str(grade):
+            expressions.append(pc.field("grade_volume") == str(grade))
+        else:
+            expressions.append(pc.starts_with(pc.field("grade_volume"), f"{grade}."))
+    if not expressions:
+        return None
+    expression = expressions[0]
+    for other in expressions[1:]:
+        expression = expression & other
+    return expression
+
+
+def read_corpus_parquet(path, idiom=None, grade=None, book_type=None, filters=None):
+    """
+    Load the books of a corpus Parquet file as {textbook_path: Textbook}.
+    The file is memory-mapped and the selection is pushed down to the reader,
+    so row groups of other books are skipped via their statistics.
+    Books left without rows by the filters are not returned.
+    """
+    table = pq.read_table(path, filters=corpus_filter(idiom, grade, book_type, filters), memory_map=True)
+    textbooks = {}
+    if not len(table):
+        return textbooks
+    # rows of a book are contiguous (one row group per book), so each run of a path is a book
+    runs = pc.run_end_encode(table["textbook_path"].combine_chunks())
+    start = 0
+    for end in runs.run_ends.to_pylist():
+        book = table.slice(start, end - start)
+        start = end
+        meta = {name: book[name][0].as_py() for name in BOOK_COLUMNS}
+        textbooks[meta["textbook_path"]] = Textbook(
+            idiom=meta["idiom"],
+            subject=meta["subject"],
+            grade_volume=meta["grade_volume"],
+            book_type=meta["book_type"],
+            ISBN=meta["ISBN"],
+            hf_dataset=Dataset(book.drop_columns(list(BOOK_COLUMNS))),
+            textbook_path=meta["textbook_path"],
+        )
+    return textbooks
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Export the unaligned textbooks into one Parquet file.")
+    parser.add_argument("--output_file", default=CORPUS_FILE)
+    parser.add_argument("--split_segments_into_sentences", action="store_true")
+    parser.add_argument("--sort_like_sample_textbooks", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from load_textbooks import load_textbooks
+
+    args = get_args()
+    textbooks = load_textbooks(args.sort_like_sample_textbooks,
+                               split_segments_into_sentences=args.split_segments_into_sentences)
+    num_books = write_corpus_parquet(textbooks, args.output_file)
+    print(f"Wrote {num_books} textbooks to {args.output_file}")
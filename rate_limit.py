@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket: allows bursts of `capacity` requests and refills at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def headroom(self):
+        """Number of requests that could start right now."""
+        return int(min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from embed.emb_store import EmbeddingFormatError, open_emb, read_emb_header, write_emb
+
+
+def write_overlaps(path, num_lines):
+    path.write_text("".join(f"overlap {i}\n" for i in range(num_lines)), encoding="utf-8")
+    return str(path)
+
+
+def test_roundtrip_is_memory_mapped(tmp_path):
+    overlaps = write_overlaps(tmp_path / "rm-puter_text_overlaps.txt", 5)
+    emb_path = str(tmp_path / "rm-puter_text_overlaps.emb")
+    embeddings = np.arange(5 * 3, dtype=np.float32).reshape(5, 3)
+    write_emb(emb_path, embeddings, "cohere-v4", overlaps)
+
+    header = read_emb_header(emb_path)
+    assert (header["dim"], header["count"], header["dtype"], header["model"]) == (3, 5, "float32", "cohere-v4")
+    # the vectors stay a plain float32 dump for vecalign
+    assert np.array_equal(np.fromfile(emb_path, dtype=np.float32).reshape(5, 3), embeddings)
+
+    loaded = open_emb(emb_path, overlaps, model="cohere-v4")
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(loaded, embeddings)
+    assert np.array_equal(loaded[2:4], embeddings[2:4])
+
+
+def test_mismatches_fail_loudly(tmp_path):
+    overlaps = write_overlaps(tmp_path / "o.txt", 5)
+    emb_path = str(tmp_path / "o.emb")
+    write_emb(emb_path, np.ones((5, 4)), "voyage-v3", overlaps)
+
+    with pytest.raises(EmbeddingFormatError, match="expected 6"):
+        open_emb(emb_path, count=6)
+    with pytest.raises(EmbeddingFormatError, match="embedded with voyage-v3"):
+        open_emb(emb_path, model="cohere-v4")
+
+    (tmp_path / "o.txt").write_text("changed\n" * 5, encoding="utf-8")
+    with pytest.raises(EmbeddingFormatError, match="changed"):
+        open_emb(emb_path, overlaps)
+
+    with open(emb_path, "r+b") as f:
+        f.truncate(5 * 4 * 4 - 4)
+    with pytest.raises(EmbeddingFormatError, match="header describes"):
+        open_emb(emb_path)
+
+
+def test_files_without_header(tmp_path):
+    overlaps = write_overlaps(tmp_path / "o.txt", 4)
+    emb_path = str(tmp_path / "o.emb")
+    np.arange(4 * 6, dtype=np.float32).tofile(emb_path)
+    assert open_emb(emb_path, overlaps).shape == (4, 6)
+    with pytest.raises(EmbeddingFormatError, match="whole float32 vectors"):
+        open_emb(emb_path, count=5)
+    with pytest.raises(EmbeddingFormatError, match="no header"):
+        open_emb(emb_path)
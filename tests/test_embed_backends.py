@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+
+# the embed scripts import their sibling modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "embed"))
+
+from embed.backends import MODEL_CAPABILITIES, FakeBackend, FunctionBackend
+from embed.embed_overlaps import MODELS
+
+
+def test_every_model_has_capabilities():
+    assert set(MODEL_CAPABILITIES) == set(MODELS)
+    for model_name, capabilities in MODEL_CAPABILITIES.items():
+        assert capabilities.model_id == MODELS[model_name]
+        assert capabilities.local or (capabilities.max_batch_size and capabilities.rate)
+
+
+def test_fake_backend_is_deterministic():
+    backend = FakeBackend()
+    embeddings = backend.embed_batch(["Bun di", "Allegra", "Bun di"])
+    assert embeddings.shape == (3, MODEL_CAPABILITIES["fake"].dimension)
+    assert embeddings.dtype == np.float32
+    assert np.array_equal(embeddings[0], embeddings[2])
+    assert not np.allclose(embeddings[0], embeddings[1])
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1)
+    assert np.array_equal(FakeBackend().embed_batch(["Allegra"])[0], embeddings[1])
+
+
+def test_embed_splits_within_capabilities():
+    fake = FakeBackend()
+    requests = []
+
+    def embed_batch(texts):
+        requests.append(len(texts))
+        return fake.embed_batch(texts)
+
+    texts = [f"line {i}\n" for i in range(100)]
+    embeddings = FunctionBackend("fake", embed_batch).embed(texts)
+    assert max(requests) <= MODEL_CAPABILITIES["fake"].max_batch_size and sum(requests) == 100
+    assert np.array_equal(embeddings, fake.embed_batch(texts))
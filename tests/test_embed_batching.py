@@ -0,0 +1,188 @@
+import json
+import random
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from embed.batching import (
+    EmbeddingCountError,
+    embed_api_batches,
+    embed_in_batches,
+    is_content_error,
+    is_transient_error,
+    pack_batches,
+    token_budget_batches,
+)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batches_respect_budget_and_cover_every_item(seed):
+    rng = random.Random(seed)
+    lengths = [rng.randint(1, 600) for _ in range(300)]
+    batches = token_budget_batches(lengths, max_tokens=2048, max_batch_size=16)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 16
+        assert len(batch) == 1 or max(lengths[i] for i in batch) * len(batch) <= 2048
+    # similar lengths end up together: batches are in decreasing length order
+    longest = [max(lengths[i] for i in batch) for batch in batches]
+    assert longest == sorted(longest, reverse=True)
+
+
+def test_item_over_budget_gets_its_own_batch():
+    assert token_budget_batches([10, 5000, 10], max_tokens=100) == [[1], [0, 2]]
+
+
+def test_embed_in_batches_restores_input_order():
+    texts = [f"line {'x' * n}" for n in [5, 50, 1, 20, 20, 7]]
+    calls = []
+
+    def embed_batch(batch):
+        calls.append(batch)
+        return [[len(text), float(text.count("x"))] for text in batch]
+
+    embeddings = embed_in_batches(texts, embed_batch, [len(t) for t in texts], max_tokens=120)
+    assert embeddings.dtype == np.float32
+    assert embeddings.tolist() == [[len(t), t.count("x")] for t in texts]
+    assert len(calls) > 1 and sum(len(c) for c in calls) == len(texts)
+    assert embed_in_batches([], embed_batch, [], max_tokens=10).shape == (0, 0)
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    """OpenAI-style /embeddings endpoint that rejects large batches and any batch containing "POISON"."""
+
+    max_inputs = 8
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        self.server.requests.append(len(texts))
+        if len(texts) > self.max_inputs or any("POISON" in text for text in texts):
+            self.send_response(400)
+            self.end_headers()
+            return
+        data = [{"index": i, "embedding": [float(len(text)), float(sum(map(ord, text)))]}
+                for i, text in reversed(list(enumerate(texts)))]
+        payload = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def http_embed_batch(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}/embeddings"
+
+    def embed_batch(texts):
+        request = urllib.request.Request(url, data=json.dumps({"input": texts}).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            data = json.loads(response.read())["data"]
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    return embed_batch
+
+
+def expected(texts):
+    return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+
+def test_pack_batches_keeps_order_within_limits():
+    lengths = [3, 3, 3, 10, 1, 1, 1, 1, 1]
+    assert pack_batches(lengths, max_batch_size=4, max_tokens=9) == [[0, 1, 2], [3], [4, 5, 6, 7], [8]]
+
+
+def test_api_batches_against_fake_server(fake_server):
+    texts = [f"segment {i} " * (i % 5 + 1) for i in range(30)]
+    embeddings = embed_api_batches(texts, http_embed_batch(fake_server), max_batch_size=8, max_tokens=10_000)
+    assert embeddings.tolist() == expected(texts)
+    assert fake_server.requests == [8, 8, 8, 6]
+
+
+def test_api_batches_bisect_oversized_batches(fake_server):
+    # the provider limit is lower than configured: every batch of 16 is split until it is accepted
+    texts = [f"line {i}" for i in range(20)]
+    embeddings = embed_api_batches(texts, http_embed_batch(fake_server), max_batch_size=16, max_tokens=10_000)
+    assert embeddings.tolist() == expected(texts)
+    assert fake_server.requests == [16, 8, 8, 4]
+
+
+def test_api_batches_bisection_isolates_a_bad_text(fake_server):
+    texts = [f"line {i}" for i in range(8)]
+    texts[5] = "POISON"
+    with pytest.raises(Exception):
+        embed_api_batches(texts, http_embed_batch(fake_server), max_batch_size=8, max_tokens=10_000)
+    # 8 fails -> [0:4] ok, [4:8] fails -> [4:6] fails -> [4] ok, [5] fails and raises
+    assert fake_server.requests == [8, 4, 4, 2, 1, 1]
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_api_batches_raise_permanent_errors_without_retrying_or_bisecting():
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(len(texts))
+        raise StatusError(401)
+
+    with pytest.raises(StatusError):
+        embed_api_batches([f"line {i}" for i in range(8)], embed_batch, max_batch_size=8, max_tokens=10_000)
+    assert calls == [8]
+
+
+@pytest.mark.parametrize("error", [StatusError(429), StatusError(503), ConnectionError("reset")])
+def test_api_batches_retry_transient_errors(error):
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(len(texts))
+        if len(calls) < 3:
+            raise error
+        return expected(texts)
+
+    texts = [f"line {i}" for i in range(8)]
+    embeddings = embed_api_batches(texts, embed_batch, max_batch_size=8, max_tokens=10_000, backoff_base=0.001)
+    assert embeddings.tolist() == expected(texts)
+    assert calls == [8, 8, 8]
+
+
+def test_api_batches_give_up_after_max_retries():
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(len(texts))
+        raise StatusError(503)
+
+    with pytest.raises(StatusError):
+        embed_api_batches(["a", "b"], embed_batch, max_batch_size=8, max_tokens=10_000, max_retries=3,
+                          backoff_base=0.001)
+    assert calls == [2, 2, 2]
+
+
+def test_error_classification():
+    assert is_content_error(StatusError(413)) and not is_transient_error(StatusError(413))
+    assert is_transient_error(StatusError(429)) and is_transient_error(StatusError(502))
+    assert is_transient_error(ConnectionError("reset")) and not is_content_error(ConnectionError("reset"))
+    assert not is_transient_error(StatusError(401)) and not is_content_error(StatusError(401))
+    assert is_content_error(EmbeddingCountError("2 for 3")) and not is_transient_error(EmbeddingCountError("2 for 3"))
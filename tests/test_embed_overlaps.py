@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import types
+
+import numpy as np
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+EMBED_DIR = os.path.join(ROOT, "embed")
+# the embed scripts import their sibling modules directly
+sys.path.insert(0, EMBED_DIR)
+
+from embed import embed_overlaps
+
+HEAVY_MODULES = ["torch", "transformers", "cohere", "openai", "voyageai", "google.genai", "ratelimit", "datasets"]
+
+
+def run_script(*args, code=None):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, EMBED_DIR]))
+    command = [sys.executable, "-c", code] if code else [sys.executable, os.path.join(EMBED_DIR, "embed_overlaps.py"), *args]
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+
+
+def test_import_and_list_models_need_no_provider():
+    loaded = run_script(code=f"import sys, embed_overlaps; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])")
+    assert loaded.strip() == "[]"
+    listing = run_script("--list_models")
+    for model_name in embed_overlaps.MODELS:
+        assert model_name in listing
+
+
+def test_client_is_built_on_first_use_only(monkeypatch):
+    built = []
+
+    class Client:
+        def __init__(self, api_key):
+            built.append(api_key)
+
+    monkeypatch.setitem(sys.modules, "voyageai", types.SimpleNamespace(Client=Client))
+    embed_overlaps.get_client.cache_clear()
+    try:
+        assert built == []
+        client = embed_overlaps.get_client("voyage")
+        assert embed_overlaps.get_client("voyage") is client
+        assert len(built) == 1
+        with pytest.raises(ValueError):
+            embed_overlaps.get_client("transformers")
+    finally:
+        embed_overlaps.get_client.cache_clear()
+
+
+def write_val_overlaps(root):
+    for chap in ["1-regurdientschas-da-stad", "2-viadi-datun"]:
+        (root / chap).mkdir(parents=True)
+        for idiom in ["puter", "sursilv", "sutsilv", "surmiran", "vallader"]:
+            lines = [f"{idiom} {chap} {i}\n" for i in range(7)] + ["BLANK_LINE\n"]
+            (root / chap / f"rm-{idiom}_text_overlaps.txt").write_text("".join(lines), encoding="utf-8")
+
+
+def test_main_runs_val_set_and_full_dataset_with_any_model(tmp_path):
+    from embed.backends import FakeBackend
+
+    write_val_overlaps(tmp_path / "val")
+    embed_overlaps.main("fake", str(tmp_path / "val"), "text", True, None, str(tmp_path / "out"))
+    emb_path = tmp_path / "out" / "fake" / "2-viadi-datun" / "rm-puter_text_overlaps.emb"
+    lines = (tmp_path / "val" / "2-viadi-datun" / "rm-puter_text_overlaps.txt").read_text(encoding="utf-8")
+    expected = FakeBackend().embed_batch(lines.splitlines(keepends=True))
+    assert np.array_equal(np.fromfile(emb_path, dtype=np.float32).reshape(expected.shape), expected)
+
+    # the full dataset path is no longer tied to Cohere
+    write_val_overlaps(tmp_path / "full" / "4.1_wb")
+    embed_overlaps.main("fake", str(tmp_path / "full"), "text", False, 4, str(tmp_path / "full_out"))
+    emb_path = tmp_path / "full_out" / "4.1_wb" / "2-viadi-datun" / "rm-puter_text_overlaps.emb"
+    assert np.array_equal(np.fromfile(emb_path, dtype=np.float32).reshape(expected.shape), expected)
+
+
+def test_onnx_backend_is_named_apart_from_torch(monkeypatch):
+    class SessionOptions:
+        pass
+
+    fake_ort = types.SimpleNamespace(
+        SessionOptions=SessionOptions,
+        GraphOptimizationLevel=types.SimpleNamespace(ORT_ENABLE_ALL=99),
+        InferenceSession=lambda path, options, providers: path,
+    )
+    monkeypatch.setitem(sys.modules, "onnxruntime", fake_ort)
+    model_name = "sentence-swissbert"
+    torch_backend = embed_overlaps.LocalModelBackend(model_name, object(), None)
+    int8 = embed_overlaps.LocalModelBackend(model_name, embed_overlaps.OnnxEmbedder(model_name, None), None)
+    fp32 = embed_overlaps.LocalModelBackend(model_name, embed_overlaps.OnnxEmbedder(model_name, None, int8=False), None)
+
+    # cache keys, .emb headers and output directories all use the backend name
+    assert torch_backend.name == model_name
+    assert int8.name == "sentence-swissbert-onnx-int8"
+    assert fp32.name == "sentence-swissbert-onnx-fp32"
+    assert int8.capabilities == torch_backend.capabilities
+
+
+def test_cohere_backend_makes_one_attempt_and_fails_fast(monkeypatch):
+    class ApiError(Exception):
+        def __init__(self, status_code):
+            super().__init__(f"status {status_code}")
+            self.status_code = status_code
+
+    calls = []
+
+    class Client:
+        def embed(self, texts, **kwargs):
+            calls.append(len(texts))
+            raise ApiError(401)
+
+    api_error = types.ModuleType("cohere.core.api_error")
+    api_error.ApiError = ApiError
+    monkeypatch.setitem(sys.modules, "cohere", types.ModuleType("cohere"))
+    monkeypatch.setitem(sys.modules, "cohere.core", types.ModuleType("cohere.core"))
+    monkeypatch.setitem(sys.modules, "cohere.core.api_error", api_error)
+    monkeypatch.setattr(embed_overlaps, "get_client", lambda provider: Client())
+    monkeypatch.setattr(embed_overlaps.time, "sleep", lambda seconds: pytest.fail("slept before retrying"))
+
+    backend = embed_overlaps.get_backend("cohere-v4")
+    # an invalid key is neither retried nor bisected
+    with pytest.raises(ApiError):
+        backend.embed([f"line {i}" for i in range(10)])
+    assert calls == [10]
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+# the embed scripts import their sibling modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "embed"))
+
+from embed.backends import MODEL_CAPABILITIES, FunctionBackend
+from embed.scheduler import EmbeddingScheduler, backoff_delay, find_pending_jobs
+from embed.embedding_cache import EmbeddingCache
+from embed.resumable_emb import emb_file_complete
+
+
+def write_overlaps(root, num_chapters=3, num_lines=40):
+    for c in range(num_chapters):
+        chapter = root / "4.1_wb" / f"{c}-chapter"
+        chapter.mkdir(parents=True)
+        for idiom in ["puter", "vallader"]:
+            lines = [f"{idiom} {c} line {i % 25}\n" for i in range(num_lines)]
+            (chapter / f"rm-{idiom}_text_overlaps.txt").write_text("".join(lines), encoding="utf-8")
+
+
+def expected(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 997)]
+
+
+class FakeProvider:
+    """Thread-safe fake API: fails the first call of every batch whose first text ends in '7', tracks concurrency."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = self.calls = 0
+        self.failed = set()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.01)
+            if texts[0].strip().endswith("7") and texts[0] not in self.failed:
+                self.failed.add(texts[0])
+                raise ConnectionError("rate limited")
+            return [expected(text) for text in texts]
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def run(scheduler, jobs):
+    asyncio.run(scheduler.run(jobs, report_interval=0.01))
+
+
+def test_scheduler_embeds_all_pending_files_in_order(tmp_path):
+    write_overlaps(tmp_path / "in")
+    out = tmp_path / "out"
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(out), "cohere-v4")
+    assert len(jobs) == 6
+
+    provider = FakeProvider()
+    # each file sends its 25 distinct lines once, so the batch starting with "line 7" fails once
+    capabilities = replace(MODEL_CAPABILITIES["cohere-v4"], max_batch_size=7)
+    backend = FunctionBackend("cohere-v4", provider, capabilities)
+    scheduler = EmbeddingScheduler(backend, concurrency=3, rate=1000, backoff_base=0.001)
+    run(scheduler, jobs)
+
+    assert 1 < provider.max_in_flight <= 3
+    assert provider.failed and scheduler.failed_requests == len(provider.failed)
+    for job in jobs:
+        lines = open(job.text_path, encoding="utf-8").readlines()
+        assert emb_file_complete(job.emb_path, "cohere-v4", len(lines))
+        embeddings = np.fromfile(job.emb_path, dtype=np.float32).reshape(len(lines), 2)
+        assert embeddings.tolist() == [expected(line) for line in lines]
+    assert find_pending_jobs(str(tmp_path / "in"), str(out), "cohere-v4") == []
+    # the vectors are 2-dimensional, so at the model's dimension every file is pending again
+    assert len(find_pending_jobs(str(tmp_path / "in"), str(out), "cohere-v4", expected_dim=1536)) == 6
+
+
+def test_scheduler_sends_only_cache_misses(tmp_path):
+    write_overlaps(tmp_path / "in", num_chapters=2)
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out"), "cohere-v4")
+    provider = FakeProvider()
+    backend = FunctionBackend("cohere-v4", provider)
+    run(EmbeddingScheduler(backend, cache, rate=1000, backoff_base=0.001), jobs)
+    # every file repeats its 25 distinct lines
+    assert cache.embedded == 4 * 25 and cache.hits == 0
+
+    calls = provider.calls
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out2"), "cohere-v4")
+    run(EmbeddingScheduler(backend, cache, rate=1000), jobs)
+    assert provider.calls == calls and cache.hits == 4 * 40
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(attempt, base=1.0, cap=8.0) for attempt in range(10) for _ in range(20)]
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def scheduler_calls(tmp_path, embed_batch):
+    write_overlaps(tmp_path / "in", num_chapters=1, num_lines=8)
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out"), "cohere-v4")[:1]
+    calls = []
+
+    def provider(texts):
+        calls.append(len(texts))
+        return embed_batch(texts, len(calls))
+
+    capabilities = replace(MODEL_CAPABILITIES["cohere-v4"], max_batch_size=8)
+    scheduler = EmbeddingScheduler(FunctionBackend("cohere-v4", provider, capabilities), rate=1000,
+                                   backoff_base=0.001)
+    return scheduler, jobs, calls
+
+
+def test_scheduler_raises_permanent_errors_at_once(tmp_path):
+    def invalid_key(texts, call):
+        raise StatusError(401)
+
+    scheduler, jobs, calls = scheduler_calls(tmp_path, invalid_key)
+    with pytest.raises(StatusError):
+        run(scheduler, jobs)
+    assert calls == [8]
+
+
+def test_scheduler_retries_transient_errors_and_bisects_content_errors(tmp_path):
+    def flaky(texts, call):
+        if call == 1:
+            raise StatusError(429)
+        if any(text.endswith("line 5\n") for text in texts) and len(texts) > 1:
+            raise StatusError(413)
+        return [expected(text) for text in texts]
+
+    scheduler, jobs, calls = scheduler_calls(tmp_path, flaky)
+    run(scheduler, jobs)
+    # rate limited once, retried; then split until the rejected line is alone, each half sent once
+    assert calls[:2] == [8, 8] and sorted(calls[2:]) == [1, 1, 2, 2, 4, 4]
+    lines = open(jobs[0].text_path, encoding="utf-8").readlines()
+    assert np.fromfile(jobs[0].emb_path, dtype=np.float32).reshape(8, 2).tolist() == [expected(l) for l in lines]
+
+
+def test_lines_shared_across_files_are_embedded_once(tmp_path):
+    in_path = tmp_path / "in" / "4.1_wb"
+    for c in range(20):
+        (in_path / f"{c}-chapter").mkdir(parents=True)
+        lines = ["BLANK_LINE\n", f"chapter {c}\n", "PAD\n", "BLANK_LINE\n"]
+        (in_path / f"{c}-chapter" / "rm-puter_text_overlaps.txt").write_text("".join(lines), encoding="utf-8")
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out"), "cohere-v4")
+    sent = []
+    lock = threading.Lock()
+
+    def provider(texts):
+        with lock:
+            sent.extend(texts)
+        time.sleep(0.01)
+        return [expected(text) for text in texts]
+
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    scheduler = EmbeddingScheduler(FunctionBackend("cohere-v4", provider), cache, concurrency=4, rate=1000)
+    run(scheduler, jobs)
+
+    assert sorted(sent) == sorted({"BLANK_LINE\n", "PAD\n", *(f"chapter {c}\n" for c in range(20))})
+    assert cache.embedded == 22 and cache.hits + cache.misses == 80
+    for job in jobs:
+        lines = open(job.text_path, encoding="utf-8").readlines()
+        assert np.fromfile(job.emb_path, dtype=np.float32).reshape(4, 2).tolist() == [expected(l) for l in lines]
+
+
+def test_open_files_are_limited(tmp_path, monkeypatch):
+    from embed import scheduler as scheduler_module
+
+    write_overlaps(tmp_path / "in", num_chapters=4, num_lines=40)
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out"), "cohere-v4")
+    open_writers, max_open = set(), []
+
+    class TrackingWriter(scheduler_module.ResumableEmbWriter):
+        def __init__(self, emb_path, *args):
+            open_writers.add(emb_path)
+            max_open.append(len(open_writers))
+            super().__init__(emb_path, *args)
+
+        def write(self, embeddings):
+            super().write(embeddings)
+            if self.done:
+                open_writers.discard(self.emb_path)
+
+    monkeypatch.setattr(scheduler_module, "ResumableEmbWriter", TrackingWriter)
+    provider = FakeProvider()
+    scheduler = EmbeddingScheduler(FunctionBackend("cohere-v4", provider), concurrency=1, rate=1000,
+                                   backoff_base=0.001, max_files=2)
+    run(scheduler, jobs)
+    assert len(max_open) == len(jobs) and max(max_open) == 2
+
+
+def test_progress_is_recorded_for_each_embedded_prefix(tmp_path):
+    from embed.resumable_emb import ResumableEmbWriter, read_progress
+
+    write_overlaps(tmp_path / "in", num_chapters=1, num_lines=40)
+    jobs = find_pending_jobs(str(tmp_path / "in"), str(tmp_path / "out"), "cohere-v4")[:1]
+    calls = []
+
+    def provider(texts):
+        calls.append(len(texts))
+        if len(calls) > 3:
+            raise StatusError(401)
+        return [expected(text) for text in texts]
+
+    capabilities = replace(MODEL_CAPABILITIES["cohere-v4"], max_batch_size=5)
+    scheduler = EmbeddingScheduler(FunctionBackend("cohere-v4", provider, capabilities), concurrency=1, rate=1000)
+    with pytest.raises(StatusError):
+        run(scheduler, jobs)
+    # the first three requests cover lines 0-14, which were written before the fourth failed
+    assert read_progress(jobs[0].emb_path)["lines_done"] == 15
+    assert ResumableEmbWriter(jobs[0].emb_path, "cohere-v4", 40, jobs[0].text_path).lines_done == 15
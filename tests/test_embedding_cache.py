@@ -0,0 +1,83 @@
+import numpy as np
+
+from embed.embedding_cache import EmbeddingCache, embed_with_cache, text_key
+
+
+def fake_embed(calls):
+    def embed_texts(texts):
+        calls.append(list(texts))
+        return [[float(len(text.strip())), float(text.count("a"))] for text in texts]
+
+    return embed_texts
+
+
+def test_only_distinct_misses_are_embedded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    calls = []
+    lines = ["BLANK_LINE\n", "Ina casa\n", "BLANK_LINE\n", "PAD\n", "Ina casa"]
+    embeddings = embed_with_cache(lines, fake_embed(calls), cache, "m", "text")
+    assert calls == [["BLANK_LINE\n", "Ina casa\n", "PAD\n", "Ina casa"]]
+    assert embeddings.dtype == np.float32
+    assert embeddings.tolist() == [[10, 0], [8, 3], [10, 0], [3, 0], [8, 3]]
+    assert (cache.hits, cache.misses, cache.embedded) == (0, 5, 4)
+
+    # a later chapter (or run) only embeds what is new
+    embeddings = embed_with_cache(["PAD\n", "banana\n"], fake_embed(calls), cache, "m", "text")
+    assert calls[1:] == [["banana\n"]]
+    assert embeddings.tolist() == [[3, 0], [6, 3]]
+    assert (cache.hits, cache.misses, cache.embedded) == (1, 6, 5)
+    cache.close()
+
+    reopened = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    assert set(reopened.get_many("m", "text", [text_key("banana\n"), text_key("PAD\n"), text_key("PAD")])) == {
+        text_key("banana\n"), text_key("PAD\n")}
+
+
+def test_cached_output_matches_uncached_output(tmp_path):
+    # the vector of a text depends on its exact characters, including a trailing newline
+    def embed_texts(texts):
+        return [[float(len(text)), float(text.endswith("\n"))] for text in texts]
+
+    lines = ["foo", "foo\n", "foo\n", "Cafe\u0301\n", "Caf\u00e9\n"]
+    uncached = embed_with_cache(lines, embed_texts, None, "m", "text")
+    for order in [lines, lines[::-1]]:
+        cache = EmbeddingCache(str(tmp_path / f"{len(order[0])}.sqlite"))
+        embed_with_cache(order, embed_texts, cache, "m", "text")
+        assert np.array_equal(embed_with_cache(lines, embed_texts, cache, "m", "text"), uncached)
+        cache.close()
+
+
+def test_cache_is_keyed_by_model_and_text_type(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    calls = []
+    embed_with_cache(["PAD\n"], fake_embed(calls), cache, "m", "text")
+    embed_with_cache(["PAD\n"], fake_embed(calls), cache, "m", "html")
+    embed_with_cache(["PAD\n"], fake_embed(calls), cache, "other", "text")
+    assert len(calls) == 3
+    assert embed_with_cache([], fake_embed(calls), cache, "m", "text").shape == (0, 0)
+    assert len(calls) == 3
+
+
+def test_bulk_lookup_over_many_keys(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    lines = [f"line {i}\n" for i in range(1200)]
+    embed_with_cache(lines, fake_embed([]), cache, "m", "text")
+    calls = []
+    embeddings = embed_with_cache(lines, fake_embed(calls), cache, "m", "text")
+    assert calls == [] and len(embeddings) == 1200 and cache.hits == 1200
+
+
+def test_other_tables_in_the_cache_file_are_left_alone(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "shared.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE embeddings (name TEXT)")
+    conn.execute("INSERT INTO embeddings VALUES ('kept')")
+    conn.commit()
+    conn.close()
+
+    cache = EmbeddingCache(path)
+    embed_with_cache(["PAD\n"], fake_embed([]), cache, "m", "text")
+    cache.close()
+    assert sqlite3.connect(path).execute("SELECT name FROM embeddings").fetchall() == [("kept",)]
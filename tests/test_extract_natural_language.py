@@ -1,15 +1,20 @@
+import random
 import re
+import sys
 from html import unescape
 import pytest
 import tempfile
 import os
 
 from extract_natural_language import (
+    MEMO_MAX_LENGTH,
+    _strip_short_html_tags,
     strip_html_tags,
     collect_texts,
     extract_text,
     collect_texts_workbook_commentary,
     extract_text_workbook_teacher,
+    walk_texts,
 )
 
 
@@ -28,6 +33,51 @@ class TestStripHtmlTags:
         assert strip_html_tags(input_html) == expected
 
 
+def reference_strip_html_tags(text):
+    """The original three-pass implementation, kept as the parity oracle."""
+    text = unescape(text)
+    text = re.sub(r'<b\b[^>]*>', '<strong>', text, flags=re.IGNORECASE)
+    text = re.sub(r'</b\s*>', '</strong>', text, flags=re.IGNORECASE)
+    text = re.sub(r'<(?!\/?strong\b)[^>]+>', '', text)
+    return text.strip()
+
+
+# Fragments that combine into nested, malformed, mixed-case and entity-laden markup
+FRAGMENTS = [
+    "<", ">", "/", " ", "\n", "\t", "b", "B", "x", "strong", "STRONG", "Strong", "<b>", "</b>", "<B>", "</B >",
+    "<b class='a'>", "<br>", "<br/>", "<bx>", "<b-x>", "</b x>", "<strong>", "</strong>", "<strong >",
+    "<strongest>", "<p>", "</p>", "<div class=\"q\">", "<a href='u'>", "&lt;", "&gt;", "&amp;", "&nbsp;",
+    "&lt;b&gt;", "&#60;", "&lt;/b&gt;", "Fè", "il bain", "riè!", "é", "&", ";", "=", "\"", "'",
+]
+
+
+class TestStripHtmlTagsParity:
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_reference_on_random_markup(self, seed):
+        rng = random.Random(seed)
+        for _ in range(500):
+            text = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 30)))
+            assert strip_html_tags(text) == reference_strip_html_tags(text), text
+
+    @pytest.mark.parametrize("text", [
+        "<<b>>", "<x <b>", "</<b>", "<<b>strong>", "<b", "</b", "<b>unclosed", "  <p> padded </p>  ",
+        "<STRONG>kept?</STRONG>", "<strong\n>", "</b\n\t>", "&lt;b&gt;bold&lt;/b&gt;", "",
+    ])
+    def test_matches_reference_on_edge_cases(self, text):
+        assert strip_html_tags(text) == reference_strip_html_tags(text)
+
+    def test_only_short_markup_is_memoized(self):
+        _strip_short_html_tags.cache_clear()
+        for _ in range(3):
+            assert strip_html_tags("<p>Memo</p>") == "Memo"
+        assert _strip_short_html_tags.cache_info().hits == 2
+        long_markup = "<p>" + "word " * MEMO_MAX_LENGTH + "</p>"
+        for _ in range(2):
+            assert strip_html_tags(long_markup) == reference_strip_html_tags(long_markup)
+        assert _strip_short_html_tags.cache_info().currsize == 1
+
+
 class TestCollectTexts:
 
     def test_skips_media_image(self):
@@ -281,3 +331,157 @@ class TestExtractTextWorkbookTeacher:
         # dedup, only one "Work"; teacher only one "Dup"
         assert wb_lines == ["Work"]
         assert tc_lines == ["Dup"]
+
+
+# The original recursive walkers, kept as the parity oracle for walk_texts
+# (with the memoTitle check as an equality test and a missing contentType tolerated).
+def reference_collect_texts(obj, texts, html_pieces):
+    if isinstance(obj, dict):
+        # skip pure image entries
+        if obj.get('mediaType') == 'Image':
+            return
+
+        for key, val in obj.items():
+            if key == 'url':
+                continue
+
+            if key == 'memoTitle' and isinstance(val, str):
+                texts.append(val)
+                html_pieces.append(val)
+
+            if key == 'properties' and isinstance(val, dict):
+                title = val.get('title')
+                if title and obj.get("contentType") != "chapter":
+                    texts.append(title)
+                    html_pieces.append(title)
+
+            if key == 'markup' and isinstance(val, str):
+                stripped = strip_html_tags(val)
+                if stripped:
+                    texts.append(stripped)
+                    html_pieces.append(val)
+
+            # recurse
+            reference_collect_texts(val, texts, html_pieces)
+
+    elif isinstance(obj, list):
+        for item in obj:
+            reference_collect_texts(item, texts, html_pieces)
+
+def reference_collect_texts_workbook_commentary(obj, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, current_obj_is_main_content_context, parent_content_type=None):
+    if isinstance(obj, dict):
+        if obj.get('mediaType') == 'Image':
+            return
+
+        for key, val in obj.items():
+            if key == 'url':
+                continue
+
+            if key == 'mainContent' and isinstance(val, dict):
+                markup = val.get('markup')
+                if markup and isinstance(markup, str):
+                    stripped = strip_html_tags(markup)
+                    if stripped:
+                        teacher_texts.append(stripped)
+                        teacher_htmls.append(markup)
+                reference_collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, True, obj.get("contentType"))
+            
+            elif key == 'mainContent2' and isinstance(val, dict):
+                markup = val.get('markup')
+                if markup and isinstance(markup, str):
+                    stripped = strip_html_tags(markup)
+                    if stripped:
+                        workbook_texts.append(stripped) # mainContent2.markup to workbook
+                        workbook_htmls.append(markup)
+                reference_collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
+
+            elif key == 'memoTitle' and isinstance(val, str):
+                workbook_texts.append(val)
+                workbook_htmls.append(val)
+            
+            elif key == 'properties' and isinstance(val, dict):
+                # 'title' within 'properties' depends on the contentType of 'obj' (the holder of 'properties')
+                title = val.get('title')
+                if title and isinstance(title,str) and obj.get("contentType") != "chapter":
+                    workbook_texts.append(strip_html_tags(title))
+                    workbook_htmls.append(title)
+                reference_collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
+            
+            elif key == 'markup' and isinstance(val, str):
+                if not current_obj_is_main_content_context: # we want to collect all non-mainContent markup into workbook_texts
+                    stripped = strip_html_tags(val)
+                    if stripped:
+                        workbook_texts.append(stripped)
+                        workbook_htmls.append(val)
+            
+            elif isinstance(val, (dict, list)) and key not in ('mainContent', 'mainContent2', 'properties'):
+                 reference_collect_texts_workbook_commentary(val, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, False, obj.get("contentType"))
+
+    elif isinstance(obj, list):
+        for item in obj:
+            # Propagate context and parent_content_type. parent_content_type might be less relevant for list items directly.
+            reference_collect_texts_workbook_commentary(item, workbook_texts, teacher_texts, workbook_htmls, teacher_htmls, current_obj_is_main_content_context, parent_content_type)
+
+
+TREE_KEYS = ["markup", "memoTitle", "properties", "mainContent", "mainContent2", "url", "title",
+             "contentType", "mediaType", "items", "memo", "Title"]
+TREE_STRINGS = ["<p>Para</p>", "<b>Bold</b> text", "Plain", "", "  ", "&amp; more", "chapter", "Image", "http://x"]
+
+
+def random_tree(rng, depth=0):
+    roll = rng.random()
+    if depth > 5 or roll < 0.4:
+        return rng.choice(TREE_STRINGS + [None, 3])
+    if roll < 0.55:
+        return [random_tree(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    return {rng.choice(TREE_KEYS): random_tree(rng, depth + 1) for _ in range(rng.randint(0, 5))}
+
+
+class TestWalkTextsParity:
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_recursive_walkers(self, seed):
+        rng = random.Random(seed)
+        for _ in range(200):
+            tree = random_tree(rng)
+            expected = [], []
+            reference_collect_texts(tree, *expected)
+            assert walk_texts(tree) == expected
+            for context in (False, True):
+                expected = [], [], [], []
+                reference_collect_texts_workbook_commentary(tree, *expected, context)
+                assert walk_texts(tree, True, context) == expected
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_extract_dedup_matches_index_bookkeeping(self, seed):
+        def reference_dedup(texts, htmls):
+            unique, corresponding, seen = [], [], set()
+            for i, text in enumerate(texts):
+                if text not in seen:
+                    unique.append(text)
+                    corresponding.append(htmls[i])
+                    seen.add(text)
+            return unique, corresponding
+
+        rng = random.Random(seed)
+        for _ in range(200):
+            tree = {"contentType": "exercise", "items": [random_tree(rng) for _ in range(3)]}
+            texts, htmls = [], []
+            reference_collect_texts(tree, texts, htmls)
+            if not all(isinstance(text, str) for text in texts):
+                continue  # neither version can join a non-string title
+            assert extract_text(tree) == ("\n".join(texts), *reference_dedup(texts, htmls))
+
+            wb, tc, wb_htmls, tc_htmls = [], [], [], []
+            reference_collect_texts_workbook_commentary(tree, wb, tc, wb_htmls, tc_htmls, False)
+            (wb_unique, wb_first), (tc_unique, tc_first) = reference_dedup(wb, wb_htmls), reference_dedup(tc, tc_htmls)
+            assert extract_text_workbook_teacher(tree) == (
+                "\n".join(dict.fromkeys(wb)), "\n".join(dict.fromkeys(tc)), wb_unique, tc_unique, wb_first, tc_first
+            )
+
+    def test_deep_nodes_do_not_hit_recursion_limit(self):
+        node = {"markup": "<p>Leaf</p>"}
+        for _ in range(5 * sys.getrecursionlimit()):
+            node = {"items": [node]}
+        assert walk_texts(node) == (["Leaf"], ["<p>Leaf</p>"])
+        assert walk_texts(node, True) == (["Leaf"], [], ["<p>Leaf</p>"], [])
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import fetch_api_dataset
+
+
+# A small Umbraco-like tree: root -> (a, b) -> (a1, a2, a3) -> flat descendants.
+# "shared" is returned under both a1 and a2 to exercise deduplication.
+CHILDREN = {
+    "root": ["a", "b"],
+    "a": ["a1", "a2", "a3"],
+    "b": [],
+}
+DESCENDANTS = {
+    "a1": ["a1-x", "a1-y", "a1-z", "shared"],
+    "a2": ["shared"],
+    "a3": [],
+}
+UPDATED = {}
+
+
+def make_item(node_id):
+    return {
+        "id": node_id,
+        "contentType": "exercise",
+        "updateDate": UPDATED.get(node_id, "2024-01-01T00:00:00Z"),
+        "route": {"path": f"/rm/{node_id}"},
+        "properties": {"title": f"Title {node_id} {UPDATED.get(node_id, '')}"},
+    }
+
+
+class StubUmbracoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests_seen.append(self.path)
+        if url.path.startswith("/item/"):
+            body = make_item(url.path[len("/item/"):])
+        else:
+            query = parse_qs(url.query)
+            relation, parent_id = query["fetch"][0].split(":")
+            skip, take = int(query["skip"][0]), int(query["take"][0])
+            ids = (CHILDREN if relation == "children" else DESCENDANTS).get(parent_id, [])
+            body = {"items": [make_item(i) for i in ids[skip:skip + take]]}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubUmbracoHandler)
+    server.requests_seen = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(fetch_api_dataset, "BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    # small pages so that paging is exercised
+    monkeypatch.setattr(fetch_api_dataset, "PAGE_SIZE", 2)
+    monkeypatch.setattr(fetch_api_dataset, "MAX_DEPTH", 2)
+    monkeypatch.setattr(fetch_api_dataset.time, "sleep", lambda _: None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read_ids(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+EXPECTED_IDS = ["root", "a", "b", "a1", "a2", "a3", "a1-x", "a1-y", "a1-z", "shared"]
+
+
+def test_serial_crawl_against_stub(stub_server, tmp_path):
+    out = tmp_path / "export.jsonl"
+    written = fetch_api_dataset.fetch_all_descendants("root", str(out))
+    assert written == len(EXPECTED_IDS)
+    assert read_ids(out) == EXPECTED_IDS
+    # checkpoint is removed after a completed crawl
+    assert not (tmp_path / "export.checkpoint.json").exists()
+
+
+def test_async_crawl_matches_serial(stub_server, tmp_path):
+    serial, concurrent = tmp_path / "serial.jsonl", tmp_path / "async.jsonl"
+    fetch_api_dataset.fetch_all_descendants("root", str(serial))
+    asyncio.run(fetch_api_dataset.fetch_all_descendants_async("root", str(concurrent), concurrency=4, rate=1000))
+    assert concurrent.read_bytes() == serial.read_bytes()
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_crawl_resumes_from_checkpoint(stub_server, tmp_path, monkeypatch, use_async):
+    out = tmp_path / "export.jsonl"
+    checkpoint = tmp_path / "export.checkpoint.json"
+    out.write_text('{"id": "previous"}\n', encoding="utf-8")
+
+    def crawl():
+        if use_async:
+            return asyncio.run(fetch_api_dataset.fetch_all_descendants_async("root", str(out), concurrency=2, rate=1000))
+        return fetch_api_dataset.fetch_all_descendants("root", str(out))
+
+    # fail on the flat descendants of a2, after the upper levels are on disk
+    real_fetch = fetch_api_dataset.fetch_flat_descendants
+
+    def failing_fetch(parent_id, *args, **kwargs):
+        if parent_id == "a2":
+            raise ConnectionError("boom")
+        return real_fetch(parent_id, *args, **kwargs)
+
+    monkeypatch.setattr(fetch_api_dataset, "fetch_flat_descendants", failing_fetch)
+    with pytest.raises(ConnectionError):
+        crawl()
+    assert checkpoint.exists()
+    frontier = json.loads(checkpoint.read_text())["frontier"]
+    assert [entry[0] for entry in frontier] == ["a2", "a3"]
+    # the previous export is kept until the crawl completes
+    assert read_ids(out) == ["previous"]
+
+    monkeypatch.setattr(fetch_api_dataset, "fetch_flat_descendants", real_fetch)
+    stub_server.requests_seen.clear()
+    crawl()
+    assert read_ids(out) == EXPECTED_IDS
+    assert not checkpoint.exists()
+    assert not (tmp_path / "export.jsonl.partial").exists()
+    # the upper levels were not downloaded again
+    assert not any("children" in path or path == "/item/root" for path in stub_server.requests_seen)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_sync_export_fetches_only_changes(stub_server, tmp_path, monkeypatch, use_async):
+    previous = tmp_path / "previous.jsonl"
+    fetch_api_dataset.fetch_all_descendants("root", str(previous))
+
+    # a1-y is edited, a1-z is deleted and a3-new is created
+    monkeypatch.setitem(UPDATED, "a1-y", "2025-06-01T00:00:00Z")
+    monkeypatch.setitem(DESCENDANTS, "a1", ["a1-x", "a1-y", "shared"])
+    monkeypatch.setitem(DESCENDANTS, "a3", ["a3-new"])
+    stub_server.requests_seen.clear()
+
+    synced, changelog_file = tmp_path / "synced.jsonl", tmp_path / "changes.json"
+    changelog = fetch_api_dataset.sync_export("root", str(previous), str(synced), str(changelog_file),
+                                              async_crawl=use_async, concurrency=2, rate=1000)
+
+    assert changelog["added"] == ["a3-new"]
+    assert changelog["modified"] == ["a1-y"]
+    assert changelog["removed"] == ["a1-z"]
+    assert changelog["paths"] == ["/rm/a1-y", "/rm/a1-z", "/rm/a3-new"]
+    assert json.loads(changelog_file.read_text())["added"] == ["a3-new"]
+    # only the changed nodes were downloaded with expanded properties
+    expanded = sorted(p.split("?")[0] for p in stub_server.requests_seen if p.startswith("/item/") and "expand" in p)
+    assert expanded == ["/item/a1-y", "/item/a3-new"]
+
+    # the fetched items were streamed through a temp file that is gone, as is the listing
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["changes.json", "previous.jsonl", "synced.jsonl"]
+
+    fresh = tmp_path / "fresh.jsonl"
+    fetch_api_dataset.fetch_all_descendants("root", str(fresh))
+    assert synced.read_bytes() == fresh.read_bytes()
+
+
+def test_token_bucket_limits_rate():
+    async def take(n, bucket):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(n):
+            await bucket.acquire()
+        return loop.time() - start
+
+    # 5 burst tokens, then 5 more at 50/s -> at least ~0.1s
+    elapsed = asyncio.run(take(10, fetch_api_dataset.TokenBucket(rate=50, capacity=5)))
+    assert elapsed >= 0.08
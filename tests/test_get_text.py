@@ -0,0 +1,76 @@
+import json
+
+from datasets import Dataset
+
+from embed import get_text
+from load_textbooks import textbook_cache_entry
+from models.textbook import Textbook
+from models.textbook_catalog import TextbookCatalog
+
+
+def make_textbook(idiom, path, chapters):
+    rows = {"chapterPath": [], "sentenceExtractedText": [], "sentenceHTML": []}
+    for chapter in chapters:
+        for i in range(3):
+            rows["chapterPath"].append(f"{path}/{chapter}/exercise-{i}")
+            rows["sentenceExtractedText"].append(f"{idiom} {chapter} {i}")
+            rows["sentenceHTML"].append(f"<p>{idiom} {chapter} {i}</p>")
+    return Textbook(idiom, "language", "2.1", "workbook", hf_dataset=Dataset.from_dict(rows))
+
+
+def make_mappings(tmp_path):
+    mappings_dir = tmp_path / "mappings"
+    mappings_dir.mkdir()
+    textbooks = {}
+    for book in ["2.1_wb", "2.1_tc", "3.1_wb"]:
+        klasse, book_num = book.split("_")[0].split(".")
+        book_type = "workbook" if "wb" in book else "teachers_commentary"
+        chapters = [f"1-{book}", f"2-{book}"]
+        with open(mappings_dir / f"{book}.jsonl", "w") as f:
+            for chapter in chapters:
+                f.write(json.dumps({"rm-sursilv": chapter, "rm-puter": chapter, "rm-vallader": None}) + "\n")
+        for idiom in ["rm-sursilv", "rm-puter"]:
+            path = f"/{get_text.IDIOMS[idiom]}/klasse-{klasse}/arbeitsbuch-{book_num}/{book_type}"
+            textbooks[path] = make_textbook(idiom, path, chapters)
+    return mappings_dir, textbooks
+
+
+def read_tree(root):
+    return {str(p.relative_to(root)): p.read_text(encoding="utf-8") for p in sorted(root.rglob("*")) if p.is_file()}
+
+
+def test_export_full_writes_both_text_types(tmp_path):
+    mappings_dir, textbooks = make_mappings(tmp_path)
+    out = tmp_path / "out"
+    assert get_text.export_full(textbooks, str(out), ["text", "html"], mappings_dir=str(mappings_dir)) == 6
+    files = read_tree(out)
+    assert len(files) == 3 * 2 * 2 * 2  # books x chapters x idioms x text types
+    assert files["2.1_tc/1-2.1_tc/rm-puter_text.txt"] == "".join(f"rm-puter 1-2.1_tc {i}\n" for i in range(3))
+    assert files["2.1_tc/1-2.1_tc/rm-puter_html.txt"] == "".join(f"<p>rm-puter 1-2.1_tc {i}</p>\n" for i in range(3))
+    assert not any(name.endswith(".tmp") for name in files)
+
+
+def cache_catalog(textbooks, variant_dir):
+    entries = []
+    for i, (path, tb) in enumerate(textbooks.items()):
+        tb.textbook_path = path
+        tb.hf_dataset.save_to_disk(str(variant_dir / f"book_{i}"))
+        entries.append(textbook_cache_entry(tb, f"book_{i}"))
+    return TextbookCatalog(entries, str(variant_dir))
+
+
+def test_export_full_in_parallel_matches_serial(tmp_path, monkeypatch):
+    mappings_dir, textbooks = make_mappings(tmp_path)
+    get_text.export_full(textbooks, str(tmp_path / "serial"), ["text", "html"], mappings_dir=str(mappings_dir))
+    catalog = cache_catalog(textbooks, tmp_path / "variant")
+    # the workers rebuild the catalog from its entries, without loading (and touching) the cache manifest
+    monkeypatch.setattr(get_text, "load_catalog", None)
+    get_text.export_full(catalog, str(tmp_path / "parallel"), ["text", "html"], num_proc=2, mappings_dir=str(mappings_dir))
+    assert read_tree(tmp_path / "parallel") == read_tree(tmp_path / "serial")
+    assert not (tmp_path / "variant" / "manifest.json").exists()
+
+
+def test_export_full_of_books_not_cached_on_disk_runs_serially(tmp_path):
+    mappings_dir, textbooks = make_mappings(tmp_path)
+    assert get_text.worker_catalog_args(textbooks) is None
+    assert get_text.export_full(textbooks, str(tmp_path / "out"), ["text"], num_proc=2, mappings_dir=str(mappings_dir)) == 6
@@ -0,0 +1,40 @@
+import pytest
+from bs4 import BeautifulSoup
+
+import html_backends
+from html_backends import available_html_backends, resolve_html_backend, stripped_to_html_map
+
+MARKUP = [
+    "",
+    "Plain title without tags",
+    "Hello <b>x</b>",
+    "<p>Fè il bain &amp; riè!&nbsp;Sest tü</p><ul><li>Un</li><li><strong>Dus</strong> &lt;3</li></ul>",
+    "<p class=\"a\" style='color:red'>x<br>y</p><div><p>in</p></div>",
+    "<table><tr><td>a</td><th>b</th></tr></table>",
+    "<h2 id=x>T</h2><p><img src=\"a.png\" alt=\"q\"> txt</p>",
+]
+
+
+@pytest.mark.parametrize("markup", MARKUP)
+@pytest.mark.parametrize("backend", available_html_backends())
+def test_backends_match_html_parser_mapping(markup, backend):
+    expected = html_backends.build_stripped_to_html_map(BeautifulSoup(markup, "html.parser"))
+    assert stripped_to_html_map(markup, backend) == expected
+
+
+def test_markup_without_tags_is_not_parsed(monkeypatch):
+    monkeypatch.setattr(html_backends, "BeautifulSoup", None)
+    assert stripped_to_html_map("A title &amp; more") == {}
+
+
+def test_resolve_html_backend(monkeypatch):
+    # lxml is opt-in, even when installed
+    monkeypatch.setattr(html_backends, "available_html_backends", lambda: ("lxml", "html.parser"))
+    assert resolve_html_backend() == "html.parser"
+    assert resolve_html_backend("lxml") == "lxml"
+    monkeypatch.setattr(html_backends, "HTML_BACKEND", "lxml")
+    assert resolve_html_backend() == "lxml"
+    monkeypatch.setattr(html_backends, "HTML_BACKEND", None)
+    assert resolve_html_backend() == "html.parser"
+    with pytest.raises(ValueError):
+        resolve_html_backend("no-such-parser")
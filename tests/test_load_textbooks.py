@@ -1,13 +1,17 @@
 import json
 import os
-import tempfile
 from types import SimpleNamespace
 import pytest
-from load_textbooks import build_stripped_to_html_map, save_segments_to_textbooks
-from bs4 import BeautifulSoup
+from load_textbooks import save_segments_to_textbooks
 
 import load_textbooks  # adjust this to your actual module name
-from datasets import Features, Value
+from models import textbook_catalog
+from datasets import Dataset, Features, Value
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import arrow_utils
 
 
 class DummyTb(SimpleNamespace):
@@ -32,6 +36,25 @@ def test_load_and_filter_jsonl(tmp_path):
     assert only_books == [lines[1], lines[2]]
 
 
+def test_streaming_readers_match_load_and_filter_jsonl(tmp_path):
+    lines = [
+        {"id": "1", "contentType": "foo", "properties": {"title": "a book"}},
+        {"id": "2", "contentType": "book"},
+        {"id": "3", "contentType": "chapter", "properties": {"title": "book"}},
+        {"id": "4", "contentType": "book"},
+    ]
+    p = tmp_path / "data.jsonl"
+    with open(p, "w", encoding="utf-8") as f:
+        for obj in lines:
+            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+    all_data, only_books = load_textbooks.load_and_filter_jsonl(str(p))
+    iterator = load_textbooks.iter_jsonl(str(p))
+    assert not isinstance(iterator, list)
+    assert list(iterator) == all_data
+    assert load_textbooks.load_textbooks_meta(str(p)) == only_books == [lines[1], lines[3]]
+
+
 def test_init_textbooks_list_with_and_without_isbn():
     # With isbn
     meta = [{
@@ -113,6 +136,9 @@ def test_save_segments_to_textbooks(monkeypatch):
     ]
 
     rows_per_book, features = load_textbooks.save_segments_to_textbooks(json_lines, textbooks_as_dict)
+    # a lazily consumed stream of lines gives the same rows
+    streamed_rows, _ = load_textbooks.save_segments_to_textbooks(iter(json_lines), textbooks_as_dict)
+    assert streamed_rows == rows_per_book
 
     # Only the first JSON line should be captured, under index 0 (the workbook)
     assert list(rows_per_book.keys()) == [path_tb1]
@@ -270,4 +296,275 @@ def test_define_textbook_type_additional_patterns():
     # chapter always goes there, even if path looks workbook‐like
     assert load_textbooks.define_textbook_type("chapter", "/foo/workbook") == "teachers_commentary"
     # anything else defaults
-    assert load_textbooks.define_textbook_type("foo", "/no/special/path") == "workbook"
\ No newline at end of file
+    assert load_textbooks.define_textbook_type("foo", "/no/special/path") == "workbook"
+
+def write_export(tmp_path, markup="<p>Text</p>"):
+    raw_dir = tmp_path / "raw_data" / "umbraco-export.v1"
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "id": "m1",
+        "contentType": "book",
+        "route": {"path": "/En/klasse-3/book-1"},
+        "properties": {"idiom": "En", "klass": "3", "workBook": "1", "isbn": ""}
+    }
+    seg = {
+        "id": "s1",
+        "contentType": "T1",
+        "route": {"path": "/En/klasse-3/book-1"},
+        "markup": markup
+    }
+    with open(raw_dir / "umbraco-export.v1.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps(meta) + "\n")
+        f.write(json.dumps(seg) + "\n")
+
+
+def test_load_textbooks_warm_cache_skips_export(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_export(tmp_path)
+    monkeypatch.setattr(load_textbooks, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(load_textbooks, "CONTENT_TYPES_INCLUDED", {"T1"})
+    monkeypatch.setattr(load_textbooks, "IDIOMS_MAPPING", {"En": "rm-en"})
+
+    cold = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    assert len(list((tmp_path / "cache").glob("*/manifest.json"))) == 1
+
+    # a warm start must not read the export at all
+    def fail(*args, **kwargs):
+        raise AssertionError("export was parsed on a warm cache")
+    monkeypatch.setattr(load_textbooks, "load_textbooks_meta", fail)
+    monkeypatch.setattr(load_textbooks, "iter_jsonl", fail)
+    warm = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+
+    assert list(warm) == list(cold) == ["/En/klasse-3/book-1/workbook"]
+    tb = warm["/En/klasse-3/book-1/workbook"]
+    assert tb.idiom == "rm-en"
+    assert tb.grade_volume == "3.1"
+    assert tb.book_type == "workbook"
+    assert tb.hf_dataset["segmentExtractedText"] == ["Text"]
+
+    # different loader options are a cache miss
+    with pytest.raises(AssertionError, match="warm cache"):
+        load_textbooks.load_textbooks(data_path=tmp_path / "raw_data", split_segments_into_sentences=True)
+
+
+def test_load_textbooks_rebuilds_when_export_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_export(tmp_path)
+    monkeypatch.setattr(load_textbooks, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(load_textbooks, "CONTENT_TYPES_INCLUDED", {"T1"})
+
+    load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    write_export(tmp_path, markup="<p>Changed text</p>")
+    textbooks = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    assert textbooks["/En/klasse-3/book-1/workbook"].hf_dataset["segmentExtractedText"] == ["Changed text"]
+
+
+def test_load_textbooks_cache_variants_side_by_side_and_lru(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_export(tmp_path, markup="<p>One line\n</p><p>Other line</p>")
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(load_textbooks, "CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(load_textbooks, "CONTENT_TYPES_INCLUDED", {"T1"})
+
+    segments = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    sentences = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data", split_segments_into_sentences=True)
+    assert len(list(cache_dir.glob("*/manifest.json"))) == 2
+
+    # each option set gets back its own variant, never the other one
+    monkeypatch.setattr(load_textbooks, "iter_jsonl", None)
+    again = load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    path = "/En/klasse-3/book-1/workbook"
+    assert again[path].hf_dataset.column_names == segments[path].hf_dataset.column_names
+    assert "sentenceId" in sentences[path].hf_dataset.column_names
+
+    # a new loader version is a new variant; with a tiny size cap the least recently used one is evicted
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(load_textbooks, "CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(load_textbooks, "CONTENT_TYPES_INCLUDED", {"T1"})
+    monkeypatch.setattr(load_textbooks, "LOADER_VERSION", "test")
+    monkeypatch.setattr(load_textbooks, "CACHE_MAX_BYTES", 1)
+    load_textbooks.load_textbooks(data_path=tmp_path / "raw_data")
+    manifests = [json.loads(p.read_text()) for p in cache_dir.glob("*/manifest.json")]
+    assert [m["loader_version"] for m in manifests] == ["test"]
+
+
+def make_parallel_fixture():
+    textbooks_dict = {
+        "/rm/klasse-4/arbeitsbuch-1/workbook": DummyTb(),
+        "/rm/klasse-4/arbeitsbuch-1/teachers_commentary": DummyTb(),
+    }
+    json_lines = []
+    for i in range(40):
+        json_lines.append({
+            "id": f"ex{i}",
+            "contentType": "exercise",
+            "route": {"path": f"/rm/klasse-4/arbeitsbuch-1/chapter-{i % 3}/exercise-{i}"},
+            "properties": {"title": f"Exercise {i}", "content": {"items": [{"markup": f"<p>First {i}\n</p><p>a)</p><p>Second <b>{i}</b></p>"}]}},
+        })
+        json_lines.append({
+            "id": f"sol{i}",
+            "contentType": "solution",
+            "route": {"path": f"/rm/klasse-4/arbeitsbuch-1/chapter-{i % 3}/solution-{i}"},
+            "markup": f"<ul><li>• Answer {i}</li></ul>",
+        })
+    json_lines.append({
+        "id": "topics",
+        "contentType": "topicsPage",
+        "route": {"path": "/rm/klasse-4/vorwort-1"},
+        "properties": {"title": "Topics"},
+        "mainContent": {"markup": "<p>For teachers</p>"},
+        "mainContent2": {"markup": "<p>For pupils</p>"},
+    })
+    return json_lines, textbooks_dict
+
+
+@pytest.mark.parametrize("split", [False, True])
+def test_save_segments_to_textbooks_parallel_matches_serial(split):
+    json_lines, textbooks_dict = make_parallel_fixture()
+    serial_rows, serial_features = save_segments_to_textbooks(json_lines, textbooks_dict, split)
+    # raw JSON strings are parsed by the workers
+    raw_lines = [json.dumps(line) for line in json_lines]
+    parallel_rows, parallel_features = save_segments_to_textbooks(iter(raw_lines), textbooks_dict, split, num_proc=2)
+    assert serial_features == parallel_features
+    assert list(parallel_rows) == list(serial_rows)
+    assert parallel_rows == serial_rows
+    assert sum(len(rows) for rows in serial_rows.values()) > 80
+
+    # many small batches are still yielded in input order
+    per_segment = list(load_textbooks.extract_segment_rows_parallel(raw_lines, textbooks_dict, split, 3, batch_size=5))
+    assert per_segment == [load_textbooks.extract_segment_rows(line, textbooks_dict, split) for line in json_lines]
+
+
+@pytest.mark.parametrize("split", [False, True])
+def test_columnar_build_matches_row_dicts(split):
+    json_lines, textbooks_dict = make_parallel_fixture()
+    rows_per_book, features = save_segments_to_textbooks(json_lines, textbooks_dict, split)
+    columns_per_book, column_features = load_textbooks.save_segments_to_columns(json_lines, textbooks_dict, split)
+    assert column_features == features
+    assert list(columns_per_book) == list(rows_per_book)
+    for path, rows in rows_per_book.items():
+        assert list(columns_per_book[path].rows()) == rows
+        # several Arrow chunks per book
+        columns = arrow_utils.BookColumns(features, chunk_size=7)
+        columns.extend(rows)
+        assert len(columns) == len(rows)
+        assert list(columns.rows()) == rows
+        assert columns.columns()["contentType"].type == pa.dictionary(pa.int32(), pa.string())
+        expected = Dataset.from_dict({key: [r[key] for r in rows] for key in features}, features=features)
+        ds = Dataset.from_dict(columns.columns(), features=features)
+        assert ds.features == expected.features
+        assert ds.to_list() == expected.to_list()
+
+
+def write_idiom_export(tmp_path, monkeypatch):
+    """An export with workbook and teacher's commentary segments for three books."""
+    monkeypatch.chdir(tmp_path)
+    raw_dir = tmp_path / "raw_data" / "umbraco-export.v1"
+    raw_dir.mkdir(parents=True)
+    lines = []
+    for idiom, grade in [("Puter", "4"), ("Vallader", "4"), ("Puter", "5")]:
+        base = f"/{idiom.lower()}/klasse-{grade}/arbeitsbuch-1"
+        lines.append({"id": f"b-{idiom}-{grade}", "contentType": "book", "route": {"path": base},
+                      "properties": {"idiom": idiom, "klass": grade, "workBook": "1"}})
+        lines.append({"id": f"e-{idiom}-{grade}", "contentType": "exercise", "route": {"path": f"{base}/ex"},
+                      "markup": f"<p>{idiom} {grade}</p>"})
+        lines.append({"id": f"s-{idiom}-{grade}", "contentType": "solution", "route": {"path": f"{base}/sol"},
+                      "markup": f"<p>Solution {idiom} {grade}</p>"})
+    with open(raw_dir / "umbraco-export.v1.jsonl", "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+    monkeypatch.setattr(load_textbooks, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(load_textbooks, "CONTENT_TYPES_INCLUDED", {"exercise", "solution"})
+    monkeypatch.setattr(load_textbooks, "IDIOMS_MAPPING", {"Puter": "rm-puter", "Vallader": "rm-vallader"})
+    return tmp_path / "raw_data"
+
+
+def test_load_textbook_catalog_is_lazy_and_filterable(tmp_path, monkeypatch):
+    write_idiom_export(tmp_path, monkeypatch)
+
+    # cold: everything is built, and the catalog serves the built books
+    cold = load_textbooks.load_textbook_catalog(data_path=tmp_path / "raw_data")
+    assert len(cold) == 6
+
+    # warm: nothing is loaded until a book is accessed
+    loads = []
+    real_load_from_disk = textbook_catalog.load_from_disk
+    monkeypatch.setattr(textbook_catalog, "load_from_disk", lambda folder: loads.append(folder) or real_load_from_disk(folder))
+    catalog = load_textbooks.load_textbook_catalog(data_path=tmp_path / "raw_data")
+    assert set(catalog) == set(cold)
+    assert loads == []
+
+    subset = catalog.filter(idiom="rm-puter", grade=4, book_type="workbook")
+    assert list(subset) == ["/puter/klasse-4/arbeitsbuch-1/workbook"]
+    assert loads == []
+    tb = subset["/puter/klasse-4/arbeitsbuch-1/workbook"]
+    assert tb.hf_dataset["segmentExtractedText"] == ["Puter 4"]
+    assert len(loads) == 1
+    # the parent catalog shares the loaded book
+    assert catalog["/puter/klasse-4/arbeitsbuch-1/workbook"] is tb
+    assert len(loads) == 1
+    assert catalog.loaded_paths() == ["/puter/klasse-4/arbeitsbuch-1/workbook"]
+
+    assert len(catalog.filter(grade="4.1")) == 4
+    assert len(catalog.filter(book_type="teacher's commentary")) == 3
+    with pytest.raises(KeyError):
+        subset["/vallader/klasse-4/arbeitsbuch-1/workbook"]
+
+
+def test_parquet_corpus_cache_and_pushdown(tmp_path, monkeypatch):
+    data_path = write_idiom_export(tmp_path, monkeypatch)
+    expected = load_textbooks.load_textbooks(data_path=data_path)
+
+    cold = load_textbooks.load_textbooks(data_path=data_path, cache_format="parquet")
+    variant_dirs = [d for d in os.listdir(tmp_path / "cache") if (tmp_path / "cache" / d / "corpus.parquet").exists()]
+    assert len(variant_dirs) == 1
+    corpus = tmp_path / "cache" / variant_dirs[0] / "corpus.parquet"
+    # one zstd row group per book, with statistics
+    metadata = pq.ParquetFile(corpus).metadata
+    assert metadata.num_row_groups == len(expected) == 6
+    column = metadata.row_group(0).column(0)
+    assert column.compression == "ZSTD" and column.statistics is not None
+
+    # warm: loaded from the Parquet file without reading the export
+    monkeypatch.setattr(load_textbooks, "load_textbooks_meta", None)
+    warm = load_textbooks.load_textbooks(data_path=data_path, cache_format="parquet")
+    for textbooks in (cold, warm):
+        assert list(textbooks) == list(expected)
+        for path, tb in textbooks.items():
+            assert tb.idiom == expected[path].idiom and tb.grade_volume == expected[path].grade_volume
+            assert tb.hf_dataset.features == expected[path].hf_dataset.features
+            assert tb.hf_dataset.to_list() == expected[path].hf_dataset.to_list()
+
+    puter_4 = load_textbooks.load_corpus(idiom="rm-puter", grade=4, data_path=data_path)
+    assert sorted(puter_4) == ["/puter/klasse-4/arbeitsbuch-1/teachers_commentary", "/puter/klasse-4/arbeitsbuch-1/workbook"]
+    chapter = load_textbooks.load_corpus(filters=pc.field("chapterPath") == "/vallader/klasse-4/arbeitsbuch-1/sol",
+                                         data_path=data_path)
+    assert list(chapter) == ["/vallader/klasse-4/arbeitsbuch-1/teachers_commentary"]
+    assert chapter["/vallader/klasse-4/arbeitsbuch-1/teachers_commentary"].hf_dataset["segmentExtractedText"] == [
+        "Solution Vallader 4"]
+    assert load_textbooks.load_corpus(book_type="workbook", grade="5.1", data_path=data_path).keys() == {
+        "/puter/klasse-5/arbeitsbuch-1/workbook"}
+
+
+def touch_manifest_repeatedly(variant_dir, export_path):
+    from cache_utils import cached_export_fingerprint, touch_manifest
+
+    for _ in range(50):
+        touch_manifest(variant_dir, {"books": []})
+        cached_export_fingerprint(os.path.dirname(variant_dir), export_path)
+
+
+def test_concurrent_manifest_writers_do_not_collide(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    from cache_utils import read_manifest
+
+    variant_dir = str(tmp_path / "cache" / "variant")
+    export_path = tmp_path / "export.jsonl"
+    export_path.write_text("{}\n")
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(touch_manifest_repeatedly, variant_dir, str(export_path)) for _ in range(4)]
+        for future in futures:
+            future.result()
+    assert read_manifest(variant_dir)["books"] == []
+    assert not list((tmp_path / "cache").rglob("*.tmp"))
@@ -0,0 +1,52 @@
+import numpy as np
+
+from embed.onnx_backend import cosine_drift, last_token_pool, mean_pool
+
+
+def padded_batch(seed, lengths, dim=8, left_padding=False):
+    rng = np.random.default_rng(seed)
+    hidden = rng.normal(size=(len(lengths), max(lengths), dim)).astype(np.float32)
+    mask = np.zeros((len(lengths), max(lengths)), dtype=np.int64)
+    for row, length in enumerate(lengths):
+        if left_padding:
+            mask[row, max(lengths) - length:] = 1
+        else:
+            mask[row, :length] = 1
+    return hidden, mask
+
+
+def real_tokens(hidden, mask, row):
+    return hidden[row][mask[row].astype(bool)]
+
+
+def test_mean_pool_ignores_padding():
+    hidden, mask = padded_batch(0, [5, 2, 7])
+    pooled = mean_pool(hidden, mask)
+    for row in range(3):
+        assert np.allclose(pooled[row], real_tokens(hidden, mask, row).mean(axis=0), atol=1e-6)
+
+
+def test_last_token_pool_with_right_and_left_padding():
+    for left_padding in [False, True]:
+        hidden, mask = padded_batch(1, [5, 2, 7], left_padding=left_padding)
+        pooled = last_token_pool(hidden, mask)
+        for row in range(3):
+            assert np.array_equal(pooled[row], real_tokens(hidden, mask, row)[-1])
+
+
+def test_pooling_matches_unpadded_single_texts():
+    # a batch must pool to what each text gives on its own, as in the one-line-at-a-time embedding
+    hidden, mask = padded_batch(2, [4, 9, 1], left_padding=True)
+    for row in range(3):
+        alone = real_tokens(hidden, mask, row)[None]
+        alone_mask = np.ones(alone.shape[:2], dtype=np.int64)
+        assert np.allclose(mean_pool(hidden, mask)[row], mean_pool(alone, alone_mask)[0], atol=1e-6)
+        assert np.array_equal(last_token_pool(hidden, mask)[row], last_token_pool(alone, alone_mask)[0])
+
+
+def test_cosine_drift():
+    rng = np.random.default_rng(3)
+    reference = rng.normal(size=(50, 16))
+    assert cosine_drift(reference, reference * 3)["max"] < 1e-12
+    noisy = cosine_drift(reference, reference + rng.normal(scale=0.1, size=reference.shape))
+    assert 0 < noisy["mean"] <= noisy["p99"] <= noisy["max"] < 0.1
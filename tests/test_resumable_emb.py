@@ -0,0 +1,87 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the embed scripts import their sibling modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "embed"))
+
+from embed.emb_store import read_emb_header
+from embed.resumable_emb import ResumableEmbWriter, emb_file_complete, read_progress
+
+
+def vectors(start, stop, dim=4):
+    return np.arange(start * dim, stop * dim, dtype=np.float32).reshape(-1, dim)
+
+
+def test_interrupted_write_resumes_after_last_vector(tmp_path):
+    path = str(tmp_path / "rm-puter_text_overlaps.emb")
+    writer = ResumableEmbWriter(path, "cohere-v4", 10)
+    writer.write(vectors(0, 4))
+    assert not emb_file_complete(path, "cohere-v4", 10)
+
+    # the run dies halfway through the next vector
+    with open(path, "ab") as f:
+        vectors(4, 5)[:, :2].tofile(f)
+
+    writer = ResumableEmbWriter(path, "cohere-v4", 10)
+    assert writer.lines_done == 4 and writer.dim == 4
+    writer.write(vectors(4, 10))
+    assert writer.done
+    assert emb_file_complete(path, "cohere-v4", 10)
+    assert np.array_equal(np.fromfile(path, dtype=np.float32).reshape(10, 4), vectors(0, 10))
+    # the progress record is replaced by the header of the finished file
+    assert read_progress(path) is None
+    header = read_emb_header(path)
+    assert (header["model"], header["dim"], header["count"]) == ("cohere-v4", 4, 10)
+    assert ResumableEmbWriter(path, "cohere-v4", 10).done
+
+
+def test_vectors_written_after_the_last_record_are_kept(tmp_path):
+    path = str(tmp_path / "x.emb")
+    ResumableEmbWriter(path, "m", 6).write(vectors(0, 2))
+    with open(path, "ab") as f:
+        vectors(2, 3).tofile(f)
+    assert ResumableEmbWriter(path, "m", 6).lines_done == 3
+
+
+def test_other_model_or_legacy_truncated_file_is_rewritten(tmp_path):
+    path = str(tmp_path / "x.emb")
+    ResumableEmbWriter(path, "m", 6).write(vectors(0, 6))
+    assert emb_file_complete(path, "m", 6)
+    assert not emb_file_complete(path, "other", 6)
+    writer = ResumableEmbWriter(path, "other", 6)
+    assert writer.lines_done == 0
+
+    legacy = str(tmp_path / "legacy.emb")
+    vectors(0, 6).tofile(legacy)
+    assert emb_file_complete(legacy, "m", 6)
+    assert not emb_file_complete(legacy, "m", 6, expected_dim=8)
+    with open(legacy, "r+b") as f:
+        f.truncate(6 * 4 * 4 - 3)
+    assert not emb_file_complete(legacy, "m", 6)
+    assert ResumableEmbWriter(legacy, "m", 6).lines_done == 0
+
+
+def test_half_written_legacy_file_is_not_complete_at_the_model_dimension(tmp_path):
+    # half of the vectors of dimension 16 look like all of them at dimension 8
+    legacy = str(tmp_path / "legacy.emb")
+    vectors(0, 4, dim=16).tofile(legacy)
+    assert emb_file_complete(legacy, "cohere-v4", 8)
+    assert not emb_file_complete(legacy, "cohere-v4", 8, expected_dim=16)
+    assert emb_file_complete(legacy, "cohere-v4", 4, expected_dim=16)
+
+    # a finished file of another dimension is not complete either
+    path = str(tmp_path / "x.emb")
+    ResumableEmbWriter(path, "m", 6).write(vectors(0, 6))
+    assert emb_file_complete(path, "m", 6, expected_dim=4)
+    assert not emb_file_complete(path, "m", 6, expected_dim=8)
+
+
+def test_dimension_mismatch_fails(tmp_path):
+    path = str(tmp_path / "x.emb")
+    writer = ResumableEmbWriter(path, "m", 6)
+    writer.write(vectors(0, 2))
+    with pytest.raises(ValueError, match="dimension 8"):
+        writer.write(vectors(0, 2, dim=8))
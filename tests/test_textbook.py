@@ -0,0 +1,38 @@
+import random
+
+import pytest
+from datasets import Dataset
+
+from models.textbook import Textbook
+
+CHAPTERS = ["/rm/klasse-4/arbeitsbuch-1/1-x", "/rm/klasse-4/arbeitsbuch-1/11-x", "/rm/klasse-4/arbeitsbuch-1/2-y", ""]
+
+
+def make_textbook(seed):
+    rng = random.Random(seed)
+    paths = [rng.choice(CHAPTERS) + rng.choice(["", "/exercise-1", "/exercise-2"]) for _ in range(60)]
+    # chapters mostly come in runs, with a few stragglers
+    paths.sort(key=lambda p: (p.split("/")[-1] if rng.random() < 0.9 else ""))
+    ds = Dataset.from_dict({"chapterPath": paths, "sentenceExtractedText": [str(i) for i in range(len(paths))]})
+    return Textbook("rm-puter", "language", "4.1", "workbook", hf_dataset=ds)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chapter_name", ["1-x", "11-x", "2-y", "exercise-2", "missing"])
+def test_select_chapter_matches_filter(seed, chapter_name):
+    tb = make_textbook(seed)
+    expected = tb.hf_dataset.filter(lambda row: chapter_name in row["chapterPath"])
+    assert tb.select_chapter(chapter_name).to_list() == expected.to_list()
+
+
+def test_chapter_index_ranges_and_rebuild():
+    ds = Dataset.from_dict({"chapterPath": ["/a/1", "/a/1", "/a/2", "/a/1"]})
+    tb = Textbook("rm-puter", "language", "4.1", "workbook", hf_dataset=ds)
+    assert tb.chapter_index() == {"/a/1": [[0, 2], [3, 4]], "/a/2": [[2, 3]]}
+    assert tb.chapter_index() is tb.chapter_index()
+    assert tb.chapter_ranges("/a/") == [(0, 4)]
+    # a contiguous chapter is selected without an indices mapping
+    assert tb.select_chapter("/a/")._indices is None
+    tb.hf_dataset = Dataset.from_dict({"chapterPath": ["/b/1"]})
+    assert tb.chapter_index() == {"/b/1": [[0, 1]]}
+    assert tb == Textbook("rm-puter", "language", "4.1", "workbook", hf_dataset=tb.hf_dataset)
@@ -11,6 +11,7 @@ import unicodedata
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
+from embed.emb_store import open_emb
 from load_val_set import load_val_set
 
 
@@ -45,27 +46,20 @@ def get_args():
 
 
 def get_emb(model, idiom, chapter, input):
-    """Function to read in embeddings and reshape them to fit the overlap file; code adapted from vecalign https://github.com/thompsonb/vecalign/blob/master/dp_utils.py"""
-    line_embeddings = np.fromfile(
+    """Function to read in embeddings (memory-mapped and checked against the overlap file) and map them to the segments; code adapted from vecalign https://github.com/thompsonb/vecalign/blob/master/dp_utils.py"""
+    overlaps_path = f"/projects/text/romansh/textbooks/val_overlaps/align_02/{chapter}/rm-{idiom}_{input}_overlaps.txt"
+    line_embeddings = open_emb(
         f"/projects/text/romansh/textbooks/val_embeddings/align_02/{model}/{chapter}/rm-{idiom}_{input}_overlaps.emb",
-        dtype=np.float32,
-        count=-1,
+        overlaps_path=overlaps_path,
+        model=model,
     )
 
     sent2line = {}
-    with open(
-        f"/projects/text/romansh/textbooks/val_overlaps/align_02/{chapter}/rm-{idiom}_{input}_overlaps.txt",
-        "r",
-        encoding="utf-8",
-    ) as f:
+    with open(overlaps_path, "r", encoding="utf-8") as f:
         for ii, line in enumerate(f):
 
             sent2line[line.strip()] = ii
 
-    embedding_size = line_embeddings.size // len(sent2line)
-
-    line_embeddings.resize(line_embeddings.shape[0] // embedding_size, embedding_size)
-
     output = {}
     text_file = "text" if input in ["text", "embconcat"] else "html"
     with open(